@@ -1,17 +1,18 @@
 import os
-import json
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+import serializer
 
 # Load the JSON file
-with open("courses.json", "r", encoding="utf-8") as file:
-    data = json.load(file)
+data = serializer.load("courses.json")
 
 # Count the number of entries in the "list_of_courses"
 number_of_courses = len(data["list_of_courses"])
 
 print(f"Number of courses in courses: {number_of_courses}")
 
-with open("not_courses.json", "r", encoding="utf-8") as file:
-    Notdata = json.load(file)
+Notdata = serializer.load("not_courses.json")
 
 number_of_not_courses = len(Notdata)
 
@@ -1,9 +1,31 @@
-import subprocess
 import os
 import asyncio
-import json
 import sys
-import random
+import uuid
+
+# Shared helpers live alongside the stage scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+import serializer
+from unit_freshness import UnitFetchPlanner
+from rate_control import get_controller, read_statuses, PAGE_HOST
+import profiling
+from profiling import profile_stage
+import download_pdf
+from http_client import HTTPClient
+from enrichment import compact_enrichment
+from offerings import mark_pipeline_run
+
+# Stage runs are paced by the adaptive rate controller instead of fixed sleeps. Each stage has its own
+# key since a run's latency includes starting the script, not only the request it makes.
+rates = get_controller()
+# Identifies this run to the stage scripts; PCI writes it into courses_delta.json
+RUN_ID = os.environ.setdefault("QUT_RUN_ID", uuid.uuid4().hex)
+# With QUT_PROFILE set, the stage scripts' profiles end up in one summary of the run
+profiling.aggregate_run_at_exit()
+# EUI writes offerings during the run, so offerings.py refresh does not compact that store meanwhile
+mark_pipeline_run()
+# Times a script is run again after its page asked us to back off (429/503)
+BACKOFF_RETRIES = int(os.environ.get("QUT_BACKOFF_RETRIES", 2))
 
 
 # Async function for running scripts
@@ -32,6 +54,11 @@ async def run_script(script_name):
 
 # Function to run a script with arguments
 async def run_script_with_args(script_name, *args):
+    ok, _ = await run_script_with_output(script_name, *args)
+    return ok
+
+# Same as run_script_with_args, also returning what the script printed
+async def run_script_with_output(script_name, *args):
     # Run subprocess with arguments
     process = await asyncio.create_subprocess_exec(
         # For Linux
@@ -44,34 +71,80 @@ async def run_script_with_args(script_name, *args):
 
     # Wait for process to finish and capture output
     stdout, stderr = await process.communicate()
+    output = stdout.decode(errors='replace')
 
     # Check the return code to determine if the script ran successfully
     if process.returncode == 0:
         print(f"Script {script_name} completed successfully with args: {args}")
-        print(stdout.decode(errors='replace'))
+        print(output)
     else:
         print(f"Script {script_name} failed with error code {process.returncode} and args: {args}")
         print(stderr.decode(errors='replace'))
+    return process.returncode == 0, output
+
+# Run a stage script that fetches one page of `host`. The page request waits for the host's slot, which
+# is shared with every other process and never closer than QUT_MIN_PAGE_DELAY to the last one. The
+# script reports the page's status, so a 429/503 backs the host off and the script runs again once
+# the cooldown is over. Script runs are also paced per stage; a failed run counts as an error.
+async def run_paced(script_name, *args, host=PAGE_HOST):
+    stage = "stage:" + os.path.splitext(os.path.basename(script_name))[0]
+    for attempt in range(BACKOFF_RETRIES + 1):
+        async with rates.slot(stage, max_concurrency=1) as outcome:
+            await rates.wait(host)
+            ok, output = await run_script_with_output(script_name, *args)
+            outcome["error"] = not ok
 
-# Check if courses.json exists. If it doesn't then get it
+        backed_off = False
+        for reported in read_statuses(output):
+            backed_off = rates.record(reported["host"], reported["latency"], status=reported["status"],
+                                      error=reported["error"], retry_after=reported["retry_after"]) or backed_off
+        if not backed_off:
+            return ok
+        if attempt < BACKOFF_RETRIES:
+            print(f"Running {script_name} {args} again after backing off")
+    return False
+
+# Check if courses.json exists. If it doesn't (or --refresh or --skip-unchanged is passed) then get it
 async def check_and_run():
     try:
-        if os.path.exists("courses.json"):
+        if os.path.exists("courses.json") and "--refresh" not in sys.argv and "--skip-unchanged" not in sys.argv:
             print("active_courses_list.txt already exists")
         else:
-            print("active_courses_list.txt does not exist. Fetching the list...")
+            print("Fetching the active course list...")
             await run_script("scripts/PCI.py")
     except Exception as e:
         print(f"An error occurred while checking for courses.json: {e}")
         return
 
+# Returns False when the course list refresh of this run found no change. A delta left by an earlier
+# run (PCI failed or did not run this time) says nothing about the current list, so it counts as a change.
+def course_list_changed():
+    if not os.path.exists("courses_delta.json"):
+        return True
+    delta = serializer.load("courses_delta.json")
+    if delta.get('run_id') != RUN_ID:
+        print("Course list was not refreshed in this run, not skipping")
+        return True
+    print(f"Course list delta: {len(delta['added'])} added, {len(delta['removed'])} removed")
+    return delta['changed']
+
+# --skip-unchanged: the run is skipped only when the course list is unchanged and so is every course PDF,
+# checked with one HEAD request per course against the validators of the last download
+async def nothing_changed():
+    if course_list_changed():
+        return False
+    changed = await download_pdf.changed_pdfs(download_pdf.course_pairs())
+    if changed:
+        print(f"{len(changed)} course PDFs changed, not skipping")
+        return False
+    return True
+
 # Function to pull course information from the JSON file and plug into extract course information script
 async def pull_course_information():
 
     try:
         # Open and load the JSON file
-        with open("courses.json", "r", encoding="utf-8") as file:
-            data = json.load(file)  # Load JSON data into a Python object (list or dict)
+        data = serializer.load("courses.json")  # Load JSON data into a Python object (list or dict)
 
         # Loop through the JSON data to obtain course Code. Then feed it into the script
         for course in data['list_of_courses']:
@@ -79,8 +152,7 @@ async def pull_course_information():
             course_title = course['course_title']
 
             # Pass course information as arguments to the ECI script
-            await run_script_with_args("scripts/ECI.py", course_code, course_title)
-            await asyncio.sleep(random.randint(1, 5))  # Random sleep between 1 and 5 seconds
+            await run_paced("scripts/ECI.py", course_code, course_title)
     except Exception as e:
         print("An error occurred while pulling course information:", e)
 
@@ -89,70 +161,146 @@ async def pull_unitCode_from_course():
     course_folder = "./courses"
 
     # Check if the course folder exists
-    if os.path.exists(course_folder):
-        # Process each file in folder
-        for filename in os.listdir(course_folder):
-            # Construct the full file path
-            file_path = os.path.join(course_folder, filename)
-            # Check if the file is a JSON file
-            if filename.endswith(".json") and os.path.isfile(file_path):
-                print(f"Processing file: {file_path}")
-                # Open and load the JSON file
-                with open(file_path, "r", encoding="utf-8") as file:
-                    try:
-                        
-                        course = json.load(file)
-                        course_code = course['course_code']
-                        course_id = course['identifier']
-
-                        # Download course pdf to extract unitCode
-                        await run_script_with_args("scripts/download_pdf.py", course_code, course_id)
-                        await asyncio.sleep(random.randint(1, 5))  # Random sleep between 1 and 5 seconds
-                        
-                        # Extract information about course semesters
-                        await run_script_with_args("scripts/analyze_pdf.py", course_code)
-                        await asyncio.sleep(random.randint(1, 5))  # Random sleep between 1 and 5 seconds
-
-                        # Extract Unit Code
-                        await run_script_with_args("scripts/EUFC.py", course_code, course_id)
-
-                    except json.JSONDecodeError as e:
-                        print(f"Error reading JSON file {file_path}: {e}")
-                        continue
-    else:
+    if not os.path.exists(course_folder):
         print(f"Course folder '{course_folder}' does not exist.")
         return
 
+    # Refresh every course PDF in one burst; unchanged PDFs are not downloaded again
+    courses = download_pdf.course_pairs(course_folder)
+    results = await download_pdf.download_all(courses)
+
+    for course_code, course_id in courses:
+        result = results.get(course_code)
+        if result is None:
+            continue
+        # An unchanged PDF was already analysed, unless its output is missing
+        if result == "unchanged" and os.path.exists(f"./course_to_unit/{course_code}.json"):
+            continue
+        # Extract Unit Code, course semesters and the unit guide from a single parse of the PDF
+        await run_script_with_args("scripts/EUFC.py", course_code, course_id)
+
 # Function to pull unit information from unit code website
 async def pull_unit_information():
 
+    planner = UnitFetchPlanner()
     try:
         # Open and load the JSON file
-        with open("units.json", "r", encoding="utf-8") as file:
-            data = json.load(file)  # Load JSON data into a Python object (list or dict)
-        
+        data = serializer.load("units.json")  # Load JSON data into a Python object (list or dict)
+
         for unitCode in data['unitCodes']:
+            # Skip units fetched recently whose courses' PDFs have not changed
+            if not planner.should_fetch(unitCode):
+                print(f"Unit {unitCode} is up to date, skipping")
+                continue
 
             # Pass course information as arguments to the script
-            await run_script_with_args("scripts/EUI.py", unitCode)
-            await asyncio.sleep(2)
+            await run_paced("scripts/EUI.py", unitCode)
     except Exception as e:
         print("An error occurred while pulling unit information:", e)
+    finally:
+        planner.close()
+
+# Streaming pipeline: every stage hands each item to the next stage as soon as it is done with it,
+# so PDFs are downloaded and units fetched while the remaining courses are still being scraped.
+async def stream_courses(pdf_queue):
+    try:
+        data = serializer.load("courses.json")
+        for course in data['list_of_courses']:
+            course_code = course['courseCode']
+            await run_paced("scripts/ECI.py", course_code, course['course_title'])
+
+            # Hand the course to the PDF stage as soon as ECI has found its identifier
+            course_file = f"./courses/{course_code}.json"
+            if os.path.exists(course_file):
+                course_id = serializer.load(course_file).get('identifier')
+                if course_id:
+                    await pdf_queue.put((course_code, course_id))
+    except Exception as e:
+        print("An error occurred while streaming course information:", e)
+    finally:
+        await pdf_queue.put(None)
+
+async def stream_pdfs(pdf_queue, unit_queue):
+    planner = UnitFetchPlanner()  # Units shared between courses are only fetched once per run
+    validators = download_pdf.load_validators()
+    os.makedirs(download_pdf.PDF_DIR, exist_ok=True)
+    try:
+        async with HTTPClient() as client:
+            while True:
+                item = await pdf_queue.get()
+                if item is None:
+                    break
+                course_code, course_id = item
+                result = await download_pdf.download_pdf(client, course_code, course_id, validators)
+                if result is None:
+                    continue
+                relationship_file = f"./course_to_unit/{course_code}.json"
+                if result == "downloaded":
+                    download_pdf.save_validators(validators)
+                if result == "downloaded" or not os.path.exists(relationship_file):
+                    await run_script_with_args("scripts/EUFC.py", course_code, course_id)
+
+                # Push the units of this course that need fetching straight into the unit stage
+                if os.path.exists(relationship_file):
+                    unit_codes = serializer.load(relationship_file).get('unitCodes', [])
+                    planner.add_course(course_code, unit_codes)
+                    for unitCode in unit_codes:
+                        if planner.should_fetch(unitCode):
+                            await unit_queue.put(unitCode)
+    except Exception as e:
+        print("An error occurred while streaming PDFs:", e)
+    finally:
+        planner.close()
+        await unit_queue.put(None)
+
+async def stream_units(unit_queue):
+    while True:
+        unitCode = await unit_queue.get()
+        if unitCode is None:
+            break
+        await run_paced("scripts/EUI.py", unitCode)
+
+async def stream_pipeline():
+    await check_and_run()
+    if "--skip-unchanged" in sys.argv and await nothing_changed():
+        print("Course list and course PDFs unchanged, nothing to do")
+        return
+
+    pdf_queue = asyncio.Queue()
+    unit_queue = asyncio.Queue()
+    with profile_stage("stream_pipeline"):
+        await asyncio.gather(
+            stream_courses(pdf_queue),
+            stream_pdfs(pdf_queue, unit_queue),
+            stream_units(unit_queue),
+        )
+    compact_enrichment()
 
 # Main script
 async def main():
     
     # # # Check if there is a course json file with all the course information.
     await check_and_run()
+    if "--skip-unchanged" in sys.argv and await nothing_changed():
+        print("Course list and course PDFs unchanged, nothing to do")
+        return
 
     # # # Run the script to pull course information
-    await pull_course_information()
+    with profile_stage("pull_course_information"):
+        await pull_course_information()
 
     # # # Run the script to pull unit information from the PDF
-    await pull_unitCode_from_course()
+    with profile_stage("pull_unitCode_from_course"):
+        await pull_unitCode_from_course()
+    # Every PDF analysed appended a new copy of its course's enrichment record
+    compact_enrichment()
 
     # Run script to pull unit information from unit code website
-    await pull_unit_information()
+    with profile_stage("pull_unit_information"):
+        await pull_unit_information()
 
-# Run the main function
-asyncio.run(main())
\ No newline at end of file
+# Run the main function. Pass --stream to overlap the stages instead of running them one after another.
+if "--stream" in sys.argv:
+    asyncio.run(stream_pipeline())
+else:
+    asyncio.run(main())
\ No newline at end of file
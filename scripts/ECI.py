@@ -1,19 +1,37 @@
 # The purpose of this script is to pull information from each course page.
 import sys
 import scrapy
-from scrapy_splash import SplashRequest
 from scrapy.crawler import CrawlerProcess
 from datetime import datetime
 import re
 import json
-import unicodedata
 import os
+from record_store import open_store, writes_json, writes_packed
+import serializer
+from text_utils import normalize_text
+from splash_render import page_request, splash_settings
+from search_index import index_record
+from output_writer import stage_writer
+from page_changes import page_hash, unchanged_course, mark_verified, record_page
+from profiling import profile_item
+from rate_control import report_response, report_error, RETRY_HTTP_CODES, BACKOFF_STATUSES
+from records import Course, RecordError
+
+
+def course_record_exists(course_code):
+    if writes_json() and not os.path.exists(f"./courses/{course_code}.json"):
+        return False
+    if writes_packed() and course_code not in open_store("courses"):
+        return False
+    return True
 
 
 class MySpider(scrapy.Spider):
     name = "course_spider"
     custom_settings = {
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36',
+        # 429/503 are not retried here: main.py reads the reported status and backs off instead
+        'RETRY_HTTP_CODES': RETRY_HTTP_CODES,
     }
 
     def __init__(self, courseLink=None, *args, **kwargs):
@@ -22,37 +40,50 @@ class MySpider(scrapy.Spider):
 
     def start_requests(self):
         if self.courseLink:
-            yield SplashRequest(
+            # Rendered only when a Splash pool is configured, and then only until the course tabs appear
+            yield page_request(
                 url=self.courseLink,
-                callback=self.parse,
+                selector='#course-tab-wrapper',
+                callback=self.profiled_parse,
                 errback=self.handle_error,
-                args={'wait': 10},  # Adjust wait time if needed
             )
         else:
             self.logger.error("No course link provided.")
 
+    def profiled_parse(self, response):
+        # parse() wrapped in the opt-in profiler (QUT_PROFILE), one item per course page.
+        # The page's status goes to main.py first, it counts towards the host's rate.
+        report_response(response)
+        with profile_item("ECI", self.courseLink):
+            yield from self.parse(response)
+
     @staticmethod
     def normalize_text(text):
         # Normalize text by replacing special characters and normalizing Unicode
-
-        text = text.replace('’', "'")  # right single quote
-        text = text.replace('‘', "'")  # left single quote
-        text = text.replace('“', '"')  # left double quote
-        text = text.replace('”', '"')  # right double quote
-        text = unicodedata.normalize('NFKC', text)  # normalize Unicode
-        return text
+        return normalize_text(text)
 
     def handle_error(self, failure):
         # Handle errors during the request
-        print(f"Error occurred: {failure.value.response.status} for URL: {failure.request.url}")
-        status_code = failure.value.response.status
+        response = getattr(failure.value, "response", None)
+        if response is None:
+            # Timeout, DNS failure or refused connection: not a missing course, so nothing is recorded
+            report_error(failure.request.url)
+            print(f"Error occurred: {failure.getErrorMessage()} for URL: {failure.request.url}")
+            return
+        report_response(response)
+        if response.status in BACKOFF_STATUSES:
+            # Not a missing course: main.py backs off and runs the course again
+            print(f"Asked to back off ({response.status}) for URL: {failure.request.url}")
+            return
+        print(f"Error occurred: {response.status} for URL: {failure.request.url}")
+        status_code = response.status
         if status_code == 404:
             error_message = "Website not found"
         else:
             error_message = f"HTTP error {status_code}"
 
         self.handle_missing_course(
-            url=failure.value.response.url,
+            url=response.url,
             error_message=error_message,
             missing_fields=["course_name", "course_code"]
         )
@@ -69,15 +100,13 @@ class MySpider(scrapy.Spider):
             missing_course["missing_fields"] = missing_fields
 
         try:
-            with open("not_courses.json", "r", encoding="utf-8") as f:
-                not_courses = json.load(f)
+            not_courses = serializer.load("not_courses.json")
         except (FileNotFoundError, json.JSONDecodeError):
             not_courses = []
 
         not_courses.append(missing_course)
 
-        with open("not_courses.json", "w", encoding="utf-8") as f:
-            json.dump(not_courses, f, indent=4)
+        serializer.dump(not_courses, "not_courses.json", indent=4)
 
         print(f"Missing or invalid course data for URL: {url}")
 
@@ -95,6 +124,17 @@ class MySpider(scrapy.Spider):
                 )
                 return  # Exit early if it's not a course page
 
+            # Skip parsing and writing when the parts of the page we read are the same as last time
+            # and the record they produced is still there; only the verification time is updated.
+            # A selector added or changed below must also go into page_changes.HASHED_REGIONS.
+            page_url = self.courseLink or response.url
+            content_hash = page_hash(response)
+            known_code = unchanged_course(page_url, content_hash)
+            if known_code and course_record_exists(known_code):
+                mark_verified(page_url)
+                print(f"Course page for {known_code} unchanged, skipped")
+                return
+
             # Extract course name
             course_name = response.xpath('//span[@data-course-map-key="courseTitle"]/text()').get()
             course_name = course_name.strip() if course_name else None
@@ -158,7 +198,7 @@ class MySpider(scrapy.Spider):
 
             # Extract JSON-LD and get courseCode + identifier
             json_ld = response.xpath('//script[@type="application/ld+json"]/text()').get()
-            identifier = json.loads(json_ld).get('identifier', None) if json_ld else None
+            identifier = serializer.loads(json_ld).get('identifier', None) if json_ld else None
 
             # Build the extracted data dictionary
             extracted_data = {
@@ -177,19 +217,44 @@ class MySpider(scrapy.Spider):
                 'day_obtained': datetime.now().strftime('%Y-%m-%d'),
             }
 
+            # Only records that pass validation are stored as courses; the rest are saved apart
+            # with the reason, so the page is not lost
+            valid = True
+            try:
+                extracted_data = Course.from_dict(extracted_data).to_dict()
+            except RecordError as e:
+                print(f"Course page {self.courseLink} failed validation: {e}")
+                extracted_data["validation_error"] = str(e)
+                valid = False
+
             # Save the extracted data to a separate JSON file for each course
-            if course_code:
+            if not valid:
+                output_file = f"./courses_unknown/{re.sub(r'[^A-Za-z0-9_-]', '_', course_code or course_name or 'unknown')}.json"
+                course_code = None
+            elif course_code:
                 output_file = f"./courses/{course_code}.json"
             else:
                 output_file = f"./courses/{course_name.replace(' ', '_').lower()}.json"
 
             # Write extracted data into a JSON object
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(extracted_data, f, indent=4, ensure_ascii=False)
+            if writes_json() or not valid:
+                writer = stage_writer("courses")
+                writer.write(output_file, extracted_data)
+                writer.flush()
+                print(f"Data extracted and saved to {output_file}")
+
+            # Append the record to the packed course store
+            if writes_packed() and course_code:
+                open_store("courses").put(extracted_data)
+                print(f"Data extracted and packed under {course_code}")
+
+            # Keep the full-text search index in step with the stored record
+            if course_code:
+                index_record("course", extracted_data)
+                record_page(page_url, course_code, content_hash)
 
             # Yield the extracted data as output
             yield extracted_data
-            print(f"Data extracted and saved to {output_file}")
 
         except Exception as e:
             # Handle unexpected errors
@@ -218,6 +283,6 @@ if __name__ == "__main__":
 
 
     # Run the spider with the course_link argument
-    process = CrawlerProcess()
+    process = CrawlerProcess(settings=splash_settings())
     process.crawl(MySpider, courseLink=courseLink)
     process.start()
\ No newline at end of file
@@ -1,80 +1,112 @@
-import fitz  # PyMuPDF
-import json
-import re
 import sys
 import os
 from datetime import datetime
+import serializer
+from text_utils import UNIT_CODE_CELL_PATTERN
+from unit_freshness import record_pdf
+from pdf_layout import load_layout, table_rows, pdf_sha256
+from analyze_pdf import semester_blocks_from_texts
+from extract_unitCodes import units_by_semester_from_rows, save_unit_guide
+from output_writer import stage_writer
+from profiling import profile_item
+from records import CourseUnitLink
 
 def extract_unit_code(pdf_path):
     #Extracts unique unit codes from tables in the PDF.
+    return unit_codes_from_rows(table_rows(pdf_path))
 
-    # Open the PDF file
-    doc = fitz.open(pdf_path)
-
-    # Regular expression to match unit codes (e.g., ABB123)
-    unit_code_pattern = re.compile(r'^[A-Z]{3}\d{3}$')
+def unit_codes_from_rows(rows):
+    #Extracts unique unit codes from already extracted table rows.
 
     unique_unit_codes = set()  # To track unique unit codes globally
 
-    # Iterate through each page in the PDF
-    for page in doc:
-        tables = page.find_tables()
-        # If no tables are found, skip to the next page
-        if not tables:
-            continue
-        # Iterate through each table found on the page and extract data according to the pattern
-        for table in tables:
-            table_data = table.extract()
-            for row in table_data:
-                cleaned_row = [str(cell).strip() if cell else "" for cell in row]
-                if cleaned_row[0] and unit_code_pattern.match(cleaned_row[0]):
-                    unit_code = cleaned_row[0]
-                    unique_unit_codes.add(unit_code)  # Add only the unit code
-
-    doc.close()
+    # Iterate through every table row of the PDF and extract data according to the pattern
+    for cleaned_row in rows:
+        if cleaned_row and cleaned_row[0] and UNIT_CODE_CELL_PATTERN.match(cleaned_row[0]):
+            unit_code = cleaned_row[0]
+            unique_unit_codes.add(unit_code)  # Add only the unit code
+
     return list(unique_unit_codes)  # Convert the set to a list
 
-def save_units_to_json(course_code, new_unit_codes, course_id, output_json, preserve_relationship=False):
+def save_units_to_json(course_code, new_unit_codes, course_id, output_json, preserve_relationship=False, writer=None):
     #Appends new unit codes to an existing JSON file or creates a new one if it doesn't exist.
     #Stores the unit codes as a simple list of strings.
     
-    # Load existing data if the file exists
-    if os.path.exists(output_json):
-        with open(output_json, 'r', encoding='utf-8') as f:
-            existing_data = json.load(f)
+    # Locked, since parallel workers (worker.py, pdf_pool.py) merge into the same units.json
+    with serializer.locked(output_json):
+        # Load existing data if the file exists
+        if os.path.exists(output_json):
+            existing_data = serializer.load(output_json)
             existing_unit_codes = set(
                 entry["unitCode"] if isinstance(entry, dict) else entry
                 for entry in existing_data.get("unitCodes", []))
-    else:
-        existing_data = {}
-        existing_unit_codes = set()
+        else:
+            existing_data = {}
+            existing_unit_codes = set()
+
+        # Add new unit codes to the existing set
+        updated_unit_codes = existing_unit_codes.union(new_unit_codes)
+
+        # Build the JSON structure
+        if preserve_relationship:
+            # Retain 'source', 'day_obtained' and the units found in this course's PDF
+            updated_data = CourseUnitLink(
+                course_code=course_code,
+                unit_codes=list(new_unit_codes),
+                source=f"https://pdf.courses.qut.edu.au/coursepdf/qut_{course_code}_{course_id}_dom_cms_unit.pdf",
+                day_obtained=datetime.now().strftime('%Y-%m-%d'),
+            ).to_dict()
+        else:
+            # Save the full data with unit codes
+            updated_data = {
+                "unitCodes": sorted(updated_unit_codes)
+            }
+
+        # Save the updated data back to the JSON file, through the stage writer when one is given
+        # (the caller flushes it and reports the write)
+        if writer is not None:
+            writer.write(output_json, updated_data, indent=4)
+        else:
+            serializer.dump(updated_data, output_json, indent=4)
+            print(f"Data extracted and saved to {output_json}")
+
+
+def process_course_pdf(course_code, course_id, update_units_json=True):
+    # Extract unit codes, semester blocks and the unit guide of one course from a single parse of its PDF.
+    # Returns the unit codes. Callers that process many PDFs in parallel pass update_units_json=False
+    # and merge the codes into units.json themselves, so the shared file is written by one process.
+    pdf_path = f"./pdf/{course_code}.pdf"
+    output_json = f"units.json"
+    output_json_preserveRelationship = f"./course_to_unit/{course_code}.json"
+    output_json_unitGuide = f"./course_to_unit/{course_code}_unitGuide.json"
 
-    # Add new unit codes to the existing set
-    updated_unit_codes = existing_unit_codes.union(new_unit_codes)
-    
-    # Build the JSON structure
-    if preserve_relationship:
-        # Only retain 'source' and 'day_obtained'
-        updated_data = {
-            "source": f"https://pdf.courses.qut.edu.au/coursepdf/qut_{course_code}_{course_id}_dom_cms_unit.pdf",
-            "day_obtained": datetime.now().strftime('%Y-%m-%d'),
-
-        }
-    else:
-        # Save the full data with unit codes
-        updated_data = {
-            "unitCodes": sorted(updated_unit_codes)
-        }
-
-    # Save the updated data back to the JSON file
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(updated_data, f, indent=4)
-
-    print(f"Data extracted and saved to {output_json}")
+    # Remember the PDF's hash so units of changed courses are refetched
+    if record_pdf(course_code, pdf_path, sha256=pdf_sha256(pdf_path)):
+        print(f"PDF for {course_code} is new or has changed")
 
-    
+    # Parse the PDF once, every extractor below works from the same cached layout
+    layout = load_layout(pdf_path)
+    rows = [row for page in layout for row in page["rows"]]
+
+    # Extract unit codes from the PDF
+    unit_codes = unit_codes_from_rows(rows)
 
+    # Save or append the unit codes to the JSON file
+    if update_units_json:
+        save_units_to_json(course_code, unit_codes, course_id, output_json)
+    writer = stage_writer("course_to_unit")
+    save_units_to_json(course_code, unit_codes, course_id, output_json_preserveRelationship, preserve_relationship=True, writer=writer)
+
+    # Map the units to semesters. The semester blocks are found in the page texts of the same
+    # parse, so analyze_pdf does not need to open the PDF separately.
+    semester_blocks = semester_blocks_from_texts([page["text"] for page in layout])
+    unit_guide = units_by_semester_from_rows(rows, semester_blocks)
+    save_unit_guide(course_code, unit_guide, output_json_unitGuide, semester_blocks=semester_blocks, writer=writer)
 
+    # Both course files are committed together before the course counts as processed
+    writer.flush()
+    print(f"Data extracted and saved to {output_json_preserveRelationship} and {output_json_unitGuide}")
+    return unit_codes
 
 
 # Main script
@@ -82,13 +114,5 @@ if __name__ == "__main__":
     course_code = sys.argv[1].upper()
     course_id = sys.argv[2]
 
-    pdf_path = f"./pdf/{course_code}.pdf"
-    output_json = f"units.json"
-    output_json_preserveRelationship = f"./course_to_unit/{course_code}.json"
-
-    # Extract unit codes from the PDF
-    unit_codes = extract_unit_code(pdf_path)
-
-    # Save or append the unit codes to the JSON file
-    save_units_to_json(course_code, unit_codes, course_id, output_json)
-    save_units_to_json(course_code, unit_codes, course_id, output_json_preserveRelationship, preserve_relationship=True)
\ No newline at end of file
+    with profile_item("EUFC", course_code):
+        process_course_pdf(course_code, course_id)
@@ -1,21 +1,30 @@
 # The purpose of this script is to pull information from the each course information.
 import sys
 import scrapy
-from scrapy_splash import SplashRequest
 from scrapy.crawler import CrawlerProcess
 import subprocess
 from datetime import datetime
 import re
-import json
-import unicodedata
 import pdfplumber
-import requests 
+import serializer
+from record_store import open_store, writes_json, writes_packed
+from text_utils import normalize_text, find_unit_codes, remove_or_words, parse_prerequisites
+from unit_freshness import mark_unit_fetched
+from search_index import index_record
+from output_writer import stage_writer
+from offerings import fetch_offerings_sync
+from profiling import profile_item
+from rate_control import report_response, report_error, RETRY_HTTP_CODES, BACKOFF_STATUSES
+from records import Unit, RecordError
+from splash_render import page_request, splash_settings
 
 
 class MySpider(scrapy.Spider):
     name = "unit_spider"
     custom_settings = {
         'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36',
+        # 429/503 are not retried here: main.py reads the reported status and backs off instead
+        'RETRY_HTTP_CODES': RETRY_HTTP_CODES,
     }
     def __init__(self, unitLink = None, unitCode = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -25,33 +34,68 @@ class MySpider(scrapy.Spider):
     
     def start_requests(self):
         if self.unitLink:
-            yield SplashRequest(
+            # Rendered only when a Splash pool is configured, and then only until the unit details appear
+            yield page_request(
                 url=self.unitLink,
-                callback=self.parse,
-                errback=self.handle_error, 
-                args={'wait': 10},  
+                selector='dl',
+                callback=self.profiled_parse,
+                errback=self.handle_error,
             )
         else:
             print("No Unit link provided.")
     
+    def profiled_parse(self, response):
+        # parse() wrapped in the opt-in profiler (QUT_PROFILE), one item per unit page.
+        # The page's status goes to main.py first, it counts towards the host's rate.
+        report_response(response)
+        with profile_item("EUI", self.unitCode):
+            yield from self.parse(response)
+
     @staticmethod
     def normalize_text(text):
         # Replace smart quotes and other typographic characters with ASCII equivalents
-        text = text.replace('’', "'")  # right single quote
-        text = text.replace('‘', "'")  # left single quote
-        text = text.replace('“', '"')  # left double quote
-        text = text.replace('”', '"')  # right double quote
-        text = unicodedata.normalize('NFKC', text)  # normalize Unicode
-        return text
+        return normalize_text(text)
 
     def handle_error(self, failure):
-        #Log the error and add the unit to not_unit
-            self.handle_missing_unit(
-        url=failure.value.response.url,
-        error_message=f"HTTP error {failure.value.response.status}",
-        missing_fields=["unit_code"]
-    )
-            
+        #Log the error and add the unit to not_units.json
+        response = getattr(failure.value, "response", None)
+        if response is None:
+            # Timeout, DNS failure or refused connection: not a missing unit, so nothing is recorded
+            report_error(failure.request.url)
+            print(f"Error occurred: {failure.getErrorMessage()} for URL: {failure.request.url}")
+            return
+        report_response(response)
+        if response.status in BACKOFF_STATUSES:
+            # Not a missing unit: main.py backs off and runs the unit again
+            print(f"Asked to back off ({response.status}) for URL: {failure.request.url}")
+            return
+        self.handle_missing_unit(
+            url=response.url,
+            error_message=f"HTTP error {response.status}",
+            missing_fields=["unit_code"]
+        )
+
+    def handle_missing_unit(self, url, error_message, missing_fields=None):
+        #Records units whose page could not be fetched in `not_units.json`, like ECI's not_courses.json
+        missing_unit = {
+            "url": url,
+            "unitCode": self.unitCode,
+            "error": error_message,
+        }
+        if missing_fields:
+            missing_unit["missing_fields"] = missing_fields
+
+        try:
+            not_units = serializer.load("not_units.json")
+        except (FileNotFoundError, ValueError):
+            not_units = []
+
+        not_units.append(missing_unit)
+
+        serializer.dump(not_units, "not_units.json", indent=4)
+
+        print(f"Missing or invalid unit data for URL: {url}")
+
     def clean_prerequisites(self, prerequisites):
         if not prerequisites:
             return None
@@ -59,11 +103,8 @@ class MySpider(scrapy.Spider):
         # Extract all text, including links and plain text
         prerequisites = prerequisites.strip()
 
-        # Remove the word "or" from the prerequisites
-        prerequisites = re.sub(r'\bor\b', '', prerequisites, flags=re.IGNORECASE)
-
-        # Normalize whitespace
-        prerequisites = re.sub(r'\s+', ' ', prerequisites).strip()
+        # Remove the word "or" from the prerequisites and normalize whitespace
+        prerequisites = remove_or_words(prerequisites)
 
         return prerequisites if prerequisites else None
 
@@ -81,32 +122,9 @@ class MySpider(scrapy.Spider):
         return equivalents if equivalents else None
 
     def fetch_offerings_json(self, unit_code):
-   
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
-        }
-
-        # You can customize the years list or default to the current year
-        years = [datetime.now().year]
-        year_str = ",".join(map(str, years))
-        url = f"https://www.qut.edu.au/study/unit/unit-sorcery/courseloop-subject-offerings?unitCode={unit_code}&years={year_str}"
-
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                outlines = response.json()
-                if outlines:
-                    print(f"Fetched {len(outlines)} offerings for {unit_code}")
-                    return outlines
-                else:
-                    print.warning(f"No offerings found for {unit_code} in {year_str}")
-                    return []
-            else:
-                print.error(f"Failed to fetch offerings for {unit_code}: HTTP {response.status_code}")
-                return []
-        except Exception as e:
-            print.error(f"Error fetching offerings for {unit_code}: {str(e)}")
-            return []
+        # This year's offerings come from the offerings store, which fetches them only when its copy
+        # is stale; other years are kept current by scripts/offerings.py without re-crawling units
+        return fetch_offerings_sync(unit_code, datetime.now().year)
 
 
     def parse(self, response):
@@ -119,8 +137,10 @@ class MySpider(scrapy.Spider):
             creditPoints= response.xpath('//dt[contains(text(), "Credit points")]/following-sibling::dd[1]/text()').get()
             prerequisites_raw = response.xpath('//dt[contains(text(), "Prerequisites")]/following-sibling::dd[1]//text()').getall()
             joined_text = " ".join([text.strip() for text in prerequisites_raw if text.strip()])
-            unit_codes = re.findall(r'\b[A-Z]{3}\d{3}\b', joined_text)
-            prerequisites = unit_codes if unit_codes else None         
+            unit_codes = find_unit_codes(joined_text)
+            prerequisites = unit_codes if unit_codes else None
+            # The same prerequisites with their and/or structure kept, for the prerequisite graph
+            prerequisites_expr = parse_prerequisites(joined_text)
             equivalents= self.clean_equivalents(response.xpath('//dt[contains(text(), "Equivalents")]/following-sibling::dd[1]/text()').get())
             anti_requisites = response.xpath('//dt[contains(text(), "Anti-requisites")]/following-sibling::dd[1]/text()').get()
             sp_fee = response.xpath('//dt[contains(text(), "Commonwealth supported place")]/following-sibling::dd[1]/text()').get()
@@ -143,6 +163,7 @@ class MySpider(scrapy.Spider):
                 "international_fee": international_fee,
                 "creditPoints": creditPoints,
                 "prerequisites": prerequisites,
+                "prerequisites_expr": prerequisites_expr,
                 "equivalents": equivalents,
                 "anti_requisites": anti_requisites,
                 "overview": offerings,
@@ -150,16 +171,35 @@ class MySpider(scrapy.Spider):
                 'day_obtained': datetime.now().strftime('%Y-%m-%d'),
             }
 
+            # Only records that pass validation are stored as units; the rest are kept with the
+            # pages that have no unit code, together with the reason
+            try:
+                extracted_data = Unit.from_dict(extracted_data).to_dict()
+            except RecordError as e:
+                print(f"Unit page {self.unitLink} failed validation: {e}")
+                extracted_data["validation_error"] = str(e)
+                unitCode = None
+
 
             # Save the extracted data to a separate JSON file for each unit_code
             if unitCode:
                 output_file = f"./units/{unitCode}.json"
             else:
-                output_file = "./units/unknown_unit.json"
+                # Pages without a (valid) unit code are kept apart, one file per requested code, so
+                # they neither overwrite each other nor get read as units
+                output_file = f"./units_unknown/{re.sub(r'[^A-Za-z0-9_-]', '_', self.unitCode or 'unknown')}.json"
 
             try:
-                with open(output_file, "w", encoding="utf-8") as f:
-                    json.dump(extracted_data, f, indent=4, ensure_ascii=False) 
+                if writes_json() or not unitCode:
+                    writer = stage_writer("units")
+                    writer.write(output_file, extracted_data)
+                    # Committed before the unit is marked fetched, so a crash cannot skip it next run
+                    writer.flush()
+                if writes_packed() and unitCode:
+                    open_store("units").put(extracted_data)
+                if unitCode:
+                    mark_unit_fetched(unitCode)
+                    index_record("unit", extracted_data)
             except Exception as e:
                 print(f"Error writing to {output_file}: {e}")
 
@@ -185,6 +225,6 @@ unitLink = f"https://www.qut.edu.au/study/unit?unitCode={unit}"
 print(unitLink)
 
 # Run the spider with the unit_link argument
-process = CrawlerProcess()
+process = CrawlerProcess(settings=splash_settings())
 process.crawl(MySpider, unitLink=unitLink, unitCode=unitCode)
 process.start()
\ No newline at end of file
@@ -2,12 +2,42 @@
 # page and save it to a file.
 
 import scrapy
-from scrapy_splash import SplashRequest
 from scrapy.crawler import CrawlerProcess
 from scrapy.http import HtmlResponse
 import os
 import json 
+import hashlib
 from datetime import datetime
+import serializer
+from splash_render import page_request, splash_settings
+
+COURSES_FILE = 'courses.json'
+DELTA_FILE = 'courses_delta.json'
+# Set by main.py, so it can tell a delta written in its own run from one left by an earlier run
+RUN_ID = os.environ.get('QUT_RUN_ID')
+
+
+def course_list_hash(courses):
+    # Hash of the course list only, so a new day_obtained alone does not count as a change
+    return hashlib.sha256(serializer.dumps(courses)).hexdigest()
+
+
+def load_previous_courses(output_file=COURSES_FILE):
+    if not os.path.exists(output_file):
+        return []
+    try:
+        return serializer.load(output_file).get('list_of_courses', [])
+    except json.JSONDecodeError as e:
+        print(f"Error reading JSON file {output_file}: {e}")
+        return []
+
+
+def course_delta(previous, current):
+    # Course codes added to and removed from the active course list
+    previous_codes = {course['courseCode'] for course in previous}
+    current_codes = {course['courseCode'] for course in current}
+    return sorted(current_codes - previous_codes), sorted(previous_codes - current_codes)
+
 
 class CourseSpider(scrapy.Spider):
     name = 'courses'
@@ -18,10 +48,11 @@ class CourseSpider(scrapy.Spider):
     }
 
     def start_requests(self):
-        yield SplashRequest(
+        # The course list is in the static HTML, it is only rendered when a Splash pool is configured
+        yield page_request(
             url=self.start_urls[0],
+            selector='h3',
             callback=self.parse,
-            args={'wait': 2},  
         )
 
     def parse(self, response):
@@ -34,6 +65,8 @@ class CourseSpider(scrapy.Spider):
 
             # Yield each course title with separated fields
             for title in course_titles:
+                if not title.strip():
+                    continue
                 # Split the title into courseCode and course_title
                 parts = title.strip().split(" ", 1)
                 if len(parts) == 2:
@@ -46,6 +79,11 @@ class CourseSpider(scrapy.Spider):
                     'course_title': course_name,
                 })
 
+            # Never replace a good list with an empty one from a broken page
+            if not courses:
+                print("No courses found on the page, keeping the existing course list")
+                return
+
             # Build the final output structure
             extracted_data = {
                 'source': self.start_urls[0],
@@ -53,27 +91,33 @@ class CourseSpider(scrapy.Spider):
                 'list_of_courses': courses,
             }
 
-            # Save the extracted data to a JSON file
-            output_file = 'courses.json'
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(extracted_data, f, indent=4)
+            # Compare with the previous list and only replace it when the content changed
+            previous = load_previous_courses()
+            changed = course_list_hash(previous) != course_list_hash(courses)
+            added, removed = course_delta(previous, courses)
+
+            if changed:
+                serializer.dump(extracted_data, COURSES_FILE, indent=4)
+                print(f"Course list changed: {len(added)} added, {len(removed)} removed. Saved to {COURSES_FILE}")
+            else:
+                print(f"Course list unchanged, {COURSES_FILE} left as is")
+
+            serializer.dump({
+                'day_obtained': extracted_data['day_obtained'],
+                'run_id': RUN_ID,
+                'changed': changed,
+                'list_hash': course_list_hash(courses),
+                'added': added,
+                'removed': removed,
+            }, DELTA_FILE, indent=4)
 
             # Yield the extracted data as output
             yield extracted_data
 
 # Function to run the spider
 def run_spider():
-    output_file = 'courses.json'
-
-    # Check if courses.json exists and delete it
-    if os.path.exists(output_file):
-        os.remove(output_file)
-        print(f"{output_file} has been deleted.")
-
-    # Set up the crawler process with settings
-    process = CrawlerProcess(settings={
-        'FEED_FORMAT': 'json', 
-    })
+    # courses.json is kept until a new list has been fetched, and replaced atomically by parse
+    process = CrawlerProcess(settings=splash_settings())
     process.crawl(CourseSpider)  # Start crawling with the CourseSpider
     process.start()  # Start the crawling process
     
@@ -1,8 +1,10 @@
-import fitz  # PyMuPDF
-import json
 import re
 import sys
 from datetime import datetime
+from enrichment import save_enrichment_many
+import serializer
+from pdf_layout import page_texts
+from records import SemesterBlock
 
 def dedup_preserve_order(seq):
     # Deduplicate a list while preserving the order of first occurrences.
@@ -17,9 +19,12 @@ def dedup_preserve_order(seq):
 
 # This function extracts the mode of entry and semesters from the PDF.
 def extract_mode_entry_and_semesters(pdf_path):
-    # Open the PDF file
-    doc = fitz.open(pdf_path)
+    # Page texts come from the shared layout cache, so other extractors reuse the same parse
+    return semester_blocks_from_texts(page_texts(pdf_path))
 
+
+# This function finds the mode of entry and semester blocks in already extracted page texts.
+def semester_blocks_from_texts(texts):
     # Define regex patterns for mode/entry and semester
     mode_entry_pattern = re.compile(
         r'(February|July) entry\s*-\s*(Full Time|Part Time)', re.IGNORECASE
@@ -31,8 +36,7 @@ def extract_mode_entry_and_semesters(pdf_path):
     results = []
 
     # Iterate through each page in the PDF
-    for page in doc:
-        text = page.get_text("text")
+    for text in texts:
         # Find all mode/entry headers and their positions
         mode_entries = [(m.start(), m.group(1).capitalize(), m.group(2).title()) for m in mode_entry_pattern.finditer(text)]
         # Add an artificial end marker for the last block
@@ -50,15 +54,8 @@ def extract_mode_entry_and_semesters(pdf_path):
                 semesters = dedup_preserve_order(semesters)
                 # Only keep blocks that actually have semesters listed
                 if semesters:
-                    results.append({
-                        "mode_entry": {
-                            "entry_time": entry_time,
-                            "mode": mode
-                        },
-                        "semesters": semesters
-                    })
-
-    doc.close()
+                    results.append(SemesterBlock(entry_time, mode, semesters).to_dict())
+
     return results
 
 
@@ -71,39 +68,35 @@ def save_course_info_to_json(course_data, output_json):
         'day_obtained': datetime.now().strftime('%Y-%m-%d'),
         'course_data': course_data,
     }
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(extracted_data, f, indent=4)
+    serializer.dump(extracted_data, output_json, indent=4)
     print(f" Data extracted and saved to {output_json}")
 
 
-def add_semester_blocks_to_course(course_json_path, semester_blocks, output_path=None):
-    # Load the course JSON
-    with open(course_json_path, "r", encoding="utf-8") as f:
-        course_data = json.load(f)
-
-    # Add the semester blocks under durations
-    course_data["semester_blocks"] = semester_blocks
+def add_semester_blocks_to_courses(semester_blocks_by_course):
+    # Store the semester blocks in the enrichment side store keyed by course code.
+    # The scraped course records are left untouched, the blocks are merged in when read or exported.
+    save_enrichment_many({
+        course_code: {
+            "semester_blocks": semester_blocks,
+            "semester_blocks_obtained": datetime.now().strftime('%Y-%m-%d'),
+        }
+        for course_code, semester_blocks in semester_blocks_by_course.items()
+    })
+    print(f"Semester blocks saved for {', '.join(semester_blocks_by_course)}")
 
-    # Save to a new file or overwrite
-    if output_path is None:
-        output_path = course_json_path
-        
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(course_data, f, indent=2)
 
-    print(f"Semester blocks added to {output_path}")
+def add_semester_blocks_to_course(course_code, semester_blocks):
+    add_semester_blocks_to_courses({course_code: semester_blocks})
 
 if __name__ == "__main__":
 
-    # Get course code and construct JSON file path from command line arguments
-    course_code = sys.argv[1].upper()
-    
-    pdf_path = f"./pdf/{course_code}.pdf"
-    json_path = f"./courses/{course_code}.json"
-    output_json = f"./course_to_unit/{course_code}_course_data.json"
+    # Get one or more course codes from command line arguments
+    course_codes = [code.upper() for code in sys.argv[1:]]
 
-    # Extract course information from the PDF
-    course_info = extract_mode_entry_and_semesters(pdf_path)
+    # Extract course information from each PDF and save them in one batch
+    semester_blocks_by_course = {}
+    for course_code in course_codes:
+        pdf_path = f"./pdf/{course_code}.pdf"
+        semester_blocks_by_course[course_code] = extract_mode_entry_and_semesters(pdf_path)
 
-    # Save the extracted course information to a JSON file
-    add_semester_blocks_to_course(json_path, course_info)
+    add_semester_blocks_to_courses(semester_blocks_by_course)
@@ -0,0 +1,399 @@
+# The purpose of this script is to serve the scraped catalogue over a small read-only HTTP API.
+#
+# Courses, units and the course -> unit relationships are loaded into in-memory indexes at startup.
+# Every QUT_API_RELOAD_SECONDS the sources are checked again and only the records that changed are
+# re-read (by file mtime/size for the JSON folders, by record offset for the packed stores).
+# Response bodies are serialized once and cached with an ETag until the data behind them changes,
+# so repeated requests are answered from memory, and If-None-Match is answered with 304. The cache is
+# keyed by the canonical request (code case, extra query parameters and slashes do not make new
+# entries) and keeps the QUT_API_CACHE_ENTRIES (default 2048) most recently used responses.
+#
+# Endpoints:
+#   GET /courses                        course codes and names
+#   GET /courses/<code>                 course record, with its PDF enrichment merged in
+#   GET /courses/<code>/units           unit codes of the course
+#   GET /units/<code>                   unit record
+#   GET /units/<code>/courses           courses that include the unit
+#   GET /units/<code>/prerequisites     prerequisite expression, direct and all prerequisites
+#   GET /search?q=<text>                courses and units matching the text, ranked when
+#                                       scripts/search_index.py has built the index
+#   GET /health
+#
+# Usage:
+#   python scripts/api_server.py [port]
+#   python scripts/api_server.py smoke          # start on a free port, check a few requests, stop
+import asyncio
+import hashlib
+import os
+import sys
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+import serializer
+from enrichment import open_enrichment_store
+from prereq_graph import expression_codes, record_expression
+from record_store import open_store, writes_packed
+import search_index
+
+HOST = os.environ.get("QUT_API_HOST", "127.0.0.1")
+PORT = int(os.environ.get("QUT_API_PORT", 8080))
+RELOAD_SECONDS = float(os.environ.get("QUT_API_RELOAD_SECONDS", 5))
+COURSES_DIR = "./courses"
+UNITS_DIR = "./units"
+COURSE_TO_UNIT_DIR = "./course_to_unit"
+MAX_SEARCH_RESULTS = 50
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_CACHED_RESPONSES = int(os.environ.get("QUT_API_CACHE_ENTRIES", 2048))
+
+STATUS_TEXT = {
+    200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+def _scan_json_dir(directory):
+    # {key: (mtime_ns, size)} of every <key>.json in a folder
+    if not os.path.exists(directory):
+        return {}
+    return {
+        entry.name[:-len(".json")]: (entry.stat().st_mtime_ns, entry.stat().st_size)
+        for entry in os.scandir(directory) if entry.name.endswith(".json") and not entry.name.startswith(".")
+    }
+
+
+class Catalogue:
+    def __init__(self):
+        self.courses = {}
+        self.units = {}
+        self.enrichment = {}
+        self.course_units = {}
+        self.unit_courses = {}
+        self._link_files = {}
+        self._signatures = {}
+        self.generation = 0
+        self.loaded_at = None
+
+    # ---- loading ----
+
+    def _changed(self, source, current):
+        # Keys whose signature changed since the last load, and keys that disappeared
+        previous = self._signatures.get(source, {})
+        self._signatures[source] = current
+        changed = [key for key, signature in current.items() if previous.get(key) != signature]
+        removed = [key for key in previous if key not in current]
+        return changed, removed
+
+    def _reload_json_dir(self, source, directory, target, read):
+        changed, removed = self._changed(source, _scan_json_dir(directory))
+        for key in changed:
+            try:
+                target[key] = read(serializer.load(os.path.join(directory, f"{key}.json")))
+            except (OSError, ValueError) as e:
+                # Half-written or removed between the scan and the read, picked up on the next pass
+                print(f"Could not load {directory}/{key}.json: {e}")
+                self._signatures[source].pop(key, None)
+        for key in removed:
+            target.pop(key, None)
+        return bool(changed or removed)
+
+    def _reload_store(self, source, store, target):
+        # Packed stores append a record again when it changes, so its offset identifies the version
+        changed, removed = self._changed(source, dict(store.offsets))
+        for key in changed:
+            target[key] = store.get(key)
+        for key in removed:
+            target.pop(key, None)
+        return bool(changed or removed)
+
+    def reload(self):
+        # Re-read whatever changed since the last call. Returns True when anything did.
+        changed = False
+        if writes_packed():
+            changed |= self._reload_store("courses", open_store("courses"), self.courses)
+            changed |= self._reload_store("units", open_store("units"), self.units)
+        else:
+            changed |= self._reload_json_dir("courses", COURSES_DIR, self.courses, lambda record: record)
+            changed |= self._reload_json_dir("units", UNITS_DIR, self.units, lambda record: record)
+        changed |= self._reload_store("enrichment", open_enrichment_store(), self.enrichment)
+        if self._reload_json_dir("course_to_unit", COURSE_TO_UNIT_DIR, self._link_files, lambda record: record.get("unitCodes", [])):
+            # Only <code>.json holds a course's unit codes, <code>_unitGuide.json is the guide
+            self.course_units = {key: codes for key, codes in self._link_files.items() if not key.endswith("_unitGuide")}
+            self.unit_courses = {}
+            for course_code, unit_codes in self.course_units.items():
+                for unit_code in unit_codes:
+                    self.unit_courses.setdefault(unit_code, []).append(course_code)
+            changed = True
+        if changed:
+            self.generation += 1
+            self.loaded_at = time.time()
+        return changed
+
+    # ---- queries ----
+
+    def course(self, course_code):
+        record = self.courses.get(course_code)
+        if record is None:
+            return None
+        merged = dict(record)
+        merged.update({key: value for key, value in self.enrichment.get(course_code, {}).items() if key != "course_code"})
+        return merged
+
+    def prerequisites(self, unit_code):
+        record = self.units.get(unit_code)
+        if record is None:
+            return None
+        expr = record_expression(record)
+        direct = list(dict.fromkeys(expression_codes(expr)))
+        # Walk the prerequisite chain through the units we have
+        seen, stack = set(), list(direct)
+        while stack:
+            code = stack.pop()
+            if code in seen:
+                continue
+            seen.add(code)
+            if code in self.units:
+                stack.extend(expression_codes(record_expression(self.units[code])))
+        return {"unitCode": unit_code, "expression": expr, "direct": direct, "all": sorted(seen)}
+
+    def search(self, text):
+        # Ranked full-text search when the index has been built, plain substring matching otherwise
+        if os.path.exists(search_index.SEARCH_PATH):
+            return search_index.search(text, limit=MAX_SEARCH_RESULTS)
+        text = text.strip().lower()
+        if not text:
+            return []
+        results = []
+        for code, record in self.courses.items():
+            if text in code.lower() or text in (record.get("course_name") or "").lower():
+                results.append({"type": "course", "code": code, "name": record.get("course_name")})
+        for code, record in self.units.items():
+            if text in code.lower() or text in (record.get("studyArea") or "").lower():
+                results.append({"type": "unit", "code": code, "studyArea": record.get("studyArea")})
+        return results[:MAX_SEARCH_RESULTS]
+
+
+# ---- request handling ----
+
+class APIServer:
+    def __init__(self, catalogue=None):
+        self.catalogue = catalogue or Catalogue()
+        self._responses = OrderedDict()
+        self._generation = None
+
+    @staticmethod
+    def canonical(target):
+        # (path parts, query) of a request target, the same for every spelling of one request
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        if len(parts) >= 2 and parts[0] in ("courses", "units"):
+            parts[1] = parts[1].upper()
+        query = ""
+        if parts == ["search"]:
+            query = " ".join(parse_qs(url.query).get("q", [""])[0].split())
+        return tuple(parts), query
+
+    def route(self, parts, query):
+        # Returns (status, payload) for a GET of the canonical request
+        catalogue = self.catalogue
+        parts = list(parts)
+        path = "/" + "/".join(parts)
+        if parts == ["health"]:
+            return 200, {"generation": catalogue.generation, "courses": len(catalogue.courses), "units": len(catalogue.units)}
+        if parts == ["courses"]:
+            return 200, [{"course_code": code, "course_name": record.get("course_name")} for code, record in sorted(catalogue.courses.items())]
+        if parts == ["search"]:
+            return 200, catalogue.search(query)
+        if len(parts) >= 2:
+            code = parts[1]
+            if parts[0] == "courses" and len(parts) == 2:
+                payload = catalogue.course(code)
+            elif parts[0] == "courses" and parts[2:] == ["units"]:
+                payload = catalogue.course_units.get(code)
+            elif parts[0] == "units" and len(parts) == 2:
+                payload = catalogue.units.get(code)
+            elif parts[0] == "units" and parts[2:] == ["courses"]:
+                payload = sorted(catalogue.unit_courses.get(code, [])) if code in catalogue.units or code in catalogue.unit_courses else None
+            elif parts[0] == "units" and parts[2:] == ["prerequisites"]:
+                payload = catalogue.prerequisites(code)
+            else:
+                payload = None
+            if payload is not None:
+                return 200, payload
+        return 404, {"error": f"Not found: {path}"}
+
+    def respond(self, method, target, headers):
+        # Returns (status, extra headers, body). Bodies are cached per canonical request until the
+        # data changes, least recently used first out.
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD"}, serializer.dumps({"error": "Read-only API"})
+        if self._generation != self.catalogue.generation:
+            self._responses.clear()
+            self._generation = self.catalogue.generation
+        key = self.canonical(target)
+        cached = self._responses.get(key)
+        if cached is None:
+            status, payload = self.route(*key)
+            body = serializer.dumps(payload)
+            cached = (status, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"', body)
+            if status == 200:
+                self._responses[key] = cached
+                if len(self._responses) > MAX_CACHED_RESPONSES:
+                    self._responses.popitem(last=False)
+        else:
+            self._responses.move_to_end(key)
+        status, etag, body = cached
+        if status == 200 and headers.get("if-none-match") == etag:
+            return 304, {"ETag": etag}, b""
+        return status, {"ETag": etag} if status == 200 else {}, body
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive; requests on one connection are answered in order
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    writer.write(self._encode(400, {}, serializer.dumps({"error": "Bad request"}), False, False))
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                # Request bodies are not used, but they have to be read off the connection or they
+                # would be parsed as the next request
+                if "transfer-encoding" in headers:
+                    writer.write(self._encode(400, {}, serializer.dumps({"error": "Chunked request bodies are not supported"}), False, False))
+                    break
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > MAX_BODY_BYTES:
+                    status = 400 if length < 0 else 413
+                    writer.write(self._encode(status, {}, serializer.dumps({"error": STATUS_TEXT[status]}), False, False))
+                    break
+                try:
+                    await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                status, extra, body = self.respond(method, target, headers)
+                writer.write(self._encode(status, extra, body, method == "HEAD", keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _encode(status, extra, body, head_only, keep_alive):
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Cache-Control: no-cache",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in extra.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (b"" if head_only else body)
+
+    async def reload_forever(self):
+        while True:
+            await asyncio.sleep(RELOAD_SECONDS)
+            try:
+                # Runs on the event loop so no request sees a half-updated index; only changed
+                # records are read, so this is short
+                if self.catalogue.reload():
+                    print(f"Reloaded catalogue (generation {self.catalogue.generation})")
+            except Exception as e:
+                print(f"Error reloading catalogue: {e}")
+
+    async def serve(self, host=HOST, port=PORT):
+        start = time.perf_counter()
+        self.catalogue.reload()
+        print(f"Loaded {len(self.catalogue.courses)} courses and {len(self.catalogue.units)} units "
+              f"in {time.perf_counter() - start:.2f}s")
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        print(f"Serving on http://{host}:{port}")
+        reloader = asyncio.create_task(self.reload_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reloader.cancel()
+
+
+async def _read_response(reader):
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = {name.strip().lower(): value.strip() for name, value in (line.split(":", 1) for line in head[1:] if ":" in line)}
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return int(head[0].split(" ")[1]), headers, body
+
+
+async def smoke():
+    # Start the server on a free port over the local data and check the request handling.
+    # Returns the list of failed checks.
+    api = APIServer()
+    api.catalogue.reload()
+    server = await asyncio.start_server(api.handle_connection, "127.0.0.1", 0, limit=MAX_HEADER_BYTES)
+    port = server.sockets[0].getsockname()[1]
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    async with server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # A POST with a body, then two GETs on the same keep-alive connection
+        body = b"GET /nope HTTP/1.1\r\n\r\n"
+        writer.write(b"POST /health HTTP/1.1\r\nHost: x\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body +
+                     b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n"
+                     b"GET /courses HTTP/1.1\r\nHost: x\r\n\r\n")
+        await writer.drain()
+        status, _, _ = await _read_response(reader)
+        check("POST is refused with 405", status == 405)
+        status, _, body = await _read_response(reader)
+        check("request after a body is parsed as the next request", status == 200 and b"generation" in body)
+        status, headers, _ = await _read_response(reader)
+        check("GET /courses", status == 200 and "etag" in headers)
+        writer.write(f"GET /courses HTTP/1.1\r\nHost: x\r\nIf-None-Match: {headers.get('etag')}\r\n\r\n".encode())
+        await writer.drain()
+        status, _, _ = await _read_response(reader)
+        check("If-None-Match is answered with 304", status == 304)
+        writer.write(b"POST /health HTTP/1.1\r\nHost: x\r\nContent-Length: " + str(MAX_BODY_BYTES + 1).encode() + b"\r\n\r\n")
+        await writer.drain()
+        status, _, _ = await _read_response(reader)
+        check("oversized body is refused with 413", status == 413)
+        writer.close()
+
+    # Different spellings of one request share a cache entry, and the cache stays bounded
+    api._responses.clear()
+    for target in ("/search?q=data", "/search?q=data&x=1", "/search/?q=%20data%20", "/health"):
+        api.respond("GET", target, {})
+    check("spellings of a request share one cache entry", len(api._responses) == 2)
+    for i in range(MAX_CACHED_RESPONSES + 10):
+        api.respond("GET", f"/search?q=smoke{i}", {})
+    check(f"cache keeps at most {MAX_CACHED_RESPONSES} responses", len(api._responses) == MAX_CACHED_RESPONSES)
+    return failures
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "smoke":
+        failures = asyncio.run(smoke())
+        print(f"{len(failures)} checks failed" if failures else "All checks passed")
+        sys.exit(1 if failures else 0)
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    try:
+        asyncio.run(APIServer().serve(port=port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,120 @@
+# The purpose of this script is to time the hot paths of the pipeline on the data we already have.
+#
+# Usage:
+#   python scripts/benchmark.py serializer     # load + dump every file in ./courses and ./units
+#   python scripts/benchmark.py text           # normalize the highlights and sections saved in ./courses
+import os
+import re
+import sys
+import time
+import unicodedata
+import serializer
+import text_utils
+
+
+def collect_json_files(folders):
+    files = []
+    for folder in folders:
+        if not os.path.exists(folder):
+            print(f"Folder '{folder}' does not exist, skipping")
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(".json") and not filename.startswith("."):
+                files.append(os.path.join(folder, filename))
+    return files
+
+
+def timed(func, repeat=3):
+    # Best of `repeat` runs, in seconds
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_serializer(folders=("./courses", "./units")):
+    files = collect_json_files(folders)
+    if not files:
+        print("No JSON files found to benchmark")
+        return
+
+    # Read the raw bytes once so the timings measure parsing and encoding, not disk reads
+    blobs = []
+    for path in files:
+        with open(path, "rb") as f:
+            blobs.append(f.read())
+    total_mb = sum(len(b) for b in blobs) / (1024 * 1024)
+    print(f"{len(files)} files, {total_mb:.1f} MB")
+
+    results = {}
+    for name in serializer.BACKENDS:
+        serializer.use_backend(name)
+        records = [serializer.loads(b) for b in blobs]
+        load_time = timed(lambda: [serializer.loads(b) for b in blobs])
+        dump_time = timed(lambda: [serializer.dumps(r, indent=4) for r in records])
+        results[name] = (load_time, dump_time)
+        print(f"{name:>8}: load {load_time * 1000:8.1f} ms   dump {dump_time * 1000:8.1f} ms")
+
+    if "orjson" in results:
+        json_total = sum(results["json"])
+        orjson_total = sum(results["orjson"])
+        print(f"orjson is {json_total / orjson_total:.1f}x faster than the standard library")
+
+
+def normalize_text_baseline(text):
+    # The per-string normalization the spiders used before text_utils
+    text = text.replace('’', "'")
+    text = text.replace('‘', "'")
+    text = text.replace('“', '"')
+    text = text.replace('”', '"')
+    return unicodedata.normalize('NFKC', text)
+
+
+def collect_course_strings(folder="./courses"):
+    # Every highlight and section fragment from the saved course records
+    strings = []
+    for path in collect_json_files([folder]):
+        course = serializer.load(path)
+        strings.extend(course.get("highlights") or [])
+        for content in (course.get("what_to_expect-careers_and_outcome") or {}).values():
+            strings.extend(content)
+    return strings
+
+
+def bench_text():
+    strings = collect_course_strings()
+    if not strings:
+        print("No saved course records found to benchmark")
+        return
+    print(f"{len(strings)} strings")
+
+    mismatches = sum(1 for s in strings if normalize_text_baseline(s) != text_utils.normalize_text(s))
+    if mismatches:
+        print(f"WARNING: {mismatches} strings normalize differently")
+
+    baseline = timed(lambda: [normalize_text_baseline(s) for s in strings])
+    fast = timed(lambda: [text_utils.normalize_text(s) for s in strings])
+    print(f"baseline: {baseline * 1000:8.1f} ms   text_utils: {fast * 1000:8.1f} ms   ({baseline / fast:.1f}x)")
+
+    joined = " ".join(strings)
+    baseline = timed(lambda: re.findall(r'\b[A-Z]{3}\d{3}\b', joined))
+    fast = timed(lambda: text_utils.find_unit_codes(joined))
+    print(f"unit codes: inline {baseline * 1000:8.1f} ms   precompiled {fast * 1000:8.1f} ms")
+
+
+BENCHMARKS = {
+    "serializer": bench_serializer,
+    "text": bench_text,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}")
+            continue
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
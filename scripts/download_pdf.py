@@ -1,50 +1,199 @@
+# Downloads course PDFs to ./pdf/<courseCode>.pdf.
+#
+# The ETag, Last-Modified and size of every downloaded PDF are kept in ./state/pdf_validators.json.
+# A PDF is only downloaded again when the server says it changed: the bulk mode sends a HEAD request
+# for every course at once and compares the validators, single downloads send a conditional GET
+# (If-None-Match / If-Modified-Since) and get a 304 back when nothing changed.
+# The bulk mode then downloads the changed PDFs largest first, QUT_PDF_DOWNLOADS (default 8) at a time,
+# so the biggest files do not end up as stragglers at the tail of the run.
+#
+# Usage:
+#   python scripts/download_pdf.py COURSE_CODE IDENTIFIER     # one PDF
+#   python scripts/download_pdf.py all                        # every course in ./courses
 import sys
-import scrapy
-from scrapy.crawler import CrawlerProcess
-import logging
-import fitz  # PyMuPDF
-import re
-import json
+import asyncio
 import os
-import traceback
-from pathlib import Path
+import serializer
+from http_client import HTTPClient
 
-# Silence pdfminer debug logging
-logging.getLogger("pdfminer").setLevel(logging.WARNING)
+PDF_DIR = "./pdf"
+VALIDATORS_PATH = "./state/pdf_validators.json"
+MAX_DOWNLOADS = int(os.environ.get("QUT_PDF_DOWNLOADS", 8))
 
-class PDFSpider(scrapy.Spider):
-    name = "pdf_spider"
-    custom_settings = {
-        'USER_AGENT': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36',
+
+# Build the PDF URL of a course from its code and identifier
+def course_pdf_url(courseCode, id):
+    return f"https://pdf.courses.qut.edu.au/coursepdf/qut_{courseCode}_{id}_dom_cms_unit.pdf"
+
+
+def pdf_path(courseCode):
+    return os.path.join(PDF_DIR, f"{courseCode}.pdf")
+
+
+def load_validators(path=VALIDATORS_PATH):
+    # {courseCode: {"url", "etag", "last_modified", "size"}} of the last download of each PDF
+    if not os.path.exists(path):
+        return {}
+    try:
+        return serializer.load(path)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_validators(validators, path=VALIDATORS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    serializer.dump(validators, path)
+
+
+def _content_length(headers):
+    try:
+        return int(headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _validators_from(url, headers, size):
+    return {
+        "url": url,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "size": size,
     }
-    # Initialize the spider with the PDF URL and course code
-    def __init__(self, pdf_url=None, courseCode = None, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.pdf_url = pdf_url
-        self.courseCode = courseCode
-
-    # Start the spider by making a request to the PDF URL
-    def start_requests(self):
-        if self.pdf_url:
-            yield scrapy.Request(
-                url=self.pdf_url,
-                callback=self.parse_pdf
-            )
-        else:
-            print("No PDF URL provided.")
-
-    # Write the PDF content to a pdf file
-    def parse_pdf(self, response):
+
+
+def conditional_headers(courseCode, url, validators):
+    # Only valid while the local copy exists and was downloaded from the same URL
+    known = validators.get(courseCode)
+    if not known or known.get("url") != url or not os.path.exists(pdf_path(courseCode)):
+        return {}
+    headers = {}
+    if known.get("etag"):
+        headers["If-None-Match"] = known["etag"]
+    if known.get("last_modified"):
+        headers["If-Modified-Since"] = known["last_modified"]
+    return headers
+
+
+def unchanged(courseCode, url, headers, validators):
+    # Whether the HEAD response describes the PDF we already have
+    if not conditional_headers(courseCode, url, validators):
+        return False
+    known = validators[courseCode]
+    if known.get("etag") and headers.get("ETag"):
+        return known["etag"] == headers.get("ETag")
+    if known.get("last_modified") and headers.get("Last-Modified"):
+        return (known["last_modified"] == headers.get("Last-Modified")
+                and known.get("size") == _content_length(headers))
+    return False
+
+
+# Download a course PDF through the shared HTTP client and write it to ./pdf/<courseCode>.pdf.
+# Returns "downloaded", "unchanged" or None when it failed.
+async def download_pdf(client, courseCode, id, validators=None):
+    pdf_url = course_pdf_url(courseCode, id)
+    validators = load_validators() if validators is None else validators
+    try:
+        response = await client.get(pdf_url, headers=conditional_headers(courseCode, pdf_url, validators))
+        if response.status_code == 304:
+            print(f"PDF unchanged: {pdf_path(courseCode)}")
+            return "unchanged"
+        if response.status_code != 200:
+            print(f"Error downloading PDF {pdf_url}: HTTP {response.status_code}")
+            return None
+        pdf_filename = pdf_path(courseCode)
+        serializer.write_atomic(pdf_filename, response.content)
+        validators[courseCode] = _validators_from(pdf_url, response.headers, len(response.content))
+        print(f"PDF downloaded: {pdf_filename}")
+        return "downloaded"
+    except Exception as e:
+        print(f"Error saving PDF: {e}")
+        return None
+
+
+async def _head(client, courseCode, id, validators):
+    # (courseCode, id, expected size) when the PDF has to be downloaded, None when it is unchanged
+    pdf_url = course_pdf_url(courseCode, id)
+    if not conditional_headers(courseCode, pdf_url, validators):
+        return courseCode, id, validators.get(courseCode, {}).get("size")
+    try:
+        response = await client.head(pdf_url)
+    except Exception as e:
+        print(f"Error checking PDF {pdf_url}: {e}")
+        return courseCode, id, None
+    if response.status_code == 200 and unchanged(courseCode, pdf_url, response.headers, validators):
+        return None
+    # Anything else (changed, HEAD not allowed, error) goes to a conditional GET
+    return courseCode, id, _content_length(response.headers)
+
+
+async def changed_pdfs(courses):
+    # Course codes whose PDF differs from the last download (or was never downloaded), by HEAD only
+    validators = load_validators()
+    async with HTTPClient() as client:
+        checked = await asyncio.gather(*(_head(client, code, id, validators) for code, id in courses))
+    return [entry[0] for entry in checked if entry is not None]
+
+
+async def download_all(courses, workers=MAX_DOWNLOADS):
+    # Refresh the PDFs of every (courseCode, identifier) pair in one burst.
+    # Returns {courseCode: "downloaded" | "unchanged" | None}.
+    os.makedirs(PDF_DIR, exist_ok=True)
+    validators = load_validators()
+    results = {}
+    async with HTTPClient() as client:
+        checked = await asyncio.gather(*(_head(client, code, id, validators) for code, id in courses))
+        due = [entry for entry in checked if entry is not None]
+        for code, _ in courses:
+            results[code] = "unchanged"
+        print(f"{len(courses) - len(due)} of {len(courses)} PDFs unchanged, {len(due)} to download")
+
+        # Largest first; sizes we do not know go before everything else, they may be the largest
+        due.sort(key=lambda entry: -1 if entry[2] is None else -entry[2])
+        queue = asyncio.Queue()
+        for entry in due:
+            queue.put_nowait(entry)
+
+        async def worker():
+            while not queue.empty():
+                code, id, _ = queue.get_nowait()
+                results[code] = await download_pdf(client, code, id, validators)
+
         try:
-            pdf_filename = f"./pdf/{self.courseCode}.pdf"
-            os.makedirs(os.path.dirname(pdf_filename), exist_ok=True)
-            with open(pdf_filename, "wb") as f:
-                f.write(response.body)
-            print(f"PDF downloaded: {pdf_filename}")
-        except Exception as e:
-            print(f"Error saving PDF: {e}")
+            await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(due))))))
+        finally:
+            save_validators(validators)
+    return results
 
 
+def course_pairs(course_folder="./courses"):
+    # (courseCode, identifier) of every scraped course that has an identifier
+    pairs = []
+    if not os.path.exists(course_folder):
+        return pairs
+    for filename in sorted(os.listdir(course_folder)):
+        if not filename.endswith(".json") or filename.startswith("."):
+            continue
+        try:
+            course = serializer.load(os.path.join(course_folder, filename))
+        except (OSError, ValueError) as e:
+            print(f"Error reading JSON file {filename}: {e}")
+            continue
+        if course.get('course_code') and course.get('identifier'):
+            pairs.append((course['course_code'], course['identifier']))
+    return pairs
+
+
+async def main(courseCode, id):
+    async with HTTPClient() as client:
+        validators = load_validators()
+        result = await download_pdf(client, courseCode, id, validators)
+        if result == "downloaded":
+            # Other processes may have downloaded PDFs meanwhile, only replace this course's entry
+            latest = load_validators()
+            latest[courseCode] = validators[courseCode]
+            save_validators(latest)
+        return result
+
 
 if __name__ == "__main__":
 
@@ -54,16 +203,17 @@ if __name__ == "__main__":
         os.makedirs(output_dir)
         print(f"Created output directory: {output_dir}")
 
+    if len(sys.argv) > 1 and sys.argv[1] == "all":
+        results = asyncio.run(download_all(course_pairs()))
+        failed = [code for code, result in results.items() if result is None]
+        downloaded = sum(result == "downloaded" for result in results.values())
+        print(f"{downloaded} PDFs downloaded, {len(results) - downloaded - len(failed)} unchanged, {len(failed)} failed")
+        sys.exit(1 if failed else 0)
+
     # Pull the course code and ID from command line arguments
     courseCode = sys.argv[1]  # First argument
     id = sys.argv[2]
 
-    # Construct the PDF URL
-    pdf_url = f"https://pdf.courses.qut.edu.au/coursepdf/qut_{courseCode}_{id}_dom_cms_unit.pdf"
-
-    # Run the spider
-    process = CrawlerProcess()
-    process.crawl(PDFSpider, pdf_url=pdf_url, courseCode = courseCode)
-    process.start()  # Download PDF
-
-
+    # Download the PDF
+    if not asyncio.run(main(courseCode, id)):
+        sys.exit(1)
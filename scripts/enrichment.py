@@ -0,0 +1,100 @@
+# The purpose of this script is to keep data derived from the course PDFs (semester blocks,
+# unit structure) in a side store keyed by course code, instead of rewriting the scraped
+# course records. The enrichment is merged into a course record only when it is read or exported.
+#
+# Usage:
+#   python scripts/enrichment.py get AB05
+#   python scripts/enrichment.py export ./courses ./export/courses   # course files with enrichment merged in
+#   python scripts/enrichment.py compact                              # drop superseded copies (run after a full run)
+import os
+import sys
+import serializer
+from record_store import RecordStore
+from output_writer import OutputWriter
+
+ENRICHMENT_DIR = "./enrichment"
+
+
+def open_enrichment_store(directory=ENRICHMENT_DIR):
+    return RecordStore("courses", "course_code", directory=directory)
+
+
+def save_enrichment_many(entries, store=None):
+    # entries maps course_code -> {field: value}. Fields are merged into whatever is already
+    # stored for the course and the whole batch is written with one append. The read and the append
+    # happen under the store lock, so parallel PDF workers do not overwrite each other's fields.
+    store = store or open_enrichment_store()
+    records = []
+    with store.locked():
+        store.reload()
+        for course_code, fields in entries.items():
+            record = store.get(course_code) or {"course_code": course_code}
+            record.update(fields)
+            records.append(record)
+        store.put_many(records)
+    return records
+
+
+def save_enrichment(course_code, store=None, **fields):
+    return save_enrichment_many({course_code: fields}, store=store)[0]
+
+
+def get_enrichment(course_code, store=None):
+    store = store or open_enrichment_store()
+    record = store.get(course_code)
+    if record is None:
+        return {}
+    return {key: value for key, value in record.items() if key != "course_code"}
+
+
+def get_semester_blocks(course_code, store=None):
+    return get_enrichment(course_code, store=store).get("semester_blocks", [])
+
+
+def merge_enrichment(course, store=None):
+    # Return a copy of the scraped course record with its enrichment fields added
+    course_code = course.get("course_code")
+    if not course_code:
+        return course
+    merged = dict(course)
+    merged.update(get_enrichment(course_code, store=store))
+    return merged
+
+
+def compact_enrichment(store=None):
+    # Every save appends a new copy of the course's record; rewrite the store with the latest ones only
+    store = store or open_enrichment_store()
+    store.compact()
+
+
+def export_merged(source_dir, output_dir, indent=4):
+    # Write every course record from source_dir to output_dir with enrichment merged in
+    store = open_enrichment_store()
+    enrichment = store.load_all()
+    count = 0
+    with OutputWriter("export-enriched-courses", indent=indent) as writer:
+        for filename in sorted(os.listdir(source_dir)):
+            if not filename.endswith(".json") or filename.startswith("."):
+                continue
+            course = serializer.load(os.path.join(source_dir, filename))
+            extra = enrichment.get(course.get("course_code"), {})
+            course.update({key: value for key, value in extra.items() if key != "course_code"})
+            writer.write(os.path.join(output_dir, filename), course)
+            count += 1
+    print(f"Exported {count} courses with enrichment to {output_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: enrichment.py get COURSE_CODE | export SOURCE_DIR OUTPUT_DIR | compact")
+        sys.exit(1)
+
+    if sys.argv[1] == "compact":
+        compact_enrichment()
+    elif sys.argv[1] == "get" and len(sys.argv) > 2:
+        print(serializer.dumps(get_enrichment(sys.argv[2].upper()), indent=4).decode("utf-8"))
+    elif sys.argv[1] == "export" and len(sys.argv) > 3:
+        export_merged(sys.argv[2], sys.argv[3])
+    else:
+        print(f"Unknown command: {' '.join(sys.argv[1:])}")
+        sys.exit(1)
@@ -1,8 +1,9 @@
-import fitz
 import re
-import json
 import sys
-import os
+import serializer
+from text_utils import UNIT_CODE_CELL_PATTERN as UNIT_CODE_PATTERN
+from enrichment import get_semester_blocks, save_enrichment
+from pdf_layout import table_rows
 
 def normalize_semester(sem):
     """Remove anything in parentheses and extra spaces, then lowercase."""
@@ -18,13 +19,15 @@ def dedup_preserve_order(seq):
             result.append(x_lower)
     return result
 
-def extract_units_by_semester(pdf_path, semester_blocks):
-    doc = fitz.open(pdf_path)
-    semester_header_pattern = re.compile(r'Year\s*\d+,\s*Semester\s*\d+', re.IGNORECASE)
-    unit_code_pattern = re.compile(r'^[A-Z]{3}\d{3}$')
-    special_unit_pattern = re.compile(r'(QUT You unit|Complementary Studies unit)', re.IGNORECASE)
+SEMESTER_HEADER_PATTERN = re.compile(r'Year\s*\d+,\s*Semester\s*\d+', re.IGNORECASE)
+SPECIAL_UNIT_PATTERN = re.compile(r'(QUT You unit|Complementary Studies unit)', re.IGNORECASE)
 
+def extract_units_by_semester(pdf_path, semester_blocks):
+    # Table rows come from the shared layout cache, the same parse EUFC uses for unit codes
+    return units_by_semester_from_rows(table_rows(pdf_path), semester_blocks)
 
+def units_by_semester_from_rows(rows, semester_blocks):
+    """Map the unit codes in already extracted table rows to the semesters of each semester block."""
     all_semesters = set()
     for block in semester_blocks:
         all_semesters.update([normalize_semester(s) for s in block["semesters"]])
@@ -33,47 +36,39 @@ def extract_units_by_semester(pdf_path, semester_blocks):
     current_semester = None
     pre_semester_units = []
 
-    for page in doc:
-        tables = page.find_tables()
-        if not tables:
+    for cleaned_row in rows:
+        if not cleaned_row or not cleaned_row[0]:
             continue
-        for table in tables:
-            table_data = table.extract()
-            for row in table_data:
-                cleaned_row = [str(cell).strip() if cell else "" for cell in row]
-                if cleaned_row[0] and semester_header_pattern.match(cleaned_row[0]):
-                    normalized_sem = normalize_semester(cleaned_row[0])
-                    if normalized_sem in semester_units:
-                        current_semester = normalized_sem
-                    else:
-                        current_semester = None
-                    continue
-                if current_semester and cleaned_row[0] and unit_code_pattern.match(cleaned_row[0]):
-                    title = next((cell for cell in cleaned_row[1:] if cell), "")
-                    semester_units[current_semester].append({
-                        "code": cleaned_row[0],
-                        "title": title
-                    })
-                elif not current_semester and cleaned_row[0] and unit_code_pattern.match(cleaned_row[0]):
-                    title = next((cell for cell in cleaned_row[1:] if cell), "")
-                    pre_semester_units.append({
-                        "code": cleaned_row[0],
-                        "title": title
-                    })
-                elif not current_semester and cleaned_row[0] and special_unit_pattern.search(cleaned_row[0]):
-                    pre_semester_units.append({
-                        "code": cleaned_row[0],
-                        "title": ""
-                    })
+        if SEMESTER_HEADER_PATTERN.match(cleaned_row[0]):
+            normalized_sem = normalize_semester(cleaned_row[0])
+            if normalized_sem in semester_units:
+                current_semester = normalized_sem
+            else:
+                current_semester = None
+            continue
+        if current_semester and UNIT_CODE_PATTERN.match(cleaned_row[0]):
+            title = next((cell for cell in cleaned_row[1:] if cell), "")
+            semester_units[current_semester].append({
+                "code": cleaned_row[0],
+                "title": title
+            })
+        elif not current_semester and UNIT_CODE_PATTERN.match(cleaned_row[0]):
+            title = next((cell for cell in cleaned_row[1:] if cell), "")
+            pre_semester_units.append({
+                "code": cleaned_row[0],
+                "title": title
+            })
+        elif not current_semester and SPECIAL_UNIT_PATTERN.search(cleaned_row[0]):
+            pre_semester_units.append({
+                "code": cleaned_row[0],
+                "title": ""
+            })
 
 
     y1s1_norm = normalize_semester("year 1, semester 1")
     if y1s1_norm in semester_units and not semester_units[y1s1_norm]:
         semester_units[y1s1_norm] = pre_semester_units
 
-    doc.close()
-
-
     # Build the output structure for the unit guide
     unit_guide = []
     for block in semester_blocks:
@@ -89,24 +84,28 @@ def extract_units_by_semester(pdf_path, semester_blocks):
 
     return unit_guide
 
+def save_unit_guide(course_code, unit_guide, output_json, semester_blocks=None, writer=None):
+    # Keep the guide with the course's other PDF-derived data and write the per-course file.
+    # Semester blocks found in the same pass are saved in the same enrichment write.
+    fields = {"unit_guide": unit_guide}
+    if semester_blocks is not None:
+        fields["semester_blocks"] = semester_blocks
+    save_enrichment(course_code, **fields)
+    if writer is not None:
+        # Committed and reported by the caller when it flushes the writer
+        writer.write(output_json, {f"{course_code}_unitGuide": unit_guide}, indent=2)
+    else:
+        serializer.dump({f"{course_code}_unitGuide": unit_guide}, output_json, indent=2)
+        print(f"Wrote {output_json}")
+
 if __name__ == "__main__":
     course_code = sys.argv[1].upper()
     pdf_path = f"./pdf/{course_code}.pdf"
-    json_path = f"./courses/{course_code}.json"
     output_json = f"./course_to_unit/{course_code}_unitGuide.json"
 
-    # Load semester_blocks from the course JSON
-    with open(json_path, "r", encoding="utf-8") as f:
-        course_data = json.load(f)
-    semester_blocks = course_data.get("semester_blocks", [])
+    # Load semester_blocks from the enrichment side store
+    semester_blocks = get_semester_blocks(course_code)
 
     # Extract the unit guide
     unit_guide = extract_units_by_semester(pdf_path, semester_blocks)
-
-    # Output as {AB05_unitGuide: [...]}
-    # result = {f"{course_code}_unitGuide": unit_guide}
-    # os.makedirs(os.path.dirname(output_json), exist_ok=True)
-    # with open(output_json, "w", encoding="utf-8") as f:
-    #     json.dump(result, f, indent=2)
-
-    print(f"Wrote {output_json}")
\ No newline at end of file
+    save_unit_guide(course_code, unit_guide, output_json)
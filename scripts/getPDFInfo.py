@@ -1,9 +1,11 @@
-import fitz  # PyMuPDF
 import re
 import json
 import os
 import sys
 import traceback
+import serializer
+from pdf_layout import page_texts
+from text_utils import SPLIT_UNIT_CODE_PATTERN, SEMESTER_TITLE_PATTERN, course_structure_pattern
 
 # Hard cut: always stop here
 HARD_CUTOFFS = [
@@ -25,7 +27,7 @@ def fix_split_codes(text):
     Fixes unit codes that might be split across lines.
     Example: 'ABB\\n101' becomes 'ABB101'.
     """
-    return re.sub(r'([A-Z]{3})\s*\n\s*(\d{3})', r'\1\2', text)
+    return SPLIT_UNIT_CODE_PATTERN.sub(r'\1\2', text)
 
 
 def find_cutoff_index_by_line(text, soft_keywords, hard_keywords):
@@ -57,8 +59,7 @@ def extract_course_guide_info_from_text(text, course_code):
     and collects semesters and unit codes within each structure.
     """
     structures = []
-    pattern = rf'({course_code} - .*?entry - .*?)\s*\n\s*Semesters'
-    structure_matches = list(re.finditer(pattern, text))
+    structure_matches = list(course_structure_pattern(course_code).finditer(text))
 
     for idx, match in enumerate(structure_matches):
         structure_name = match.group(1)
@@ -74,8 +75,8 @@ def extract_course_guide_info_from_text(text, course_code):
 
         # Extract semesters
         semesters = {}
-        semester_blocks = re.split(r'Year\s+\d,?\s+Semester\s+\d(?:\s+\(July\))?', structure_text)
-        semester_titles = re.findall(r'Year\s+\d,?\s+Semester\s+\d(?:\s+\(July\))?', structure_text)
+        semester_blocks = SEMESTER_TITLE_PATTERN.split(structure_text)
+        semester_titles = SEMESTER_TITLE_PATTERN.findall(structure_text)
 
         for title, block in zip(semester_titles, semester_blocks[1:]):
             semester_key = title.lower().replace(" ", "").replace(",", "")
@@ -102,18 +103,13 @@ def extract_course_guide_info_from_text(text, course_code):
 
 def extract_and_save_course_info(pdf_path, output_json, course_code):
     try:
-        doc = fitz.open(pdf_path)
-        full_text = ""
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            full_text += page.get_text("text") + "\n\n"
-        doc.close()
+        # Page texts come from the shared layout cache, joined once instead of growing one string page by page
+        full_text = "\n\n".join(page_texts(pdf_path)) + "\n\n"
 
         full_text = fix_split_codes(full_text)
         course_info = extract_course_guide_info_from_text(full_text, course_code)
 
-        with open(output_json, 'w', encoding='utf-8') as f:
-            json.dump(course_info, f, indent=4)
+        serializer.dump(course_info, output_json, indent=4)
 
         print(f" Extraction complete. Saved to {output_json}")
     except Exception as e:
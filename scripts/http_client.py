@@ -0,0 +1,199 @@
+# Shared HTTP client for every fetch made outside Scrapy (PDF downloads, offerings API).
+#
+# Uses httpx with a pooled keep-alive connection per host, HTTP/2 when the `h2` package is
+# installed, gzip (and brotli when `brotli` is installed) decoding, a per-host concurrency limit
+# and at most QUT_HTTP_MAX_CONNECTIONS (default 32) open connections, so repeated requests to the
+# same few QUT hosts reuse their connections. Connections live as long as the client: a stage
+# script run once per item by main.py opens a new one each run.
+# Set QUT_DNS_CACHE=1 to also cache DNS lookups of the hosts the clients request for DNS_TTL_SECONDS;
+# lookups of any other host in the process are left alone.
+# Falls back to urllib (no pooling) when httpx is not installed.
+import asyncio
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+import serializer
+from rate_control import get_controller, retry_after_seconds
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401, enables HTTP/2 in httpx
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+try:
+    import brotli  # noqa: F401, lets httpx decode br responses
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
+DEFAULT_HEADERS = {"User-Agent": USER_AGENT, "Accept-Encoding": ACCEPT_ENCODING}
+TIMEOUT_SECONDS = 30
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("QUT_HTTP_PER_HOST", 4))
+MAX_CONNECTIONS = int(os.environ.get("QUT_HTTP_MAX_CONNECTIONS", 32))
+DNS_CACHE = os.environ.get("QUT_DNS_CACHE", "").lower() in ("1", "true", "yes")
+DNS_TTL_SECONDS = 300
+# Attempts per request when the host answers 429/503
+MAX_ATTEMPTS = 3
+
+
+# ---- DNS cache ----
+
+_original_getaddrinfo = socket.getaddrinfo
+_dns_cache = {}
+_dns_hosts = set()
+_dns_lock = threading.Lock()
+
+
+def _cached_getaddrinfo(host, port, *args, **kwargs):
+    if host not in _dns_hosts:
+        return _original_getaddrinfo(host, port, *args, **kwargs)
+    key = (host, port, args, tuple(sorted(kwargs.items())))
+    now = time.monotonic()
+    with _dns_lock:
+        entry = _dns_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+    result = _original_getaddrinfo(host, port, *args, **kwargs)
+    with _dns_lock:
+        _dns_cache[key] = (now + DNS_TTL_SECONDS, result)
+    return result
+
+
+def cache_dns(host):
+    # Resolve the host once per DNS_TTL_SECONDS. The lookup hook is installed on first use and only
+    # caches hosts registered here.
+    with _dns_lock:
+        _dns_hosts.add(host)
+    if socket.getaddrinfo is not _cached_getaddrinfo:
+        socket.getaddrinfo = _cached_getaddrinfo
+
+
+# ---- fallback response for urllib ----
+
+class SimpleResponse:
+    # The parts of httpx.Response we use, for the urllib fallback
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return serializer.loads(self.content)
+
+
+def _urllib_request(method, url, headers, timeout):
+    # urllib does not decode gzip, so only ask for identity encoding here
+    headers = {**headers, "Accept-Encoding": "identity"}
+    request = urllib.request.Request(url, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return SimpleResponse(url, response.status, dict(response.headers), response.read())
+    except urllib.error.HTTPError as e:
+        return SimpleResponse(url, e.code, dict(e.headers), e.read())
+
+
+# ---- async client ----
+
+class HTTPClient:
+    def __init__(self, per_host=MAX_CONNECTIONS_PER_HOST, timeout=TIMEOUT_SECONDS, rates=None, dns_cache=DNS_CACHE):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.dns_cache = dns_cache
+        self.rates = rates or get_controller()
+        self._client = None
+        if httpx is not None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2,
+                headers=DEFAULT_HEADERS,
+                timeout=timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            )
+
+    async def _send(self, method, url, headers):
+        if self._client is not None:
+            return await self._client.request(method, url, headers=headers)
+        return await asyncio.to_thread(_urllib_request, method, url, {**DEFAULT_HEADERS, **(headers or {})}, self.timeout)
+
+    async def request(self, method, url, headers=None):
+        # Paced by the host's learned rate; 429/503 slow the host down and the request is retried
+        # once the cooldown (Retry-After when given) has passed
+        host = urlsplit(url).hostname
+        if self.dns_cache:
+            cache_dns(host)
+        for attempt in range(MAX_ATTEMPTS):
+            async with self.rates.slot(host, max_concurrency=self.per_host) as outcome:
+                response = await self._send(method, url, headers)
+                outcome["status"] = response.status_code
+                outcome["retry_after"] = retry_after_seconds(response.headers.get("Retry-After"))
+            if response.status_code not in (429, 503):
+                break
+        return response
+
+    async def get(self, url, headers=None):
+        return await self.request("GET", url, headers=headers)
+
+    async def head(self, url, headers=None):
+        return await self.request("HEAD", url, headers=headers)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+# ---- sync client for code that is not async (e.g. inside Scrapy callbacks) ----
+
+_sync_client = None
+_sync_lock = threading.Lock()
+
+
+def _get_sync_client():
+    global _sync_client
+    with _sync_lock:
+        if _sync_client is None and httpx is not None:
+            _sync_client = httpx.Client(
+                http2=HTTP2, headers=DEFAULT_HEADERS, timeout=TIMEOUT_SECONDS, follow_redirects=True,
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS))
+    return _sync_client
+
+
+def get(url, headers=None):
+    # Blocking GET through a process-wide keep-alive client
+    client = _get_sync_client()
+    rates = get_controller()
+    host = urlsplit(url).hostname
+    if DNS_CACHE:
+        cache_dns(host)
+    for attempt in range(MAX_ATTEMPTS):
+        rates.wait_sync(host)
+        start = time.monotonic()
+        try:
+            if client is not None:
+                response = client.get(url, headers=headers)
+            else:
+                response = _urllib_request("GET", url, {**DEFAULT_HEADERS, **(headers or {})}, TIMEOUT_SECONDS)
+        except Exception:
+            rates.record(host, time.monotonic() - start, error=True)
+            raise
+        retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        if not rates.record(host, time.monotonic() - start, status=response.status_code, retry_after=retry_after):
+            break
+    return response
@@ -0,0 +1,214 @@
+# The purpose of this script is to keep unit offerings per (unit, year), separately from the unit
+# pages, so offerings for several years can be fetched and refreshed without re-crawling units.
+#
+# Records live in a packed store under ./offerings keyed "<unitCode>:<year>". Past years do not
+# change, so once stored they are never fetched again. The current and next year are refetched when
+# their copy is older than QUT_OFFERINGS_REFRESH_DAYS (default 7); run `refresh` on a schedule (cron,
+# Task Scheduler) to keep them current. Years are fetched in parallel through the shared HTTP client.
+# Every refresh appends new copies, so `refresh` compacts the store once it is done, unless a pipeline
+# run (main.py or a worker, which mark themselves in ./state/runs) is writing offerings through EUI.
+#
+# Usage:
+#   python scripts/offerings.py refresh                     # every unit in units.json, this year and next
+#   python scripts/offerings.py refresh 2024,2025,2026      # selected years
+#   python scripts/offerings.py get IFB104 [year]
+#   python scripts/offerings.py compact
+import asyncio
+import atexit
+import os
+import sys
+import time
+from datetime import datetime
+import http_client
+import serializer
+from http_client import HTTPClient
+from record_store import RecordStore
+
+OFFERINGS_DIR = "./offerings"
+OFFERINGS_URL = "https://www.qut.edu.au/study/unit/unit-sorcery/courseloop-subject-offerings?unitCode={unit_code}&years={year}"
+REFRESH_DAYS = float(os.environ.get("QUT_OFFERINGS_REFRESH_DAYS", 7))
+# Records are appended to the store in batches of this many
+STORE_BATCH = 200
+# Pipeline runs write a file named after their pid here while they run
+RUNS_DIR = "./state/runs"
+
+
+def open_offerings_store(directory=OFFERINGS_DIR):
+    return RecordStore("offerings", "key", directory=directory)
+
+
+def mark_pipeline_run():
+    # Called by main.py and workers, so compaction waits until no run is writing offerings
+    os.makedirs(RUNS_DIR, exist_ok=True)
+    marker = os.path.join(RUNS_DIR, str(os.getpid()))
+    with open(marker, "w") as f:
+        f.write(os.environ.get("QUT_RUN_ID", ""))
+    atexit.register(_remove_marker, marker)
+
+
+def _remove_marker(marker):
+    if os.path.exists(marker):
+        os.remove(marker)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def pipeline_running():
+    # True while another process marked as a pipeline run is alive. Markers of crashed runs are removed.
+    if not os.path.exists(RUNS_DIR):
+        return False
+    running = False
+    for filename in os.listdir(RUNS_DIR):
+        if not filename.isdigit() or int(filename) == os.getpid():
+            continue
+        if _pid_alive(int(filename)):
+            running = True
+        else:
+            try:
+                os.remove(os.path.join(RUNS_DIR, filename))
+            except OSError:
+                pass
+    return running
+
+
+def compact_offerings(store=None):
+    # Compact unless a pipeline run could be appending through EUI at the same time
+    if pipeline_running():
+        print("A pipeline run is in progress, not compacting the offerings store")
+        return False
+    (store or open_offerings_store()).compact()
+    return True
+
+
+def default_years():
+    year = datetime.now().year
+    return [year, year + 1]
+
+
+def offering_key(unit_code, year):
+    return f"{unit_code}:{year}"
+
+
+def needs_fetch(record, year, now=None):
+    # Past years are immutable once stored; the current and later years go stale after REFRESH_DAYS
+    if record is None:
+        return True
+    if int(year) < datetime.now().year:
+        return False
+    now = now or time.time()
+    return now - record.get("fetched_at", 0) > REFRESH_DAYS * 86400
+
+
+def _offerings_from_response(response, unit_code, year):
+    # The offerings list, or None when the request failed and nothing should be stored
+    if response.status_code != 200:
+        print(f"Failed to fetch offerings for {unit_code} in {year}: HTTP {response.status_code}")
+        return None
+    outlines = response.json() or []
+    print(f"Fetched {len(outlines)} offerings for {unit_code} in {year}")
+    return outlines
+
+
+def _record(unit_code, year, outlines):
+    return {
+        "key": offering_key(unit_code, year),
+        "unitCode": unit_code,
+        "year": int(year),
+        "offerings": outlines,
+        "fetched_at": time.time(),
+    }
+
+
+def get_offerings(unit_code, year, store=None):
+    store = store or open_offerings_store()
+    record = store.get(offering_key(unit_code, year))
+    return record["offerings"] if record else None
+
+
+def fetch_offerings_sync(unit_code, year, store=None):
+    # Stored offerings when still fresh, otherwise fetch and store them. Used by EUI.
+    store = store or open_offerings_store()
+    record = store.get(offering_key(unit_code, year))
+    if not needs_fetch(record, year):
+        return record["offerings"]
+    try:
+        outlines = _offerings_from_response(http_client.get(OFFERINGS_URL.format(unit_code=unit_code, year=year)), unit_code, year)
+    except Exception as e:
+        print(f"Error fetching offerings for {unit_code}: {str(e)}")
+        outlines = None
+    if outlines is None:
+        # Keep serving the last good copy when the refresh failed
+        return record["offerings"] if record else []
+    store.put(_record(unit_code, year, outlines))
+    return outlines
+
+
+async def _fetch(client, unit_code, year):
+    try:
+        response = await client.get(OFFERINGS_URL.format(unit_code=unit_code, year=year))
+        outlines = _offerings_from_response(response, unit_code, year)
+    except Exception as e:
+        print(f"Error fetching offerings for {unit_code} in {year}: {str(e)}")
+        outlines = None
+    return None if outlines is None else _record(unit_code, year, outlines)
+
+
+async def refresh(unit_codes, years=None, store=None):
+    # Fetch every (unit, year) that is missing or stale, all years in parallel
+    store = store or open_offerings_store()
+    years = years or default_years()
+    now = time.time()
+    due = [
+        (unit_code, year) for unit_code in unit_codes for year in years
+        if needs_fetch(store.get(offering_key(unit_code, year)), year, now)
+    ]
+    print(f"{len(due)} of {len(unit_codes) * len(years)} unit offerings need fetching")
+
+    fetched = failed = 0
+    async with HTTPClient() as client:
+        # The client paces requests per host, so all of them can be scheduled at once
+        for start in range(0, len(due), STORE_BATCH):
+            batch = due[start:start + STORE_BATCH]
+            records = await asyncio.gather(*(_fetch(client, unit_code, year) for unit_code, year in batch))
+            good = [record for record in records if record is not None]
+            if good:
+                store.put_many(good)
+            fetched += len(good)
+            failed += len(batch) - len(good)
+    print(f"Stored {fetched} unit offerings, {failed} failed")
+    if fetched:
+        # Drop the copies the refresh superseded
+        compact_offerings(store)
+    return fetched, failed
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "refresh"
+
+    if command == "refresh":
+        years = [int(year) for year in sys.argv[2].split(",")] if len(sys.argv) > 2 else None
+        unit_codes = serializer.load("units.json").get("unitCodes", []) if os.path.exists("units.json") else []
+        if not unit_codes:
+            print("No unit codes in units.json")
+            sys.exit(1)
+        asyncio.run(refresh(unit_codes, years))
+    elif command == "compact":
+        compact_offerings()
+    elif command == "get" and len(sys.argv) > 2:
+        unit_code = sys.argv[2].upper()
+        store = open_offerings_store()
+        years = [int(sys.argv[3])] if len(sys.argv) > 3 else sorted(
+            int(key.split(":")[1]) for key in store.keys() if key.startswith(f"{unit_code}:"))
+        for year in years:
+            print(f"{year}: {serializer.dumps(get_offerings(unit_code, year, store=store), indent=2).decode('utf-8')}")
+    else:
+        print(f"Unknown command: {' '.join(sys.argv[1:])}")
+        sys.exit(1)
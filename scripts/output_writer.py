@@ -0,0 +1,197 @@
+# Buffered, atomic writer for the per-record JSON files every stage produces
+# (./courses/<code>.json, ./units/<code>.json, ./course_to_unit/<code>.json, exports).
+#
+# Records are kept in memory and flushed in batches, once BATCH_SIZE records are pending or
+# FLUSH_SECONDS have passed since the last flush, and always on close. Callers flush themselves before
+# they report a record as saved: the stage scripts handle one item per process, so ECI and EUI flush
+# after their one record and EUFC after the two files of its course, and pdf_pool workers flush every
+# document before telling the parent it is done. Long loops such as the exports batch fully.
+# A flush of several files writes each one to a temp file next to its target, records the batch in a
+# journal under ./state/journal, then renames the temp files over their targets and removes the
+# journal. If the process dies half-way through the renames, the next process to open a writer
+# finishes them from the journal, so a batch lands either completely or not at all. A single file
+# needs no journal, its rename is atomic on its own.
+# Throughput of every writer is printed on close and appended to ./metrics/output_writer.jsonl.
+import atexit
+import os
+import tempfile
+import time
+from datetime import datetime
+import serializer
+
+JOURNAL_DIR = "./state/journal"
+METRICS_FILE = "./metrics/output_writer.jsonl"
+BATCH_SIZE = int(os.environ.get("QUT_WRITE_BATCH", 100))
+FLUSH_SECONDS = float(os.environ.get("QUT_WRITE_FLUSH_SECONDS", 5))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+_recovered = False
+
+
+def recover_once():
+    # Journals are only left behind by crashed processes, checking once per process is enough
+    global _recovered
+    if not _recovered:
+        _recovered = True
+        recover()
+
+
+def recover(journal_dir=JOURNAL_DIR):
+    # Finish the batches of writers that died between writing their temp files and renaming them
+    if not os.path.exists(journal_dir):
+        return 0
+    recovered = 0
+    for filename in os.listdir(journal_dir):
+        if not filename.endswith(".json") or filename.startswith("."):
+            continue
+        journal_path = os.path.join(journal_dir, filename)
+        try:
+            pid = int(filename.split("-")[-2])
+        except (IndexError, ValueError):
+            pid = None
+        if pid is not None and pid != os.getpid() and _pid_alive(pid):
+            continue  # still flushing
+        try:
+            entries = serializer.load(journal_path)
+        except (OSError, ValueError):
+            # The journal itself was not completely written, so no rename had started
+            entries = []
+        for tmp_path, path in entries:
+            if os.path.exists(tmp_path):
+                os.replace(tmp_path, path)
+                recovered += 1
+        os.remove(journal_path)
+    if recovered:
+        print(f"Recovered {recovered} files from interrupted writes")
+    return recovered
+
+
+class OutputWriter:
+    def __init__(self, stage, indent=4, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.stage = stage
+        self.indent = indent
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._sequence = 0
+        self.records = 0
+        self.bytes = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.started = time.monotonic()
+        recover_once()
+
+    def write(self, path, record, indent=None):
+        # Queue a record; a later write to the same path replaces it
+        self._pending[path] = (record, self.indent if indent is None else indent)
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return 0
+        start = time.perf_counter()
+        batch, self._pending = self._pending, {}
+        entries = []
+        try:
+            for path, (record, indent) in batch.items():
+                data = serializer.dumps(record, indent=indent)
+                directory = os.path.dirname(path) or "."
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                entries.append((tmp_path, path))
+                self.bytes += len(data)
+        except BaseException:
+            # Nothing has been renamed yet, drop the temp files and leave every target as it was
+            for tmp_path, _ in entries:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+
+        if len(entries) == 1:
+            os.replace(*entries[0])
+        else:
+            # The journal is the commit point: once it exists the batch is finished even after a crash
+            self._sequence += 1
+            journal_path = os.path.join(JOURNAL_DIR, f"{self.stage}-{os.getpid()}-{self._sequence}.json")
+            serializer.dump(entries, journal_path)
+            for tmp_path, path in entries:
+                os.replace(tmp_path, path)
+            os.remove(journal_path)
+
+        self.records += len(entries)
+        self.batches += 1
+        self.write_seconds += time.perf_counter() - start
+        return len(entries)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "stage": self.stage,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "records": self.records,
+            "batches": self.batches,
+            "mb": round(self.bytes / (1024 * 1024), 3),
+            "write_seconds": round(self.write_seconds, 3),
+            "records_per_second": round(self.records / self.write_seconds, 1) if self.write_seconds else None,
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+    def close(self):
+        self.flush()
+        if not self.records:
+            return
+        stats = self.stats()
+        print(f"{self.stage}: wrote {stats['records']} records ({stats['mb']} MB) in {stats['batches']} batches, "
+              f"{stats['records_per_second']} records/s")
+        try:
+            os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+            with open(METRICS_FILE, "ab") as f:
+                f.write(serializer.dumps(stats) + b"\n")
+        except OSError as e:
+            print(f"Could not record write metrics: {e}")
+        self.records = self.bytes = self.batches = 0
+        self.write_seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_stage_writers = {}
+
+
+def stage_writer(stage, indent=4):
+    # One writer per stage per process, flushed when the process exits
+    if stage not in _stage_writers:
+        writer = _stage_writers[stage] = OutputWriter(stage, indent=indent)
+        atexit.register(writer.close)
+    return _stage_writers[stage]
+
+
+def flush_all():
+    # Commit everything buffered by this process's stage writers
+    for writer in _stage_writers.values():
+        writer.flush()
+
+
+def close_all():
+    # For processes that end without running atexit handlers (multiprocessing workers)
+    for writer in _stage_writers.values():
+        writer.close()
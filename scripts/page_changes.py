@@ -0,0 +1,138 @@
+# Detects when a refetched course page has not changed, so ECI can skip parsing and rewriting it.
+#
+# The hash covers only the nodes the parser reads (HASHED_REGIONS, selected by the parser's own
+# XPaths), so changes to navigation, banners, tracking scripts or anything else on the page that does
+# not end up in the record do not count, while every change that does is caught. Hashes, the course code they
+# produced and when the page was last verified are kept in ./state/page_changes.db, apart from the
+# course records, which keep the day_obtained of their last real change.
+#
+# Usage:
+#   python scripts/page_changes.py stats
+#   python scripts/page_changes.py reset      # make the next run parse every page again
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PAGE_CHANGES_PATH = "./state/page_changes.db"
+# Bump when the parser reads new parts of the page, so every page is parsed again once
+HASH_VERSION = 2
+# The nodes ECI.parse reads, by the same XPaths (the elements rather than their text, so attributes
+# such as data-course-audience count too). Keep this list in step with the parser.
+HASHED_REGIONS = [
+    '//span[@data-course-map-key="courseTitle"]',                                          # course_name
+    '//dd[@data-course-map-key="reqTabCourseCode"]',                                       # course_code
+    '//div[contains(@class, "duration-icon")]//li[@data-course-audience]',                 # durations
+    '//div[contains(@class, "col-sm-10")]//b[contains(text(), "Delivery")]/following-sibling::ul',  # delivery_location
+    '//dd[contains(@class, "rank inverted")]',                                             # atar_rank
+    '//b[@data-course-audience="DOM" and contains(text(), "QTAC code")]/following-sibling::ul',      # qtac_code
+    '//b[@data-course-audience="INT" and contains(text(), "CRICOS")]/following-sibling::ul',        # cricos_code
+    '//div[contains(@class, "container course-highlights") and @data-course-audience="DOM"]//ul/li',  # highlights
+    '//div[contains(@class, "box-content")]/p[contains(text(), "CSP")]',                   # csp_cost
+    '//div[contains(@class, "panel-content row")]//div[contains(@class, "course-detail-item")]',     # what to expect
+    '//div[@data-course-map-key="careerOutcomesList"]//ul/li',                             # possible careers
+    '//script[@type="application/ld+json"]/text()',                                        # identifier
+]
+FORCE_PARSE = os.environ.get("QUT_FORCE_PARSE", "").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def _connect(path=PAGE_CHANGES_PATH):
+    # Open the page change database, commit on success and always close the connection
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            course_code TEXT,
+            content_hash TEXT NOT NULL,
+            changed_at REAL NOT NULL,
+            last_verified REAL NOT NULL
+        )
+    """)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def page_hash(response):
+    # Hash of the nodes the parser reads, taken straight from the fetched response. Each region is
+    # delimited, so a node moving from one region to another changes the hash.
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"v{HASH_VERSION}".encode())
+    for xpath in HASHED_REGIONS:
+        digest.update(b"\1")
+        for fragment in response.xpath(xpath).getall():
+            digest.update(b"\0")
+            digest.update(fragment.strip().encode("utf-8"))
+    return digest.hexdigest()
+
+
+def unchanged_course(url, content_hash, path=PAGE_CHANGES_PATH):
+    # Course code the page produced last time when its content is the same, None when it must be parsed
+    if FORCE_PARSE:
+        return None
+    with _connect(path) as conn:
+        row = conn.execute("SELECT course_code, content_hash FROM pages WHERE url = ?", (url,)).fetchone()
+    if row and row[1] == content_hash and row[0]:
+        return row[0]
+    return None
+
+
+def mark_verified(url, path=PAGE_CHANGES_PATH):
+    with _connect(path) as conn:
+        conn.execute("UPDATE pages SET last_verified = ? WHERE url = ?", (time.time(), url))
+
+
+def record_page(url, course_code, content_hash, path=PAGE_CHANGES_PATH):
+    # Called once the parsed record has been written
+    now = time.time()
+    with _connect(path) as conn:
+        conn.execute(
+            "INSERT INTO pages (url, course_code, content_hash, changed_at, last_verified) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET course_code = excluded.course_code, content_hash = excluded.content_hash, "
+            "changed_at = excluded.changed_at, last_verified = excluded.last_verified",
+            (url, course_code, content_hash, now, now))
+
+
+def verified_since(course_code, since, path=PAGE_CHANGES_PATH):
+    # Whether a page of the course was parsed or verified unchanged at or after `since`
+    with _connect(path) as conn:
+        row = conn.execute("SELECT MAX(last_verified) FROM pages WHERE course_code = ?", (course_code,)).fetchone()
+    return row[0] is not None and row[0] >= since
+
+
+def last_verified(path=PAGE_CHANGES_PATH):
+    # {course_code: {"changed": ISO date, "verified": ISO date}}
+    with _connect(path) as conn:
+        rows = conn.execute("SELECT course_code, changed_at, last_verified FROM pages").fetchall()
+    return {
+        code: {
+            "changed": datetime.fromtimestamp(changed).isoformat(timespec="seconds"),
+            "verified": datetime.fromtimestamp(verified).isoformat(timespec="seconds"),
+        }
+        for code, changed, verified in rows if code
+    }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+
+    if command == "stats":
+        with _connect() as conn:
+            total, unchanged = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(last_verified > changed_at), 0) FROM pages").fetchone()
+        print(f"{total} course pages tracked, {unchanged} verified unchanged since their last change")
+    elif command == "reset":
+        with _connect() as conn:
+            conn.execute("DELETE FROM pages")
+        print("Every course page will be parsed again on the next run")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,149 @@
+# Shared per-page layout extraction for course PDFs.
+# Each page's text and table rows are pulled out in a single pass over the document and cached,
+# so every extractor (semester blocks, unit codes, unit guide) works from the same parse
+# instead of calling page.get_text / page.find_tables again.
+#
+# Layouts are also cached on disk under ./cache/pdf_layout, keyed by the SHA-256 of the PDF, so an
+# unchanged PDF is never parsed by PyMuPDF twice, across runs and processes.
+#
+# Usage:
+#   python scripts/pdf_layout.py warm      # fill the cache for every PDF in ./pdf
+#   python scripts/pdf_layout.py stats
+import gzip
+import hashlib
+import os
+import sys
+import serializer
+from profiling import profile_item
+
+LAYOUT_CACHE_DIR = "./cache/pdf_layout"
+# Bump when the extraction changes so old cache entries are not reused
+LAYOUT_VERSION = 1
+
+# Parsed layouts kept in this process, keyed by (path, mtime, size) so a re-downloaded PDF is re-parsed
+_layout_cache = {}
+_sha256_cache = {}
+MAX_CACHED_LAYOUTS = 16
+
+
+def clean_row(row):
+    # Table cells come back as None or strings with stray whitespace
+    return [str(cell).strip() if cell else "" for cell in row]
+
+
+def _cache_key(pdf_path):
+    stat = os.stat(pdf_path)
+    return (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+
+
+def pdf_sha256(pdf_path):
+    # SHA-256 of the PDF, computed once per file version in this process
+    key = _cache_key(pdf_path)
+    sha256 = _sha256_cache.get(key)
+    if sha256 is None:
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        sha256 = _sha256_cache[key] = digest.hexdigest()
+    return sha256
+
+
+def _disk_cache_path(sha256):
+    return os.path.join(LAYOUT_CACHE_DIR, f"{sha256}.v{LAYOUT_VERSION}.json.gz")
+
+
+def iter_page_layouts(pdf_path):
+    # Stream a PDF page by page: yields each page's text and cleaned table rows and releases the
+    # page object (and MuPDF's cached resources for it) before moving on, so memory stays flat
+    # however long the document is
+    import fitz  # PyMuPDF, only needed when a PDF is not in the cache
+
+    doc = fitz.open(pdf_path)
+    try:
+        for page_number in range(doc.page_count):
+            page = doc.load_page(page_number)
+            rows = []
+            for table in page.find_tables():
+                rows.extend(clean_row(row) for row in table.extract())
+            text = page.get_text("text")
+            del page
+            fitz.TOOLS.store_shrink(100)
+            yield {"text": text, "rows": rows}
+    finally:
+        doc.close()
+
+
+def parse_layout(pdf_path):
+    # Extract text and cleaned table rows for every page; find_tables dominates on large PDFs
+    with profile_item("pdf_layout", os.path.basename(pdf_path)):
+        return list(iter_page_layouts(pdf_path))
+
+
+def read_cached_layout(sha256):
+    cache_path = _disk_cache_path(sha256)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with gzip.open(cache_path, "rb") as f:
+            return serializer.loads(f.read())
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable layout cache {cache_path}: {e}")
+        return None
+
+
+def write_cached_layout(sha256, pages):
+    # Compact JSON, gzipped, written atomically so concurrent workers never read half a file
+    serializer.write_atomic(_disk_cache_path(sha256), gzip.compress(serializer.dumps(pages), compresslevel=6))
+
+
+def load_layout(pdf_path):
+    # Return the per-page layout of a PDF from memory, then the disk cache, parsing it only if neither has it
+    key = _cache_key(pdf_path)
+    pages = _layout_cache.get(key)
+    if pages is None:
+        sha256 = pdf_sha256(pdf_path)
+        pages = read_cached_layout(sha256)
+        if pages is None:
+            pages = parse_layout(pdf_path)
+            write_cached_layout(sha256, pages)
+        if len(_layout_cache) >= MAX_CACHED_LAYOUTS:
+            _layout_cache.pop(next(iter(_layout_cache)))
+        _layout_cache[key] = pages
+    return pages
+
+
+def page_texts(pdf_path):
+    return [page["text"] for page in load_layout(pdf_path)]
+
+
+def table_rows(pdf_path):
+    # All table rows of the document in page order
+    return [row for page in load_layout(pdf_path) for row in page["rows"]]
+
+
+def clear_cache():
+    # Drop every cached layout, used by long-lived workers between documents
+    _layout_cache.clear()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    pdf_folder = sys.argv[2] if len(sys.argv) > 2 else "./pdf"
+
+    if command == "warm":
+        parsed = 0
+        for filename in sorted(os.listdir(pdf_folder)):
+            if filename.endswith(".pdf") and not filename.startswith("."):
+                pdf_path = os.path.join(pdf_folder, filename)
+                if read_cached_layout(pdf_sha256(pdf_path)) is None:
+                    write_cached_layout(pdf_sha256(pdf_path), parse_layout(pdf_path))
+                    parsed += 1
+        print(f"Parsed {parsed} PDFs into {LAYOUT_CACHE_DIR}")
+    elif command == "stats":
+        entries = os.listdir(LAYOUT_CACHE_DIR) if os.path.exists(LAYOUT_CACHE_DIR) else []
+        size_mb = sum(os.path.getsize(os.path.join(LAYOUT_CACHE_DIR, e)) for e in entries) / (1024 * 1024)
+        print(f"{len(entries)} cached layouts, {size_mb:.1f} MB")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,207 @@
+# The purpose of this script is to (re)analyse many course PDFs in parallel, in-process, with
+# bounded memory. Each worker process handles PDFs one after another and is replaced with a fresh
+# process after QUT_PDF_WORKER_MAX_DOCS documents or once its RSS passes QUT_PDF_WORKER_MAX_MB,
+# so PyMuPDF allocations cannot build up over hundreds of documents.
+# Peak RSS of every worker is written to ./metrics/pdf_pool.json.
+#
+# Usage:
+#   python scripts/pdf_pool.py            # every PDF in ./pdf that has a course record
+#   python scripts/pdf_pool.py 4          # with 4 worker processes
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+import serializer
+from enrichment import compact_enrichment
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MAX_DOCS_PER_WORKER = int(os.environ.get("QUT_PDF_WORKER_MAX_DOCS", 50))
+MAX_MB_PER_WORKER = float(os.environ.get("QUT_PDF_WORKER_MAX_MB", 500))
+METRICS_FILE = "./metrics/pdf_pool.json"
+
+
+def current_rss_mb():
+    # Resident set size of this process right now, falling back to the peak where /proc is missing
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def worker_loop(tasks, results, max_docs, max_mb):
+    # Runs in the worker process
+    import EUFC
+    import pdf_layout
+    import output_writer
+    import profiling
+
+    docs = 0
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        course_code, course_id = task
+        results.put({"type": "start", "pid": os.getpid(), "course_code": course_code})
+        start = time.perf_counter()
+        try:
+            with profiling.profile_item("EUFC", course_code):
+                unit_codes = EUFC.process_course_pdf(course_code, course_id, update_units_json=False)
+            error = None
+        except Exception as e:
+            unit_codes, error = [], str(e)
+        try:
+            # The parent counts the document as done once it gets the result, so nothing may still be buffered
+            output_writer.flush_all()
+        except Exception as e:
+            unit_codes, error = [], f"could not write results: {e}"
+        pdf_layout.clear_cache()
+        docs += 1
+        rss = current_rss_mb()
+        results.put({
+            "type": "result", "pid": os.getpid(), "course_code": course_code, "unit_codes": unit_codes,
+            "error": error, "seconds": time.perf_counter() - start, "rss_mb": rss,
+        })
+        if docs >= max_docs or rss >= max_mb:
+            break
+    # Worker processes skip atexit handlers, so commit the buffered course files here
+    output_writer.close_all()
+    if profiling.ENABLED:
+        profiling.write_summary()
+    # Tell the parent we are leaving so it can start a replacement
+    results.put({"type": "exit", "pid": os.getpid(), "docs": docs, "peak_rss_mb": peak_rss_mb()})
+
+
+def run_pool(jobs, workers=None, max_docs=MAX_DOCS_PER_WORKER, max_mb=MAX_MB_PER_WORKER):
+    # jobs is a list of (course_code, course_id). Returns the run metrics.
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for job in jobs:
+        tasks.put(job)
+
+    def start_worker():
+        process = multiprocessing.Process(target=worker_loop, args=(tasks, results, max_docs, max_mb))
+        process.start()
+        return process
+
+    alive = {}
+    in_flight = {}  # pid -> course code it is working on
+    for _ in range(min(workers, len(jobs))):
+        process = start_worker()
+        alive[process.pid] = process
+
+    all_unit_codes = set()
+    metrics = {"started": datetime.now().isoformat(timespec="seconds"), "documents": 0, "failed": [],
+               "workers": [], "recycled": 0}
+    remaining = len(jobs)
+    start = time.perf_counter()
+
+    while remaining:
+        try:
+            message = results.get(timeout=5)
+        except queue.Empty:
+            # A worker that crashed (e.g. killed for running out of memory) never reports back
+            for pid, process in list(alive.items()):
+                if not process.is_alive():
+                    alive.pop(pid)
+                    lost = in_flight.pop(pid, None)
+                    print(f"Worker {pid} died with exit code {process.exitcode}")
+                    if lost:
+                        remaining -= 1
+                        metrics["failed"].append(lost)
+                    if remaining > len(alive):
+                        metrics["recycled"] += 1
+                        process = start_worker()
+                        alive[process.pid] = process
+            continue
+
+        if message["type"] == "start":
+            in_flight[message["pid"]] = message["course_code"]
+        elif message["type"] == "result":
+            in_flight.pop(message["pid"], None)
+            remaining -= 1
+            metrics["documents"] += 1
+            if message["error"]:
+                print(f"Error processing {message['course_code']}: {message['error']}")
+                metrics["failed"].append(message["course_code"])
+            else:
+                all_unit_codes.update(message["unit_codes"])
+                print(f"Processed {message['course_code']} in {message['seconds']:.1f}s (worker RSS {message['rss_mb']:.0f} MB)")
+        elif message["pid"] in alive:
+            alive.pop(message["pid"]).join()
+            metrics["workers"].append({key: message[key] for key in ("pid", "docs", "peak_rss_mb")})
+            # Replace the worker while there is still work it could take
+            if remaining > len(alive):
+                metrics["recycled"] += 1
+                process = start_worker()
+                alive[process.pid] = process
+
+    # Shut the remaining workers down and collect their peak RSS
+    for _ in alive:
+        tasks.put(None)
+    while alive:
+        try:
+            message = results.get(timeout=30)
+        except queue.Empty:
+            break
+        if message["type"] == "exit" and message["pid"] in alive:
+            alive.pop(message["pid"]).join()
+            metrics["workers"].append({key: message[key] for key in ("pid", "docs", "peak_rss_mb")})
+
+    metrics["seconds"] = round(time.perf_counter() - start, 2)
+    metrics["max_worker_peak_rss_mb"] = max((w["peak_rss_mb"] for w in metrics["workers"]), default=0)
+
+    # units.json is written once here instead of by every worker
+    if all_unit_codes:
+        import EUFC
+        EUFC.save_units_to_json(None, all_unit_codes, None, "units.json")
+    compact_enrichment()
+
+    serializer.dump(metrics, METRICS_FILE, indent=4)
+    print(f"Processed {metrics['documents']} PDFs in {metrics['seconds']}s, "
+          f"peak worker RSS {metrics['max_worker_peak_rss_mb']:.0f} MB. Metrics saved to {METRICS_FILE}")
+    return metrics
+
+
+def collect_jobs(pdf_folder="./pdf", course_folder="./courses"):
+    # Every downloaded PDF whose course record gives us the identifier
+    jobs = []
+    for filename in sorted(os.listdir(pdf_folder)):
+        if not filename.endswith(".pdf") or filename.startswith("."):
+            continue
+        course_code = filename[:-len(".pdf")]
+        course_file = os.path.join(course_folder, f"{course_code}.json")
+        if not os.path.exists(course_file):
+            print(f"No course record for {course_code}, skipping")
+            continue
+        course_id = serializer.load(course_file).get("identifier")
+        if course_id:
+            jobs.append((course_code, course_id))
+    return jobs
+
+
+if __name__ == "__main__":
+    import profiling
+    # One profiling summary over every worker process (QUT_PROFILE)
+    profiling.aggregate_run_at_exit()
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    jobs = collect_jobs()
+    if not jobs:
+        print("No PDFs to process")
+    else:
+        run_pool(jobs, workers=workers)
@@ -0,0 +1,254 @@
+# The purpose of this script is to build the prerequisite graph of every scraped unit and answer
+# "can a student take X after Y" style questions without walking unit files.
+#
+# Prerequisites are kept as boolean expressions: a unit code, {"and": [...]} or {"or": [...]}.
+# The graph itself is stored as adjacency arrays (indptr/indices, one row per unit listing the units
+# its prerequisites mention), along with topological levels, the transitive closure of every unit as
+# a bitset, prerequisite cycles and references to units that were never scraped.
+# It is cached in ./cache/prereq_graph.json and rebuilt when the unit records change.
+#
+# Usage:
+#   python scripts/prereq_graph.py build
+#   python scripts/prereq_graph.py check IFB240 IFB104 IFB105   # can IFB240 be taken after these?
+#   python scripts/prereq_graph.py requires IFB240
+#   python scripts/prereq_graph.py stats
+import os
+import sys
+from collections import deque
+import numpy as np
+import serializer
+from text_utils import combine_expression
+from unit_analytics import load_unit_records, source_mtime
+
+GRAPH_PATH = "./cache/prereq_graph.json"
+# Bump when the cached graph layout changes
+GRAPH_VERSION = 1
+
+
+# ---- prerequisite expressions ----
+
+def expression_codes(expr):
+    # Every unit code an expression mentions; {"other": text} requirements mention none
+    if expr is None:
+        return []
+    if isinstance(expr, str):
+        return [expr]
+    operands = expr.get("and") or expr.get("or") or []
+    return [code for operand in operands for code in expression_codes(operand)]
+
+
+def satisfied(expr, completed):
+    # Whether the completed units (a set of codes) satisfy a prerequisite expression
+    if expr is None:
+        return True
+    if isinstance(expr, str):
+        return expr in completed
+    if "other" in expr:
+        # A requirement that is not a unit (e.g. admission to a course) cannot be checked, assume it is met
+        return True
+    if "and" in expr:
+        return all(satisfied(operand, completed) for operand in expr["and"])
+    return any(satisfied(operand, completed) for operand in expr["or"])
+
+
+def record_expression(record):
+    # Units scraped before prerequisites_expr existed only have the flat list; treat it as "all of"
+    if "prerequisites_expr" in record:
+        return record["prerequisites_expr"]
+    return combine_expression("and", record.get("prerequisites") or [])
+
+
+# ---- graph ----
+
+class PrereqGraph:
+    def __init__(self, units, expressions, indptr, indices, levels, closures, cycles, dangling):
+        self.units = units
+        self.index = {code: i for i, code in enumerate(units)}
+        self.expressions = expressions
+        self.indptr = indptr
+        self.indices = indices
+        self.levels = levels
+        self.closures = closures
+        self.cycles = cycles
+        self.dangling = dangling
+
+    def prerequisites_of(self, unit_code):
+        # Units directly mentioned in a unit's prerequisites
+        i = self.index[unit_code]
+        return [self.units[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def all_prerequisites(self, unit_code):
+        # Every unit reachable through prerequisites, at any depth
+        closure = self.closures[self.index[unit_code]]
+        return [code for j, code in enumerate(self.units) if closure >> j & 1]
+
+    def depends_on(self, unit_code, other_code):
+        # Whether other_code appears anywhere in unit_code's prerequisite chain
+        return bool(self.closures[self.index[unit_code]] >> self.index[other_code] & 1)
+
+    def can_take(self, unit_code, completed):
+        return satisfied(self.expressions.get(unit_code), set(completed))
+
+    def to_dict(self):
+        return {
+            "version": GRAPH_VERSION,
+            "units": self.units,
+            "expressions": self.expressions,
+            "indptr": self.indptr.tolist(),
+            "indices": self.indices.tolist(),
+            "levels": self.levels.tolist(),
+            "closures": [format(c, "x") for c in self.closures],
+            "cycles": self.cycles,
+            "dangling": self.dangling,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["units"], data["expressions"],
+            np.array(data["indptr"], dtype=np.int32), np.array(data["indices"], dtype=np.int32),
+            np.array(data["levels"], dtype=np.int32), [int(c, 16) for c in data["closures"]],
+            data["cycles"], data["dangling"],
+        )
+
+
+def build_graph(records):
+    # Unit codes that prerequisites mention but that were never scraped become nodes too, so every
+    # edge has both ends in the arrays; they are reported as dangling
+    expressions = {r["unitCode"]: record_expression(r) for r in records if r.get("unitCode")}
+    referenced = {code for expr in expressions.values() for code in expression_codes(expr)}
+    dangling = {}
+    for unit_code, expr in expressions.items():
+        for code in expression_codes(expr):
+            if code not in expressions:
+                dangling.setdefault(code, []).append(unit_code)
+    units = sorted(set(expressions) | referenced)
+    index = {code: i for i, code in enumerate(units)}
+
+    # Adjacency arrays, unit -> the units its prerequisites mention
+    rows = [sorted({index[code] for code in expression_codes(expressions.get(unit_code))}) for unit_code in units]
+    indptr = np.zeros(len(units) + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.array([j for row in rows for j in row], dtype=np.int32)
+
+    # Kahn's algorithm from units without prerequisites upwards; a unit's level is one more than
+    # the deepest of its prerequisites
+    dependents = [[] for _ in units]
+    for i, row in enumerate(rows):
+        for j in row:
+            dependents[j].append(i)
+    pending = np.diff(indptr)
+    levels = np.full(len(units), -1, dtype=np.int32)
+    closures = [0] * len(units)
+    ready = deque(i for i in range(len(units)) if pending[i] == 0)
+    for i in ready:
+        levels[i] = 0
+    while ready:
+        i = ready.popleft()
+        for j in rows[i]:
+            closures[i] |= closures[j] | (1 << j)
+        for k in dependents[i]:
+            levels[k] = max(levels[k], levels[i] + 1)
+            pending[k] -= 1
+            if pending[k] == 0:
+                ready.append(k)
+
+    # Whatever was never released sits on or behind a cycle
+    cyclic = [i for i in range(len(units)) if pending[i] > 0]
+    cycles = find_cycles(rows, cyclic, units)
+    if cyclic:
+        # Close the remaining units by iterating until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for i in cyclic:
+                closure = closures[i]
+                for j in rows[i]:
+                    closure |= closures[j] | (1 << j)
+                if closure != closures[i]:
+                    closures[i] = closure
+                    changed = True
+
+    return PrereqGraph(
+        units, {code: expressions.get(code) for code in units}, indptr, indices, levels, closures,
+        cycles, {code: sorted(users) for code, users in sorted(dangling.items())},
+    )
+
+
+def find_cycles(rows, candidates, units):
+    # Prerequisite cycles found by depth-first search over the units Kahn's algorithm could not order
+    candidate_set = set(candidates)
+    visited = set()
+    cycles = []
+    for start in candidates:
+        if start in visited:
+            continue
+        path, on_path = [], {}
+        stack = [(start, iter(rows[start]))]
+        on_path[start] = 0
+        path.append(start)
+        while stack:
+            node, children = stack[-1]
+            advanced = False
+            for child in children:
+                if child not in candidate_set:
+                    continue
+                if child in on_path:
+                    cycles.append([units[i] for i in path[on_path[child]:]])
+                    continue
+                if child not in visited:
+                    on_path[child] = len(path)
+                    path.append(child)
+                    stack.append((child, iter(rows[child])))
+                    advanced = True
+                    break
+            if not advanced:
+                stack.pop()
+                visited.add(node)
+                on_path.pop(node, None)
+                path.pop()
+    # The same cycle can be found from different starting points
+    unique = {}
+    for cycle in cycles:
+        unique.setdefault(frozenset(cycle), cycle)
+    return list(unique.values())
+
+
+def load_graph(rebuild=False):
+    # Cached graph, rebuilt when the unit records changed since it was written
+    if not rebuild and os.path.exists(GRAPH_PATH) and os.path.getmtime(GRAPH_PATH) >= source_mtime():
+        data = serializer.load(GRAPH_PATH)
+        if data.get("version") == GRAPH_VERSION:
+            return PrereqGraph.from_dict(data)
+    graph = build_graph(load_unit_records())
+    serializer.dump(graph.to_dict(), GRAPH_PATH)
+    return graph
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+
+    if command == "build":
+        graph = load_graph(rebuild=True)
+        print(f"Built prerequisite graph of {len(graph.units)} units in {GRAPH_PATH}")
+    elif command == "check":
+        graph = load_graph()
+        unit_code, completed = sys.argv[2].upper(), [code.upper() for code in sys.argv[3:]]
+        if unit_code not in graph.index:
+            print(f"Unknown unit {unit_code}")
+            sys.exit(1)
+        print(f"{unit_code} prerequisites: {serializer.dumps(graph.expressions[unit_code]).decode('utf-8')}")
+        print(f"Can take {unit_code} after {', '.join(completed) or 'nothing'}: {graph.can_take(unit_code, completed)}")
+    elif command == "requires":
+        graph = load_graph()
+        unit_code = sys.argv[2].upper()
+        print(f"Level {graph.levels[graph.index[unit_code]]}: {', '.join(graph.all_prerequisites(unit_code)) or 'no prerequisites'}")
+    elif command == "stats":
+        graph = load_graph()
+        print(f"{len(graph.units)} units, {len(graph.indices)} prerequisite edges, {int(graph.levels.max(initial=0)) + 1} levels")
+        print(f"{len(graph.dangling)} dangling references, {len(graph.cycles)} cycles")
+        for cycle in graph.cycles:
+            print("Cycle: " + " -> ".join(cycle + cycle[:1]))
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
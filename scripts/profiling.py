@@ -0,0 +1,238 @@
+# Opt-in profiling of pipeline stages and of the individual items (course pages, unit pages, PDFs)
+# they process.
+#
+# Set QUT_PROFILE to turn it on:
+#   QUT_PROFILE=cpu   cProfile every item
+#   QUT_PROFILE=mem   trace allocations with tracemalloc
+#   QUT_PROFILE=all   both
+# Items that take longer than QUT_PROFILE_SLOW_SECONDS (default 5) get their own profile
+# (./profiles/<stage>/<item>.prof, open with snakeviz or pstats) and, with memory tracing, a list of
+# their top allocation sites (<item>.mem.txt). Memory peaks are measured from the start of the
+# outermost item, so a nested item (a PDF layout inside EUFC) does not reset its parent's peak.
+#
+# main.py, pdf_pool.py and worker.py run their items in child processes. They call
+# aggregate_run_at_exit(): every process of the run (QUT_RUN_ID) then saves its stage profiles and
+# timings under ./profiles/run-<id>/ when it exits, and the parent merges them into one
+# ./profiles/summary-<id>.txt with the hotspots and slowest items of each stage, and prints it.
+# A script run on its own writes ./profiles/summary-<pid>.txt instead.
+# With QUT_PROFILE unset the hooks return a shared no-op context manager and cost next to nothing.
+#
+# Usage:
+#   python scripts/profiling.py summary        # hotspots over every .prof file in ./profiles
+import atexit
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import time
+import tracemalloc
+import uuid
+import serializer
+
+PROFILE_DIR = "./profiles"
+MODE = os.environ.get("QUT_PROFILE", "").lower()
+ENABLED = MODE in ("1", "true", "cpu", "mem", "all")
+PROFILE_CPU = ENABLED and MODE != "mem"
+PROFILE_MEMORY = MODE in ("mem", "all")
+SLOW_SECONDS = float(os.environ.get("QUT_PROFILE_SLOW_SECONDS", 5))
+TOP_ENTRIES = 20
+TRACEBACK_FRAMES = 10
+
+_NOOP = contextlib.nullcontext()
+_stage_stats = {}    # stage -> pstats.Stats over all its items
+_timings = {}        # stage -> [(item, seconds)]
+_active = False      # only one cProfile may run at a time; nested items are only timed
+_memory_depth = 0    # items inside which memory is being traced; only the outermost resets the peak
+_saved = False
+
+
+def _safe_name(item):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(item))[-120:] or "item"
+
+
+class _ItemProfile:
+    def __init__(self, stage, item):
+        self.stage = stage
+        self.item = item
+        self.profiler = None
+
+    def __enter__(self):
+        global _active
+        if PROFILE_CPU and not _active:
+            self.profiler = cProfile.Profile()
+            _active = True
+            self.profiler.enable()
+        if PROFILE_MEMORY:
+            global _memory_depth
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEBACK_FRAMES)
+            if _memory_depth == 0:
+                tracemalloc.reset_peak()
+            self.outermost = _memory_depth == 0
+            _memory_depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active, _memory_depth
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            _active = False
+        if PROFILE_MEMORY:
+            _memory_depth -= 1
+        _timings.setdefault(self.stage, []).append((str(self.item), elapsed))
+
+        if self.profiler is not None:
+            stats = _stage_stats.get(self.stage)
+            if stats is None:
+                _stage_stats[self.stage] = pstats.Stats(self.profiler)
+            else:
+                stats.add(self.profiler)
+
+        if elapsed >= SLOW_SECONDS:
+            directory = os.path.join(PROFILE_DIR, _safe_name(self.stage))
+            os.makedirs(directory, exist_ok=True)
+            base = os.path.join(directory, _safe_name(self.item))
+            saved = []
+            if self.profiler is not None:
+                self.profiler.dump_stats(base + ".prof")
+                saved.append(base + ".prof")
+            if PROFILE_MEMORY:
+                _, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ENTRIES]
+                since = "" if self.outermost else " (since the enclosing item started)"
+                with open(base + ".mem.txt", "w", encoding="utf-8") as f:
+                    f.write(f"Peak traced memory{since}: {peak / (1024 * 1024):.1f} MB\n")
+                    f.writelines(f"{stat}\n" for stat in top)
+                saved.append(base + ".mem.txt")
+            print(f"[profile] {self.stage} {self.item} took {elapsed:.1f}s, saved {', '.join(saved) or 'timing only'}")
+        return False
+
+
+def profile_item(stage, item):
+    # Context manager around the work for one item of a stage
+    if not ENABLED:
+        return _NOOP
+    return _ItemProfile(stage, item)
+
+
+def profile_stage(name):
+    # A whole stage of main.py, timed (and profiled unless an item inside is) like an item of "stages"
+    return profile_item("stages", name)
+
+
+def _top_functions(stats, limit=TOP_ENTRIES):
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+def summary(timings=None, stage_stats=None):
+    # Slowest items and hotspots of every stage, by default of the ones seen in this process
+    timings = _timings if timings is None else timings
+    stage_stats = _stage_stats if stage_stats is None else stage_stats
+    lines = []
+    for stage, items in timings.items():
+        total = sum(seconds for _, seconds in items)
+        lines.append(f"== {stage}: {len(items)} items, {total:.1f}s")
+        for item, seconds in sorted(items, key=lambda t: -t[1])[:5]:
+            lines.append(f"   {seconds:8.2f}s  {item}")
+        if stage in stage_stats:
+            lines.append(_top_functions(stage_stats[stage]))
+    return "\n".join(lines)
+
+
+def _run_dir():
+    run_id = os.environ.get("QUT_RUN_ID")
+    return os.path.join(PROFILE_DIR, f"run-{_safe_name(run_id)}") if run_id else None
+
+
+def write_summary():
+    # Save what this process profiled: into the run's folder for the parent to merge when the process
+    # is part of a run, as its own summary otherwise. Worker processes that skip atexit call this.
+    global _saved
+    if _saved or not _timings:
+        return
+    _saved = True
+    run_dir = _run_dir()
+    if run_dir:
+        os.makedirs(run_dir, exist_ok=True)
+        pid = os.getpid()
+        for stage, stats in _stage_stats.items():
+            stats.dump_stats(os.path.join(run_dir, f"{_safe_name(stage)}-{pid}.prof"))
+        serializer.dump({"pid": pid, "timings": _timings}, os.path.join(run_dir, f"timings-{pid}.json"))
+        return
+    text = summary()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"summary-{os.getpid()}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    print(text)
+    print(f"[profile] summary saved to {path}")
+
+
+def write_run_summary():
+    # Merge the profiles and timings every process of the run saved into one summary
+    write_summary()
+    run_dir = _run_dir()
+    if not run_dir or not os.path.isdir(run_dir):
+        return
+    timings, stage_stats = {}, {}
+    for name in sorted(os.listdir(run_dir)):
+        path = os.path.join(run_dir, name)
+        if name.startswith("timings-") and name.endswith(".json"):
+            for stage, items in serializer.load(path)["timings"].items():
+                timings.setdefault(_safe_name(stage), []).extend((item, seconds) for item, seconds in items)
+        elif name.endswith(".prof"):
+            stage = name[:-len(".prof")].rsplit("-", 1)[0]
+            if stage in stage_stats:
+                stage_stats[stage].add(path)
+            else:
+                stage_stats[stage] = pstats.Stats(path)
+    if not timings:
+        return
+    text = summary(timings, stage_stats)
+    path = os.path.join(PROFILE_DIR, f"summary-{os.path.basename(run_dir)[len('run-'):]}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    print(text)
+    print(f"[profile] summary of {len(os.listdir(run_dir))} files from this run saved to {path}")
+
+
+def aggregate_run_at_exit():
+    # Called by the parent of a run before it starts child processes: gives the run an id (inherited
+    # by the children through the environment) and merges everything they saved when it exits
+    if not ENABLED:
+        return
+    os.environ.setdefault("QUT_RUN_ID", uuid.uuid4().hex)
+    atexit.register(write_run_summary)
+
+
+if ENABLED:
+    atexit.register(write_summary)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "summary"
+
+    if command == "summary":
+        files = [
+            os.path.join(root, name) for root, _, names in os.walk(PROFILE_DIR)
+            for name in names if name.endswith(".prof")
+        ]
+        if not files:
+            print(f"No profiles in {PROFILE_DIR}, run with QUT_PROFILE=cpu first")
+            sys.exit(0)
+        stats = pstats.Stats(files[0])
+        for path in files[1:]:
+            stats.add(path)
+        print(f"Hotspots over {len(files)} slow items:")
+        print(_top_functions(stats, limit=30))
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
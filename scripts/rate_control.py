@@ -0,0 +1,320 @@
+# Adaptive request rate per host, replacing fixed sleeps between requests.
+#
+# Each host has a request rate (requests per second) that follows AIMD: every ADJUST_EVERY completed
+# requests it grows by RATE_INCREASE while the p95 latency and the error rate stay healthy, and it is
+# cut to RATE_BACKOFF of itself on 429/503 (waiting out Retry-After when the server sends it) or to
+# SLOW_FACTOR of itself when p95 latency rises above SLOWDOWN_RATIO times the fastest p50 seen for the
+# host. Concurrency follows from the rate and the typical latency (Little's law).
+# Learned rates are saved to ./state/rates.json so the next run starts where this one left off.
+#
+# Request slots are shared by every process on the machine through a small pacing file per host in
+# ./state/pace, so main.py, the stage scripts it starts and parallel workers keep one spacing between
+# them. Requests to the course and unit pages (PAGE_HOST) are never closer than QUT_MIN_PAGE_DELAY
+# seconds (default 1). The scrapy spiders do not go through the controller: they print their page's
+# status with report_status() and main.py feeds it back with read_statuses(), so 429/503 still back off.
+# Requests that got no response at all (timeout, DNS, refused) are reported with report_error().
+#
+# Usage:
+#   python scripts/rate_control.py            # show the learned rates
+#   python scripts/rate_control.py reset      # also clears the shared pacing files
+import asyncio
+import atexit
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import serializer
+
+RATES_PATH = "./state/rates.json"
+DEFAULT_RATE = 0.5      # what the old 1-5 second sleeps amounted to
+MIN_RATE = 0.05
+MAX_RATE = float(os.environ.get("QUT_MAX_RATE", 5))
+MAX_CONCURRENCY = int(os.environ.get("QUT_HTTP_PER_HOST", 4))
+RATE_INCREASE = 0.1
+RATE_BACKOFF = 0.5
+SLOW_FACTOR = 0.75
+SLOWDOWN_RATIO = 2.5
+MAX_ERROR_RATE = 0.1
+ADJUST_EVERY = 10
+WINDOW = 50
+SAVE_INTERVAL_SECONDS = 10
+BACKOFF_STATUSES = (429, 503)
+PACE_DIR = "./state/pace"
+PAGE_HOST = "www.qut.edu.au"
+MIN_PAGE_DELAY = float(os.environ.get("QUT_MIN_PAGE_DELAY", 1))
+STATUS_PREFIX = "rate-status"
+# Scrapy's default retry codes without the back-off statuses, which are left to the controller
+RETRY_HTTP_CODES = [500, 502, 504, 522, 524, 408]
+
+
+def retry_after_seconds(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _pace_path(host):
+    return os.path.join(PACE_DIR, re.sub(r"[^A-Za-z0-9_.-]", "_", host))
+
+
+def shared_reserve(host, earliest, interval):
+    # Take the next free slot of the host across processes, no earlier than `earliest` (wall clock).
+    # The pacing file holds the time the following slot becomes free. Returns the slot's start.
+    path = _pace_path(host)
+    with serializer.locked(path):
+        try:
+            with open(path, "rb") as f:
+                next_free = float(f.read() or 0)
+        except (OSError, ValueError):
+            next_free = 0.0
+        start = max(earliest, next_free)
+        with open(path, "wb") as f:
+            f.write(repr(start + interval).encode())
+    return start
+
+
+class HostRate:
+    def __init__(self, host, rate=DEFAULT_RATE, latency_floor=None, min_interval=0.0, shared=True):
+        self.host = host
+        self.min_interval = min_interval
+        self.shared = shared
+        self.rate = min(MAX_RATE, max(MIN_RATE, rate))
+        self.latency_floor = latency_floor
+        self.latencies = deque(maxlen=WINDOW)
+        self.errors = deque(maxlen=WINDOW)
+        self.next_allowed = 0.0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.since_adjust = 0
+        self._lock = threading.Lock()
+
+    def interval(self):
+        return max(1 / self.rate, self.min_interval)
+
+    def reserve(self):
+        # Reserve the next request slot and return how long to wait before using it
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.next_allowed, self.cooldown_until)
+            if self.shared:
+                # Other processes may have taken the slot, or be cooling down for this host
+                wall_now = time.time()
+                start = now + shared_reserve(self.host, wall_now + start - now, self.interval()) - wall_now
+            self.next_allowed = start + self.interval()
+            return start - now
+
+    def concurrency(self, cap=MAX_CONCURRENCY):
+        # Requests in flight needed to sustain the rate at the typical latency
+        if not self.latencies:
+            return 1
+        return max(1, min(cap, math.ceil(self.rate * _percentile(self.latencies, 0.5))))
+
+    def record(self, latency, status=None, error=False, retry_after=None):
+        # Feed one completed request back. Returns True when the host asked us to back off.
+        with self._lock:
+            if status in BACKOFF_STATUSES:
+                self.rate = max(MIN_RATE, self.rate * RATE_BACKOFF)
+                wait = retry_after if retry_after is not None else 1 / self.rate
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + wait)
+                if self.shared:
+                    # Hold the other processes back as well
+                    shared_reserve(self.host, time.time() + wait, 0)
+                self.latencies.clear()
+                self.errors.clear()
+                self.since_adjust = 0
+                print(f"{self.host} asked to back off ({status}), rate now {self.rate:.2f}/s, waiting {wait:.1f}s")
+                return True
+
+            self.latencies.append(latency)
+            self.errors.append(bool(error or (status is not None and status >= 500)))
+            self.since_adjust += 1
+            if self.since_adjust < ADJUST_EVERY:
+                return False
+            self.since_adjust = 0
+
+            p50, p95 = _percentile(self.latencies, 0.5), _percentile(self.latencies, 0.95)
+            self.latency_floor = p50 if self.latency_floor is None else min(self.latency_floor, p50)
+            error_rate = sum(self.errors) / len(self.errors)
+            if error_rate > MAX_ERROR_RATE or p95 > self.latency_floor * SLOWDOWN_RATIO:
+                self.rate = max(MIN_RATE, self.rate * SLOW_FACTOR)
+            else:
+                self.rate = min(MAX_RATE, self.rate + RATE_INCREASE)
+            return False
+
+
+class RateController:
+    def __init__(self, path=RATES_PATH):
+        self.path = path
+        self.hosts = {}
+        self._saved = {}
+        self._last_save = 0.0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                self._saved = serializer.load(path)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable rates file {path}: {e}")
+
+    def host(self, host):
+        with self._lock:
+            if host not in self.hosts:
+                saved = self._saved.get(host, {})
+                # Stage keys of main.py pace script runs in this process only
+                self.hosts[host] = HostRate(
+                    host, saved.get("rate", DEFAULT_RATE), saved.get("latency_floor"),
+                    min_interval=MIN_PAGE_DELAY if host == PAGE_HOST else 0.0,
+                    shared=not host.startswith("stage:"))
+            return self.hosts[host]
+
+    def record(self, host, latency, status=None, error=False, retry_after=None):
+        backed_off = self.host(host).record(latency, status=status, error=error, retry_after=retry_after)
+        if backed_off or time.monotonic() - self._last_save > SAVE_INTERVAL_SECONDS:
+            self.save()
+        return backed_off
+
+    def save(self):
+        # Merge with what other processes saved since we loaded, our hosts win
+        with self._lock:
+            self._last_save = time.monotonic()
+            saved = {}
+            if os.path.exists(self.path):
+                try:
+                    saved = serializer.load(self.path)
+                except (OSError, ValueError):
+                    pass
+            for name, state in self.hosts.items():
+                saved[name] = {"rate": round(state.rate, 4), "latency_floor": state.latency_floor, "updated": int(time.time())}
+        try:
+            serializer.dump(saved, self.path, indent=4)
+        except OSError as e:
+            print(f"Could not save rates to {self.path}: {e}")
+
+    def wait_sync(self, host):
+        # Blocking pacing for code outside the event loop
+        delay = self.host(host).reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait(self, host):
+        # Pacing for a request made outside the controller, e.g. by a spider in a child process
+        delay = self.host(host).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, host, max_concurrency=MAX_CONCURRENCY):
+        # Wait for the host's pacing and concurrency limit, then time the request made inside.
+        # The caller sets outcome["status"], outcome["error"] or outcome["retry_after"].
+        state = self.host(host)
+        while state.in_flight >= state.concurrency(max_concurrency):
+            await asyncio.sleep(0.05)
+        state.in_flight += 1
+        try:
+            delay = state.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            outcome = {"status": None, "error": False, "retry_after": None}
+            start = time.monotonic()
+            try:
+                yield outcome
+            except Exception:
+                outcome["error"] = True
+                raise
+            finally:
+                self.record(host, time.monotonic() - start, **outcome)
+        finally:
+            state.in_flight -= 1
+
+
+def report_status(host, latency, status=None, retry_after=None):
+    # Print the outcome of a request made outside the controller (the spiders) for main.py to record
+    print(f"{STATUS_PREFIX} {host} {status or 0} {latency:.3f} {'-' if retry_after is None else retry_after}", flush=True)
+
+
+def report_error(url, latency=0.0):
+    # report_status() for a request that failed without a response, counted as an error for the host
+    print(f"{STATUS_PREFIX} {urlparse(url).hostname} error {latency:.3f} -", flush=True)
+
+
+def report_response(response):
+    # report_status() for a scrapy response, with the downloader's latency
+    try:
+        latency = response.meta.get("download_latency", 0.0)
+    except AttributeError:
+        latency = 0.0
+    retry_after = response.headers.get("Retry-After")
+    retry_after = retry_after_seconds(retry_after.decode("latin-1") if retry_after else None)
+    report_status(urlparse(response.url).hostname, latency, response.status, retry_after)
+
+
+def read_statuses(output):
+    # The outcomes printed by report_status() in a child process's output
+    statuses = []
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) != 5 or parts[0] != STATUS_PREFIX:
+            continue
+        try:
+            error = parts[2] == "error"
+            statuses.append({
+                "host": parts[1],
+                "status": None if error else int(parts[2]) or None,
+                "error": error,
+                "latency": float(parts[3]),
+                "retry_after": None if parts[4] == "-" else float(parts[4]),
+            })
+        except ValueError:
+            continue
+    return statuses
+
+
+_controller = None
+
+
+def get_controller():
+    # One controller per process, shared by every client in it, saved when the process exits
+    global _controller
+    if _controller is None:
+        _controller = RateController()
+        atexit.register(_controller.save)
+    return _controller
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "show"
+
+    if command == "show":
+        saved = serializer.load(RATES_PATH) if os.path.exists(RATES_PATH) else {}
+        if not saved:
+            print(f"No learned rates yet, every host starts at {DEFAULT_RATE}/s")
+        for host, state in sorted(saved.items()):
+            print(f"{host:<30} {state['rate']:>6.2f}/s  latency floor {state.get('latency_floor') or 0:.2f}s")
+    elif command == "reset":
+        if os.path.exists(RATES_PATH):
+            os.remove(RATES_PATH)
+        if os.path.isdir(PACE_DIR):
+            for name in os.listdir(PACE_DIR):
+                os.remove(os.path.join(PACE_DIR, name))
+        print("Learned rates and pacing cleared")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,365 @@
+# The purpose of this script is to store course and unit records in a single packed file
+# instead of thousands of small pretty-printed JSON files.
+#
+# Records are appended to one data file (one JSON document per line, or one zstd frame per
+# record when compression is enabled) and located through an offset index keyed by
+# course_code / unitCode, so a single record can be read without loading the rest.
+#
+# Usage:
+#   python scripts/record_store.py pack courses ./courses     # import existing per-file JSON
+#   python scripts/record_store.py export courses ./courses   # write per-file JSON back out
+#   python scripts/record_store.py get units ABC123
+#   python scripts/record_store.py compact units               # drop stale copies, retrain dictionary
+import json
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+import serializer
+from output_writer import OutputWriter
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PACKED_DIR = "./packed"
+# What reading a record at a stale offset can raise
+DECODE_ERRORS = (OSError, ValueError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# Key field used by each kind of record
+STORE_KEYS = {
+    "courses": "course_code",
+    "units": "unitCode",
+}
+
+# Size of the shared zstd dictionary trained on compact(). Repeated strings such as faculty,
+# school and highlights text end up in the dictionary instead of in every record.
+DICTIONARY_SIZE = 64 * 1024
+
+
+def output_format():
+    # Where spiders write their records: "json" (per-file, default), "packed" or "both"
+    fmt = os.environ.get("QUT_OUTPUT_FORMAT", "json").lower()
+    if fmt not in ("json", "packed", "both"):
+        print(f"Unknown QUT_OUTPUT_FORMAT '{fmt}', falling back to json")
+        fmt = "json"
+    return fmt
+
+
+def writes_json():
+    return output_format() in ("json", "both")
+
+
+def writes_packed():
+    return output_format() in ("packed", "both")
+
+
+class RecordStore:
+    def __init__(self, name, key_field, directory=PACKED_DIR, compress=None):
+        self.name = name
+        self.key_field = key_field
+        self.directory = directory
+        self.index_path = os.path.join(directory, f"{name}.idx.json")
+        self.lock_path = os.path.join(directory, f"{name}.lock")
+        self._lock_file = None
+        self._lock_depth = 0
+
+        index = self._load_index()
+        if compress is None:
+            # Keep whatever the existing store was written with, otherwise compress if we can
+            compress = index.get("compressed", zstandard is not None)
+        if compress and zstandard is None:
+            print("zstandard is not installed, writing uncompressed records")
+            compress = False
+        self.compressed = compress
+
+        extension = "jsonl.zst" if self.compressed else "jsonl"
+        self.data_path = os.path.join(directory, f"{name}.{extension}")
+        self.offsets = index.get("offsets", {}) if index.get("compressed", self.compressed) == self.compressed else {}
+
+        self._zdict = None
+        self._dictionary = None
+        self._load_dictionary(index.get("dictionary"))
+
+    # ---- locking ----
+
+    @contextmanager
+    def locked(self):
+        # Exclusive lock shared by every process using the store, held around appends and index
+        # updates. Re-entrant within a process, so callers can hold it around a read-modify-write.
+        if self._lock_depth == 0:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock_file = open(self.lock_path, "a+b")
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            else:
+                self._lock_file.seek(0)
+                msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                else:
+                    self._lock_file.seek(0)
+                    msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                self._lock_file.close()
+                self._lock_file = None
+
+    # ---- index handling ----
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            return serializer.load(self.index_path)
+        except json.JSONDecodeError as e:
+            print(f"Index {self.index_path} is corrupt ({e}), it will be rebuilt")
+            return {}
+
+    def reload(self):
+        # Pick up records other processes added since the store was opened, and the dictionary
+        # when another process compacted the store and trained a new one
+        index = self._load_index()
+        self.offsets = index.get("offsets", {}) if index.get("compressed", self.compressed) == self.compressed else {}
+        if index.get("dictionary") != self._dictionary:
+            self._load_dictionary(index.get("dictionary"))
+
+    def _save_index(self):
+        serializer.dump({"compressed": self.compressed, "dictionary": self._dictionary, "offsets": self.offsets}, self.index_path)
+
+    # ---- dictionary ----
+
+    def _dict_path(self, dictionary):
+        # Every trained dictionary gets its own file, named by the id the index refers to, so the index
+        # and data file written by a compaction never pair up with another compaction's dictionary.
+        # Stores written before dictionaries had ids use <name>.zdict.
+        suffix = f".{dictionary}.zdict" if dictionary else ".zdict"
+        return os.path.join(self.directory, self.name + suffix)
+
+    def _load_dictionary(self, dictionary):
+        self._dictionary = dictionary
+        self._zdict = None
+        path = self._dict_path(dictionary)
+        if self.compressed and os.path.exists(path):
+            with open(path, "rb") as f:
+                self._zdict = zstandard.ZstdCompressionDict(f.read())
+
+    # ---- encoding ----
+
+    def _encode(self, record):
+        raw = serializer.dumps(record)
+        if not self.compressed:
+            return raw + b"\n"
+        if self._zdict is not None:
+            compressor = zstandard.ZstdCompressor(level=10, dict_data=self._zdict)
+        else:
+            compressor = zstandard.ZstdCompressor(level=10)
+        return compressor.compress(raw)
+
+    def _decode(self, blob):
+        if self.compressed:
+            if self._zdict is not None:
+                blob = zstandard.ZstdDecompressor(dict_data=self._zdict).decompress(blob)
+            else:
+                blob = zstandard.ZstdDecompressor().decompress(blob)
+        return serializer.loads(blob)
+
+    # ---- writing ----
+
+    def put(self, record):
+        self.put_many([record])
+
+    def put_many(self, records):
+        # Append records and update the index once for the whole batch. The offset is taken, the
+        # index merged with the one on disk and the records encoded with the store's current
+        # dictionary all under the lock, so concurrent writers neither record wrong offsets, drop
+        # each other's keys, nor append records another process's compaction can no longer decode.
+        with self.locked():
+            self.reload()
+            blobs = []
+            for record in records:
+                key = record.get(self.key_field)
+                if not key:
+                    print(f"Skipping record without {self.key_field}")
+                    continue
+                blobs.append((key, self._encode(record)))
+            with open(self.data_path, "ab") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                for key, blob in blobs:
+                    f.write(blob)
+                    # Later copies of the same key replace earlier ones, compact() reclaims the space
+                    self.offsets[key] = [offset, len(blob)]
+                    offset += len(blob)
+            self._save_index()
+
+    # ---- reading ----
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def keys(self):
+        return sorted(self.offsets)
+
+    def get(self, key):
+        # Random access to a single record through the offset index. If another process compacted
+        # the store since our index was loaded the offset points elsewhere, so reload and retry once.
+        for attempt in range(2):
+            location = self.offsets.get(key)
+            if location is None:
+                return None
+            offset, length = location
+            try:
+                with open(self.data_path, "rb") as f:
+                    f.seek(offset)
+                    record = self._decode(f.read(length))
+                if record.get(self.key_field) == key:
+                    return record
+            except DECODE_ERRORS:
+                pass
+            if attempt == 0:
+                self.reload()
+        return None
+
+    def load_all(self):
+        # Bulk load: read the data file once and slice every live record out of it. Under the lock,
+        # so the index, dictionary and data file all belong to the same compaction.
+        with self.locked():
+            self.reload()
+            if not self.offsets or not os.path.exists(self.data_path):
+                return {}
+            with open(self.data_path, "rb") as f:
+                data = f.read()
+        return {key: self._decode(data[offset:offset + length]) for key, (offset, length) in self.offsets.items()}
+
+    def rebuild_index(self):
+        # Recover the index by scanning the data file (uncompressed stores only)
+        if self.compressed:
+            raise ValueError("Cannot rebuild the index of a compressed store, re-pack it instead")
+        with self.locked():
+            self.offsets = {}
+            if os.path.exists(self.data_path):
+                with open(self.data_path, "rb") as f:
+                    offset = 0
+                    for line in f:
+                        if line.strip():
+                            key = serializer.loads(line).get(self.key_field)
+                            if key:
+                                self.offsets[key] = [offset, len(line)]
+                        offset += len(line)
+            self._save_index()
+
+    # ---- maintenance ----
+
+    def compact(self):
+        # Rewrite the store with only the latest copy of each record. For compressed stores a
+        # shared dictionary is trained first, so strings repeated across records are stored once.
+        with self.locked():
+            self.reload()
+            self._compact()
+
+    def _compact(self):
+        records = self.load_all()
+        if not records:
+            return
+
+        previous = self._dictionary
+        if self.compressed:
+            samples = [serializer.dumps(r) for r in records.values()]
+            try:
+                self._zdict = zstandard.train_dictionary(DICTIONARY_SIZE, samples)
+                self._dictionary = uuid.uuid4().hex[:12]
+                serializer.write_atomic(self._dict_path(self._dictionary), self._zdict.as_bytes())
+            except zstandard.ZstdError as e:
+                # Too few samples to train on, keep plain per-record frames
+                print(f"Could not train dictionary for {self.name}: {e}")
+                self._zdict = None
+                self._dictionary = None
+
+        tmp_path = self.data_path + ".tmp"
+        offsets = {}
+        with open(tmp_path, "wb") as f:
+            offset = 0
+            for key in sorted(records):
+                blob = self._encode(records[key])
+                f.write(blob)
+                offsets[key] = [offset, len(blob)]
+                offset += len(blob)
+        os.replace(tmp_path, self.data_path)
+        self.offsets = offsets
+        self._save_index()
+        # The old dictionary is only needed by the data file that was just replaced
+        if previous != self._dictionary and os.path.exists(self._dict_path(previous)):
+            os.remove(self._dict_path(previous))
+        print(f"Compacted {len(offsets)} records into {self.data_path}")
+
+    def pack_directory(self, source_dir):
+        # Import every per-file JSON record from a directory
+        records = []
+        for filename in sorted(os.listdir(source_dir)):
+            if not filename.endswith(".json") or filename.startswith("."):
+                continue
+            try:
+                records.append(serializer.load(os.path.join(source_dir, filename)))
+            except json.JSONDecodeError as e:
+                print(f"Error reading JSON file {filename}: {e}")
+        self.put_many(records)
+        print(f"Packed {len(records)} records from {source_dir} into {self.data_path}")
+
+    def export_json(self, output_dir, indent=4, transform=None):
+        # Write each record back out as its own pretty-printed JSON file.
+        # `transform` is applied to every record first, e.g. to merge in enrichment data.
+        os.makedirs(output_dir, exist_ok=True)
+        records = self.load_all()
+        with OutputWriter(f"export-{self.name}", indent=indent) as writer:
+            for key, record in records.items():
+                if transform is not None:
+                    record = transform(record)
+                writer.write(os.path.join(output_dir, f"{key}.json"), record)
+        print(f"Exported {len(records)} records to {output_dir}")
+
+
+def open_store(name, directory=PACKED_DIR):
+    # Open the packed store for "courses" or "units"
+    return RecordStore(name, STORE_KEYS[name], directory=directory)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[2] not in STORE_KEYS:
+        print("Usage: record_store.py pack|export|get|compact courses|units [path|key]")
+        sys.exit(1)
+
+    command, store_name = sys.argv[1], sys.argv[2]
+    store = open_store(store_name)
+
+    if command == "pack":
+        store.pack_directory(sys.argv[3] if len(sys.argv) > 3 else f"./{store_name}")
+    elif command == "export":
+        transform = None
+        if store_name == "courses":
+            # Course records are exported with their PDF-derived enrichment merged in
+            from enrichment import merge_enrichment, open_enrichment_store
+            enrichment_store = open_enrichment_store()
+            transform = lambda course: merge_enrichment(course, store=enrichment_store)
+        store.export_json(sys.argv[3] if len(sys.argv) > 3 else f"./{store_name}", transform=transform)
+    elif command == "get":
+        print(serializer.dumps(store.get(sys.argv[3]), indent=4).decode("utf-8"))
+    elif command == "compact":
+        store.compact()
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
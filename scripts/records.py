@@ -0,0 +1,443 @@
+# Typed records for what the stages produce: Course (ECI), Unit (EUI), SemesterBlock (analyze_pdf)
+# and CourseUnitLink (EUFC, ./course_to_unit/<code>.json).
+#
+# Each record is a slotted dataclass, checked when it is created, so a malformed record fails in the
+# stage that built it instead of in whatever reads it later (ECI and EUI save pages that fail under
+# ./courses_unknown and ./units_unknown). Attribute names are snake_case everywhere; the JSON keys stay
+# the ones the files have always used (course_code, unitCode, studyArea, ...) and values are kept as
+# they were scraped, so to_dict()/from_dict() round-trip the existing files unchanged (`validate`
+# checks this). to_document()/from_document() add and drop the "_id" the database layer keys documents by.
+#
+# For bulk work (the whole catalogue in memory) records are much smaller than the dicts they come
+# from: no per-record dict, lists stored as tuples, and repeated strings (faculty, school, study area,
+# dates, entry modes, prerequisite codes, offerings) interned so every record shares one copy.
+#
+# Usage:
+#   python scripts/records.py validate          # check and round-trip every course, unit and course_to_unit file
+#   python scripts/records.py memory            # memory of the unit catalogue as dicts vs records
+import os
+import re
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from sys import intern
+import serializer
+from record_store import open_store, writes_packed
+from text_utils import UNIT_CODE_CELL_PATTERN
+
+COURSES_DIR = "./courses"
+UNITS_DIR = "./units"
+COURSE_TO_UNIT_DIR = "./course_to_unit"
+
+COURSE_CODE_PATTERN = re.compile(r"^[A-Z0-9]{2,10}$")
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+ENTRY_TIMES = ("February", "July")
+MODES = ("Full Time", "Part Time")
+
+
+class RecordError(ValueError):
+    pass
+
+
+def _text(record, name, value, shared=False):
+    # Optional string field, kept as scraped; shared values are interned
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise RecordError(f"{type(record).__name__}.{name} must be a string, got {type(value).__name__}")
+    return intern(value) if shared else value
+
+
+def _texts(record, name, values, shared=False):
+    # Optional list of strings, stored as a tuple
+    if values is None:
+        return None
+    if isinstance(values, str) or not isinstance(values, (list, tuple)):
+        raise RecordError(f"{type(record).__name__}.{name} must be a list of strings")
+    return tuple(_text(record, name, value, shared) for value in values)
+
+
+def _date(record, value):
+    value = _text(record, "day_obtained", value, shared=True)
+    if value is not None and not DATE_PATTERN.match(value):
+        raise RecordError(f"{type(record).__name__}.day_obtained must be YYYY-MM-DD, got {value!r}")
+    return value
+
+
+def _code(record, name, value, pattern):
+    value = _text(record, name, value)
+    if value is None:
+        return None
+    value = intern(value)
+    if not pattern.match(value):
+        raise RecordError(f"{type(record).__name__}.{name} is not a valid code: {value!r}")
+    return value
+
+
+def _shared_json(value):
+    # Nested JSON with its short strings interned; offerings repeat the same periods and campuses
+    if isinstance(value, str):
+        return intern(value) if len(value) <= 64 else value
+    if isinstance(value, list):
+        return [_shared_json(item) for item in value]
+    if isinstance(value, dict):
+        return {intern(key): _shared_json(item) for key, item in value.items()}
+    return value
+
+
+# Attribute -> JSON key, in the order the files have always been written
+def _to_dict(record):
+    return {key: _plain(getattr(record, name)) for name, key in record.KEYS}
+
+
+def _plain(value):
+    # Tuples back to the lists the JSON files hold
+    if isinstance(value, tuple):
+        return [_plain(item) for item in value]
+    return value
+
+
+def _from_dict(cls, data, **extra):
+    return cls(**{name: data.get(key) for name, key in cls.KEYS}, **extra)
+
+
+@dataclass(slots=True)
+class SemesterBlock:
+    entry_time: str
+    mode: str
+    semesters: tuple = ()
+
+    def __post_init__(self):
+        if self.entry_time not in ENTRY_TIMES:
+            raise RecordError(f"SemesterBlock.entry_time must be one of {ENTRY_TIMES}, got {self.entry_time!r}")
+        if self.mode not in MODES:
+            raise RecordError(f"SemesterBlock.mode must be one of {MODES}, got {self.mode!r}")
+        self.entry_time = intern(self.entry_time)
+        self.mode = intern(self.mode)
+        self.semesters = _texts(self, "semesters", self.semesters, shared=True) or ()
+
+    @classmethod
+    def from_dict(cls, data):
+        mode_entry = data.get("mode_entry") or {}
+        return cls(mode_entry.get("entry_time"), mode_entry.get("mode"), data.get("semesters") or ())
+
+    def to_dict(self):
+        return {
+            "mode_entry": {"entry_time": self.entry_time, "mode": self.mode},
+            "semesters": list(self.semesters),
+        }
+
+
+@dataclass(slots=True)
+class Course:
+    course_code: str = None
+    course_name: str = None
+    identifier: object = None       # str or int, as given in the page's JSON-LD
+    durations: tuple = ()           # ((audience, duration), ...)
+    delivery_location: str = None
+    atar_rank: str = None
+    csp_cost: str = None
+    qtac_code: str = None
+    cricos_code: str = None
+    highlights: tuple = ()
+    sections: dict = None           # {section title: [paragraphs]}
+    source: str = None
+    day_obtained: str = None
+
+    KEYS = (
+        ("course_name", "course_name"),
+        ("course_code", "course_code"),
+        ("identifier", "identifier"),
+        ("durations", "durations"),
+        ("delivery_location", "delivery_location"),
+        ("atar_rank", "atar_rank"),
+        ("csp_cost", "csp_cost"),
+        ("qtac_code", "qtac_code"),
+        ("cricos_code", "cricos_code"),
+        ("highlights", "highlights"),
+        ("sections", "what_to_expect-careers_and_outcome"),
+        ("source", "source"),
+        ("day_obtained", "day_obtained"),
+    )
+
+    def __post_init__(self):
+        # ECI keeps pages without a course code (saved by course name), so the code is optional
+        self.course_code = _code(self, "course_code", self.course_code, COURSE_CODE_PATTERN)
+        if self.course_code is None and not self.course_name:
+            raise RecordError("Course needs a course_code or a course_name")
+        self.course_name = _text(self, "course_name", self.course_name)
+        if self.identifier is not None and (isinstance(self.identifier, bool) or not isinstance(self.identifier, (str, int))):
+            raise RecordError(f"Course.identifier must be a string or an integer, got {type(self.identifier).__name__}")
+        if self.durations is not None:
+            self.durations = tuple(self._duration(entry) for entry in self.durations)
+        self.delivery_location = _text(self, "delivery_location", self.delivery_location, shared=True)
+        for name in ("atar_rank", "csp_cost", "qtac_code", "cricos_code", "source"):
+            setattr(self, name, _text(self, name, getattr(self, name)))
+        self.highlights = _texts(self, "highlights", self.highlights)
+        if self.sections is not None:
+            if not isinstance(self.sections, dict):
+                raise RecordError("Course.sections must be a dict of section title to paragraphs")
+            self.sections = {intern(title): _texts(self, "sections", content) or () for title, content in self.sections.items()}
+        self.day_obtained = _date(self, self.day_obtained)
+
+    def _duration(self, entry):
+        if isinstance(entry, dict):
+            entry = (entry.get("audience"), entry.get("duration"))
+        if not isinstance(entry, (list, tuple)) or len(entry) != 2:
+            raise RecordError(f"Course.durations entries need an audience and a duration, got {entry!r}")
+        return (_text(self, "durations", entry[0], shared=True), _text(self, "durations", entry[1], shared=True))
+
+    @property
+    def key(self):
+        return self.course_code
+
+    @classmethod
+    def from_dict(cls, data):
+        return _from_dict(cls, data)
+
+    def to_dict(self):
+        data = _to_dict(self)
+        if self.durations is not None:
+            data["durations"] = [{"audience": audience, "duration": duration} for audience, duration in self.durations]
+        if self.sections is not None:
+            data["what_to_expect-careers_and_outcome"] = {title: list(content) for title, content in self.sections.items()}
+        return data
+
+    def to_document(self):
+        return {"_id": self.course_code, **self.to_dict()}
+
+    @classmethod
+    def from_document(cls, document):
+        return cls.from_dict(document)
+
+
+@dataclass(slots=True)
+class Unit:
+    unit_code: str = None
+    faculty: str = None
+    school: str = None
+    study_area: str = None
+    sp_fee: str = None
+    domestic_fee: str = None
+    international_fee: str = None
+    credit_points: str = None
+    prerequisites: tuple = None
+    prerequisites_expr: object = None   # unit code, {"and": [...]} / {"or": [...]} / {"other": text}, or None
+    equivalents: tuple = None           # equivalent unit codes, as listed on the unit page
+    anti_requisites: str = None
+    overview: list = None               # offerings as returned by the offerings API
+    url: str = None
+    day_obtained: str = None
+
+    KEYS = (
+        ("unit_code", "unitCode"),
+        ("faculty", "faculty"),
+        ("school", "school"),
+        ("study_area", "studyArea"),
+        ("sp_fee", "sp_fee"),
+        ("domestic_fee", "domestic_fee"),
+        ("international_fee", "international_fee"),
+        ("credit_points", "creditPoints"),
+        ("prerequisites", "prerequisites"),
+        ("prerequisites_expr", "prerequisites_expr"),
+        ("equivalents", "equivalents"),
+        ("anti_requisites", "anti_requisites"),
+        ("overview", "overview"),
+        ("url", "url"),
+        ("day_obtained", "day_obtained"),
+    )
+
+    def __post_init__(self):
+        # EUI also records pages without a unit code (under ./units_unknown)
+        self.unit_code = _code(self, "unit_code", self.unit_code, UNIT_CODE_CELL_PATTERN)
+        for name in ("faculty", "school", "study_area", "credit_points"):
+            setattr(self, name, _text(self, name, getattr(self, name), shared=True))
+        for name in ("sp_fee", "domestic_fee", "international_fee", "anti_requisites", "url"):
+            setattr(self, name, _text(self, name, getattr(self, name)))
+        self.equivalents = _texts(self, "equivalents", self.equivalents, shared=True)
+        self.prerequisites = _texts(self, "prerequisites", self.prerequisites, shared=True)
+        if self.prerequisites is not None:
+            for code in self.prerequisites:
+                if not UNIT_CODE_CELL_PATTERN.match(code):
+                    raise RecordError(f"Unit.prerequisites has an invalid unit code: {code!r}")
+        self.prerequisites_expr = self._expression(self.prerequisites_expr)
+        if self.overview is not None and not isinstance(self.overview, list):
+            raise RecordError("Unit.overview must be a list of offerings")
+        self.overview = _shared_json(self.overview)
+        self.day_obtained = _date(self, self.day_obtained)
+
+    def _expression(self, expr):
+        if expr is None:
+            return None
+        if isinstance(expr, str):
+            if not UNIT_CODE_CELL_PATTERN.match(expr):
+                raise RecordError(f"Unit.prerequisites_expr has an invalid unit code: {expr!r}")
+            return intern(expr)
+        if isinstance(expr, dict) and len(expr) == 1:
+            op, operands = next(iter(expr.items()))
+            if op in ("and", "or") and isinstance(operands, list):
+                return {op: [self._expression(operand) for operand in operands]}
+            if op == "other" and isinstance(operands, str):
+                return {op: operands}
+        raise RecordError(f"Unit.prerequisites_expr is not an and/or expression: {expr!r}")
+
+    @property
+    def key(self):
+        return self.unit_code
+
+    @classmethod
+    def from_dict(cls, data):
+        return _from_dict(cls, data)
+
+    def to_dict(self):
+        return _to_dict(self)
+
+    def to_document(self):
+        return {"_id": self.unit_code, **self.to_dict()}
+
+    @classmethod
+    def from_document(cls, document):
+        return cls.from_dict(document)
+
+
+@dataclass(slots=True)
+class CourseUnitLink:
+    course_code: str
+    unit_codes: tuple = ()
+    source: str = None
+    day_obtained: str = None
+
+    # course_code is the file name (./course_to_unit/<code>.json), not a key in the file
+    KEYS = (
+        ("source", "source"),
+        ("day_obtained", "day_obtained"),
+        ("unit_codes", "unitCodes"),
+    )
+
+    def __post_init__(self):
+        self.course_code = _code(self, "course_code", self.course_code, COURSE_CODE_PATTERN)
+        if self.course_code is None:
+            raise RecordError("CourseUnitLink needs a course_code")
+        self.unit_codes = tuple(sorted(set(_texts(self, "unit_codes", self.unit_codes, shared=True) or ())))
+        for code in self.unit_codes:
+            if not UNIT_CODE_CELL_PATTERN.match(code):
+                raise RecordError(f"CourseUnitLink.unit_codes has an invalid unit code: {code!r}")
+        self.source = _text(self, "source", self.source)
+        self.day_obtained = _date(self, self.day_obtained)
+
+    @property
+    def key(self):
+        return self.course_code
+
+    @classmethod
+    def from_dict(cls, data, course_code=None):
+        return _from_dict(cls, data, course_code=course_code or data.get("course_code"))
+
+    def to_dict(self):
+        return _to_dict(self)
+
+    def to_document(self):
+        return {"_id": self.course_code, "course_code": self.course_code, **self.to_dict()}
+
+    @classmethod
+    def from_document(cls, document):
+        return cls.from_dict(document)
+
+
+# ---- bulk loading ----
+
+def _read_directory(directory):
+    # (file name without .json, record dict) of every JSON file in a directory
+    if not os.path.exists(directory):
+        return
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json") and not filename.startswith("."):
+            yield filename[:-5], serializer.load(os.path.join(directory, filename))
+
+
+def _raw_records(store_name, directory):
+    if writes_packed():
+        return list(open_store(store_name).load_all().values())
+    return [data for _, data in _read_directory(directory)]
+
+
+def load_courses(directory=COURSES_DIR):
+    return [Course.from_dict(data) for data in _raw_records("courses", directory)]
+
+
+def load_units(directory=UNITS_DIR):
+    return [Unit.from_dict(data) for data in _raw_records("units", directory)]
+
+
+def load_links(directory=COURSE_TO_UNIT_DIR):
+    # Only the per-course files; <code>_unitGuide.json holds the unit guide
+    return [
+        CourseUnitLink.from_dict(data, course_code=name)
+        for name, data in _read_directory(directory) if "_" not in name
+    ]
+
+
+def round_trip_error(record, data):
+    # Why record.to_dict() differs from the stored dict it was built from, None when it is identical
+    converted = record.to_dict()
+    if converted == data:
+        return None
+    keys = sorted(set(converted) | set(data), key=str)
+    differing = [key for key in keys if converted.get(key, KeyError) != data.get(key, KeyError)]
+    return f"does not round-trip, differs in {', '.join(differing)}"
+
+
+def validate_all():
+    # (kind, name, error) of every stored record that fails validation or does not convert back
+    # to exactly the dict it was read from
+    problems = []
+    checks = [
+        ("course", COURSES_DIR, lambda name, data: Course.from_dict(data)),
+        ("unit", UNITS_DIR, lambda name, data: Unit.from_dict(data)),
+        ("course_to_unit", COURSE_TO_UNIT_DIR,
+         lambda name, data: None if "_" in name else CourseUnitLink.from_dict(data, course_code=name)),
+    ]
+    for kind, directory, check in checks:
+        for name, data in _read_directory(directory):
+            try:
+                record = check(name, data)
+            except RecordError as e:
+                problems.append((kind, name, str(e)))
+                continue
+            error = record is not None and round_trip_error(record, data)
+            if error:
+                problems.append((kind, name, error))
+    return problems
+
+
+def _traced_size(load):
+    tracemalloc.start()
+    try:
+        records = load()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return len(records), size
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "validate"
+
+    if command == "validate":
+        problems = validate_all()
+        for kind, name, error in problems:
+            print(f"{kind} {name}: {error}")
+        print(f"{len(problems)} invalid records")
+        sys.exit(1 if problems else 0)
+    elif command == "memory":
+        raw = _raw_records("units", UNITS_DIR)
+        count, dict_bytes = _traced_size(lambda: serializer.loads(serializer.dumps(raw)))
+        _, record_bytes = _traced_size(lambda: [Unit.from_dict(data) for data in serializer.loads(serializer.dumps(raw))])
+        if not count:
+            print("No unit records")
+            sys.exit(0)
+        print(f"{count} units: {dict_bytes / count:.0f} bytes each as dicts, {record_bytes / count:.0f} as records "
+              f"({100 * (1 - record_bytes / dict_bytes):.0f}% less)")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
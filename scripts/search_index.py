@@ -0,0 +1,195 @@
+# Full-text search over courses and units, using SQLite FTS5.
+#
+# Courses are indexed on their name, highlights, the "what to expect / careers and outcomes"
+# sections and possible careers; units on their code, faculty, school and study area.
+# ECI and EUI add each record as they write it, and `sync` indexes everything already on disk.
+# A record is only re-indexed when the hash of its indexed text changes.
+# Results are ranked with BM25, title matches weighing more than body matches.
+#
+# Usage:
+#   python scripts/search_index.py sync
+#   python scripts/search_index.py search "data science" [course|unit]
+#   python scripts/search_index.py stats
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+import serializer
+from record_store import open_store, writes_packed
+
+SEARCH_PATH = "./state/search.db"
+SOURCES = {"course": ("courses", "./courses", "course_code"), "unit": ("units", "./units", "unitCode")}
+# BM25 weights of the code, title and body columns
+COLUMN_WEIGHTS = (10.0, 5.0, 1.0)
+QUERY_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+@contextmanager
+def _connect(path=SEARCH_PATH):
+    # Open the search database, commit on success and always close the connection
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,
+            code TEXT NOT NULL,
+            title TEXT,
+            content_hash TEXT NOT NULL,
+            UNIQUE (kind, code)
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            code, title, body, tokenize = 'porter unicode61'
+        );
+    """)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _flatten(value):
+    # Every string inside nested lists and dicts
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [text for key, item in value.items() for text in [key] + _flatten(item)]
+    if isinstance(value, list):
+        return [text for item in value for text in _flatten(item)]
+    return []
+
+
+def document_text(kind, record):
+    # (code, title, body) of a record as it is indexed
+    if kind == "course":
+        body = _flatten(record.get("highlights")) + _flatten(record.get("what_to_expect-careers_and_outcome"))
+        return record.get("course_code"), record.get("course_name") or "", "; ".join(body)
+    fields = [record.get(field) for field in ("faculty", "school", "studyArea")]
+    return record.get("unitCode"), record.get("studyArea") or "", "; ".join(f for f in fields if f)
+
+
+def _index(conn, kind, record):
+    code, title, body = document_text(kind, record)
+    if not code:
+        return False
+    content_hash = hashlib.blake2b("\0".join((title, body)).encode("utf-8"), digest_size=16).hexdigest()
+    row = conn.execute("SELECT id, content_hash FROM documents WHERE kind = ? AND code = ?", (kind, code)).fetchone()
+    if row and row[1] == content_hash:
+        return False
+    if row:
+        conn.execute("UPDATE documents SET title = ?, content_hash = ? WHERE id = ?", (title, content_hash, row[0]))
+        conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+        doc_id = row[0]
+    else:
+        doc_id = conn.execute(
+            "INSERT INTO documents (kind, code, title, content_hash) VALUES (?, ?, ?, ?)", (kind, code, title, content_hash),
+        ).lastrowid
+    conn.execute("INSERT INTO documents_fts (rowid, code, title, body) VALUES (?, ?, ?, ?)", (doc_id, code, title, body))
+    return True
+
+
+def index_records(kind, records, path=SEARCH_PATH):
+    # Index a batch of records in one transaction. Returns how many actually changed.
+    with _connect(path) as conn:
+        return sum(_index(conn, kind, record) for record in records)
+
+
+def index_record(kind, record, path=SEARCH_PATH):
+    # Called by the scrapers after each write; a failing index must not lose the scraped record
+    try:
+        return index_records(kind, [record], path=path)
+    except sqlite3.Error as e:
+        print(f"Could not update the search index for {kind}: {e}")
+        return 0
+
+
+def remove_missing(kind, codes, path=SEARCH_PATH):
+    # Drop indexed records of a kind whose code is no longer in codes
+    with _connect(path) as conn:
+        rows = conn.execute("SELECT id, code FROM documents WHERE kind = ?", (kind,)).fetchall()
+        stale = [(doc_id,) for doc_id, code in rows if code not in codes]
+        conn.executemany("DELETE FROM documents_fts WHERE rowid = ?", stale)
+        conn.executemany("DELETE FROM documents WHERE id = ?", stale)
+    return len(stale)
+
+
+def load_records(kind):
+    name, directory, _ = SOURCES[kind]
+    if writes_packed():
+        return list(open_store(name).load_all().values())
+    if not os.path.exists(directory):
+        return []
+    return [serializer.load(os.path.join(directory, f)) for f in sorted(os.listdir(directory)) if f.endswith(".json") and not f.startswith(".")]
+
+
+def sync(path=SEARCH_PATH):
+    # Bring the index in line with every record on disk
+    totals = {}
+    for kind, (_, _, key_field) in SOURCES.items():
+        records = load_records(kind)
+        changed = index_records(kind, records, path=path)
+        removed = remove_missing(kind, {record.get(key_field) for record in records}, path=path)
+        totals[kind] = {"records": len(records), "indexed": changed, "removed": removed}
+    return totals
+
+
+def fts_query(text):
+    # Turn free text into an FTS5 query: every word must match, the last one as a prefix
+    tokens = QUERY_TOKEN_PATTERN.findall(text)
+    if not tokens:
+        return None
+    quoted = ['"' + token.replace('"', '""') + '"' for token in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search(text, kind=None, limit=20, path=SEARCH_PATH):
+    # Ranked matches as [{"type", "code", "title", "snippet", "score"}], best first
+    query = fts_query(text)
+    if query is None or not os.path.exists(path):
+        return []
+    sql = f"""
+        SELECT d.kind, d.code, d.title,
+               snippet(documents_fts, 2, '[', ']', '...', 12),
+               bm25(documents_fts, {', '.join(map(str, COLUMN_WEIGHTS))}) AS score
+        FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+        WHERE documents_fts MATCH ?{' AND d.kind = ?' if kind else ''}
+        ORDER BY score LIMIT ?
+    """
+    params = (query, kind, limit) if kind else (query, limit)
+    with _connect(path) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [
+        {"type": row[0], "code": row[1], "title": row[2], "snippet": row[3], "score": round(-row[4], 3)}
+        for row in rows
+    ]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+
+    if command == "sync":
+        start = time.perf_counter()
+        for kind, counts in sync().items():
+            print(f"{kind}: {counts['records']} records, {counts['indexed']} (re)indexed, {counts['removed']} removed")
+        print(f"Synced {SEARCH_PATH} in {time.perf_counter() - start:.2f}s")
+    elif command == "search" and len(sys.argv) > 2:
+        start = time.perf_counter()
+        results = search(sys.argv[2], kind=sys.argv[3] if len(sys.argv) > 3 else None)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for result in results:
+            print(f"{result['score']:>8.2f}  {result['type']:<6} {result['code']:<8} {result['title']}")
+            print(f"          {result['snippet']}")
+        print(f"{len(results)} results in {elapsed_ms:.1f} ms")
+    elif command == "stats":
+        with _connect() as conn:
+            for kind, count in conn.execute("SELECT kind, COUNT(*) FROM documents GROUP BY kind"):
+                print(f"{kind}: {count} indexed")
+    else:
+        print(f"Unknown command: {' '.join(sys.argv[1:])}")
+        sys.exit(1)
@@ -0,0 +1,122 @@
+# Shared JSON serializer used by every stage that reads or writes JSON.
+# Uses orjson when it is installed and falls back to the standard library otherwise.
+# Set QUT_JSON_BACKEND=json to force the standard library.
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+def _json_loads(data):
+    return json.loads(data)
+
+
+def _json_dumps(obj, indent=None):
+    if indent:
+        text = json.dumps(obj, indent=indent, ensure_ascii=False)
+    else:
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    return text.encode("utf-8")
+
+
+def _orjson_loads(data):
+    return orjson.loads(data)
+
+
+def _orjson_dumps(obj, indent=None):
+    # orjson only supports two-space indentation, any indent asks for pretty output
+    option = orjson.OPT_INDENT_2 if indent else 0
+    return orjson.dumps(obj, option=option)
+
+
+BACKENDS = {"json": (_json_loads, _json_dumps)}
+if orjson is not None:
+    BACKENDS["orjson"] = (_orjson_loads, _orjson_dumps)
+
+_loads, _dumps = BACKENDS["json"]
+backend = "json"
+
+
+def use_backend(name):
+    # Switch the serializer used by loads/dumps/load/dump
+    global _loads, _dumps, backend
+    if name not in BACKENDS:
+        print(f"JSON backend '{name}' is not available, using {backend}")
+        return backend
+    _loads, _dumps = BACKENDS[name]
+    backend = name
+    return backend
+
+
+use_backend(os.environ.get("QUT_JSON_BACKEND", "orjson" if orjson is not None else "json"))
+
+
+def loads(data):
+    # Parse JSON from str or bytes
+    return _loads(data)
+
+
+def dumps(obj, indent=None):
+    # Serialize to UTF-8 encoded bytes
+    return _dumps(obj, indent=indent)
+
+
+def load(path):
+    # Read and parse a JSON file
+    with open(path, "rb") as f:
+        return _loads(f.read())
+
+
+def write_atomic(path, data):
+    # Write bytes to a temp file in the same directory and rename it over the target,
+    # so readers never see a half-written file. The temp file is a dotfile ending in .tmp, so
+    # folder scans for *.json / *.pdf never pick it up, even when a crash leaves it behind.
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dump(obj, path, indent=None):
+    # Serialize obj and write it atomically to path
+    write_atomic(path, _dumps(obj, indent=indent))
+
+
+@contextmanager
+def locked(path):
+    # Hold an exclusive lock on path across processes, for read-modify-write of shared files.
+    # The lock is taken on a .<name>.lock dotfile next to it, which folder scans skip.
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f".{os.path.basename(path)}.lock"), "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,146 @@
+# Managed JavaScript rendering through a pool of Splash instances.
+#
+# Rendering is only used when QUT_SPLASH_URLS is set (comma separated, e.g.
+# "http://localhost:8050,http://localhost:8051"). Pages are then rendered with a Lua script that
+# returns as soon as the element we scrape is on the page instead of sleeping a fixed time,
+# and that refuses to load images, stylesheets, fonts and third-party trackers.
+# Without QUT_SPLASH_URLS pages are fetched as plain HTTP requests.
+#
+# Usage (against a local Splash container or a stub serving /execute):
+#   python scripts/splash_render.py https://www.qut.edu.au/courses/bachelor-of-business "#course-tab-wrapper"
+import itertools
+import os
+import sys
+import time
+import urllib.request
+import scrapy
+import serializer
+
+try:
+    from scrapy_splash import SplashRequest
+except ImportError:
+    SplashRequest = None
+
+SPLASH_URLS = [url.strip() for url in os.environ.get("QUT_SPLASH_URLS", "").split(",") if url.strip()]
+
+# Upper bound for waiting on the selector, the old fixed wait
+MAX_WAIT_SECONDS = 10
+POLL_SECONDS = 0.1
+
+# Requests whose URL contains any of these are aborted before they are sent
+BLOCKED_PATTERNS = [
+    ".css", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico",
+    ".woff", ".woff2", ".ttf", ".otf", ".mp4",
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "facebook.net",
+    "hotjar.com", "clarity.ms", "linkedin.com", "twitter.com", "tiktok.com", "youtube.com",
+]
+
+LUA_SCRIPT = """
+function main(splash, args)
+    splash.images_enabled = false
+    splash.plugins_enabled = false
+    splash.resource_timeout = args.resource_timeout
+
+    splash:on_request(function(request)
+        for _, pattern in ipairs(args.blocked) do
+            if string.find(request.url, pattern, 1, true) then
+                request:abort()
+                return
+            end
+        end
+    end)
+
+    assert(splash:go(args.url))
+
+    -- Return as soon as the element we need is rendered
+    local waited = 0
+    while not splash:select(args.selector) and waited < args.max_wait do
+        splash:wait(args.poll)
+        waited = waited + args.poll
+    end
+
+    return {html = splash:html(), url = splash:url()}
+end
+"""
+
+_pool = itertools.cycle(SPLASH_URLS) if SPLASH_URLS else None
+
+
+def rendering_enabled():
+    return bool(SPLASH_URLS) and SplashRequest is not None
+
+
+def next_splash_url():
+    # Spread requests over the Splash instances round-robin
+    return next(_pool)
+
+
+def lua_args(selector, max_wait=MAX_WAIT_SECONDS):
+    return {
+        "lua_source": LUA_SCRIPT,
+        "selector": selector,
+        "max_wait": max_wait,
+        "poll": POLL_SECONDS,
+        "blocked": BLOCKED_PATTERNS,
+        "resource_timeout": max_wait,
+    }
+
+
+def splash_settings():
+    # Crawler settings for the spiders, scrapy-splash middlewares only when rendering is enabled
+    if not rendering_enabled():
+        return {}
+    return {
+        "SPLASH_URL": SPLASH_URLS[0],
+        "DOWNLOADER_MIDDLEWARES": {
+            "scrapy_splash.SplashCookiesMiddleware": 723,
+            "scrapy_splash.SplashMiddleware": 725,
+            "scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware": 810,
+        },
+        "SPIDER_MIDDLEWARES": {
+            "scrapy_splash.SplashDeduplicateArgsMiddleware": 100,
+        },
+        "DUPEFILTER_CLASS": "scrapy_splash.SplashAwareDupeFilter",
+    }
+
+
+def page_request(url, selector, callback, errback=None):
+    # A request for a page we scrape: rendered by the next Splash in the pool when rendering is
+    # enabled, a plain request otherwise
+    if rendering_enabled():
+        return SplashRequest(
+            url=url,
+            callback=callback,
+            errback=errback,
+            endpoint="execute",
+            args=lua_args(selector),
+            splash_url=next_splash_url(),
+        )
+    return scrapy.Request(url=url, callback=callback, errback=errback)
+
+
+def render(url, selector, splash_url=None, timeout=60):
+    # Render a page directly through Splash's /execute endpoint, outside Scrapy
+    splash_url = splash_url or next_splash_url()
+    args = lua_args(selector)
+    args["url"] = url
+    request = urllib.request.Request(
+        f"{splash_url.rstrip('/')}/execute",
+        data=serializer.dumps(args),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return serializer.loads(response.read())["html"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: splash_render.py URL SELECTOR")
+        sys.exit(1)
+    if not SPLASH_URLS:
+        print("Set QUT_SPLASH_URLS to the Splash instance(s) to render with")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    html = render(sys.argv[1], sys.argv[2])
+    print(f"Rendered {len(html)} characters in {time.perf_counter() - start:.2f}s")
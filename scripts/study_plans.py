@@ -0,0 +1,221 @@
+# The purpose of this script is to check the study plans in the course PDFs against unit offerings
+# and prerequisites, and to generate a valid plan for every course, entry time and mode.
+#
+# For each semester block of a course's unit guide (from the enrichment store) the units are checked
+# semester by semester: is the unit offered in that teaching period, and do the units completed in
+# earlier semesters satisfy its prerequisites. A plan is then generated greedily from the same units,
+# placing first the units that unlock the most others. Prerequisites that are not in the guide (units
+# from another course, or credit from prior study) count as satisfied; the guide check lists them as
+# "external prerequisite" so they can be looked at, and they never leave a unit unplaced.
+#
+# Unit availability per teaching period is precomputed as bitsets over the prerequisite graph, and
+# prerequisite checks are memoized on (unit, the part of the completed set its prerequisites can see),
+# so the many courses that share units share the work. Courses are processed in parallel.
+# Results are written to ./study_plans/<course_code>.json.
+#
+# Usage:
+#   python scripts/study_plans.py                 # every course with a unit guide
+#   python scripts/study_plans.py IN01 EN01       # selected courses
+#   python scripts/study_plans.py --workers 4
+import multiprocessing
+import os
+import re
+import sys
+import time
+import serializer
+from enrichment import open_enrichment_store
+from prereq_graph import load_graph
+from unit_analytics import PERIOD_BITS, load_table
+
+OUTPUT_DIR = "./study_plans"
+SEMESTER_LABEL_PATTERN = re.compile(r"Year\s*(\d+),\s*Semester\s*(\d+)", re.IGNORECASE)
+UNIT_LOAD = {"Full Time": 4, "Part Time": 2}
+# Extra semesters the generator may use beyond the guide's own length before giving up on a unit
+EXTRA_SEMESTERS = 4
+
+# Per-process state, filled once by init_worker
+_graph = None
+_available = {}    # teaching period -> bitset of the units offered in it
+_feasible = {}     # (unit index, completed & closure of unit) -> prerequisites satisfied
+
+
+def init_worker(graph=None, table=None):
+    global _graph, _available
+    _graph = graph or load_graph()
+    table = table if table is not None else load_table()
+    offered = dict(zip(table["unitCode"].tolist(), table["offered"].tolist()))
+    _available = {}
+    for period, bit in PERIOD_BITS.items():
+        bits = 0
+        for i, code in enumerate(_graph.units):
+            # Units without known offerings are assumed to be available every period
+            mask = offered.get(code, 0)
+            if mask == 0 or mask & bit:
+                bits |= 1 << i
+        _available[period] = bits
+    _feasible.clear()
+
+
+def teaching_period(semester_label, entry_time):
+    # "Year 2, Semester 1" of a July entry falls in the calendar's Semester 2
+    match = SEMESTER_LABEL_PATTERN.search(semester_label)
+    if not match:
+        return None
+    offset = 1 if entry_time == "July" else 0
+    return "Semester 1" if (int(match.group(2)) - 1 + offset) % 2 == 0 else "Semester 2"
+
+
+def _satisfied_bits(expr, completed):
+    if expr is None:
+        return True
+    if isinstance(expr, str):
+        return bool(completed >> _graph.index[expr] & 1)
+    if "other" in expr:
+        return True
+    if "and" in expr:
+        return all(_satisfied_bits(operand, completed) for operand in expr["and"])
+    return any(_satisfied_bits(operand, completed) for operand in expr["or"])
+
+
+def prerequisites_met(i, completed):
+    # Only the units in i's prerequisite chain can change the answer, so they alone form the key
+    key = (i, completed & _graph.closures[i])
+    result = _feasible.get(key)
+    if result is None:
+        result = _feasible[key] = _satisfied_bits(_graph.expressions[_graph.units[i]], completed)
+    return result
+
+
+def external_units(semester_units):
+    # Bitset of every unit in the graph that the guide does not include
+    guide = 0
+    for units in semester_units.values():
+        for unit in units:
+            i = _graph.index.get(unit["code"])
+            if i is not None:
+                guide |= 1 << i
+    return ((1 << len(_graph.units)) - 1) & ~guide
+
+
+def validate_guide(semester_units, entry_time):
+    # Problems with the plan as the course guide lays it out
+    issues = []
+    external = external_units(semester_units)
+    completed = external
+    reported = set()
+    for semester, units in semester_units.items():
+        period = teaching_period(semester, entry_time)
+        taken = 0
+        for unit in units:
+            i = _graph.index.get(unit["code"])
+            if i is None:
+                continue
+            if period and not _available[period] >> i & 1:
+                issues.append({"semester": semester, "unit": unit["code"], "issue": f"not offered in {period}"})
+            outside = [code for code in _graph.prerequisites_of(unit["code"]) if external >> _graph.index[code] & 1]
+            if outside and unit["code"] not in reported:
+                reported.add(unit["code"])
+                issues.append({"semester": semester, "unit": unit["code"], "issue": "external prerequisite",
+                               "prerequisites": outside})
+            if not prerequisites_met(i, completed):
+                issues.append({"semester": semester, "unit": unit["code"], "issue": "prerequisites not met"})
+            taken |= 1 << i
+        completed |= taken
+    return issues
+
+
+def generate_plan(semester_units, entry_time, mode):
+    # Greedy plan over the guide's units: each semester takes the units that are offered and whose
+    # prerequisites are done, preferring those that other remaining units depend on. Prerequisites
+    # outside the guide count as done from the start.
+    order = []
+    for units in semester_units.values():
+        for unit in units:
+            if unit["code"] in _graph.index and unit["code"] not in order:
+                order.append(unit["code"])
+    remaining = [_graph.index[code] for code in order]
+    load = UNIT_LOAD.get(mode, 4)
+    max_semesters = len(semester_units) + EXTRA_SEMESTERS
+    offset = 1 if entry_time == "July" else 0
+
+    plan, completed = [], external_units(semester_units)
+    for semester in range(max_semesters):
+        if not remaining:
+            break
+        period = "Semester 1" if (semester + offset) % 2 == 0 else "Semester 2"
+        candidates = [i for i in remaining if _available[period] >> i & 1 and prerequisites_met(i, completed)]
+        candidates.sort(key=lambda i: -sum(1 for j in remaining if _graph.closures[j] >> i & 1))
+        chosen = candidates[:load]
+        plan.append({
+            "semester": f"Year {semester // 2 + 1}, Semester {semester % 2 + 1}",
+            "teaching_period": period,
+            "units": [_graph.units[i] for i in chosen],
+        })
+        for i in chosen:
+            completed |= 1 << i
+        remaining = [i for i in remaining if i not in chosen]
+    # Semesters at the end where nothing more could be placed are not part of the plan
+    while plan and not plan[-1]["units"]:
+        plan.pop()
+    return plan, [_graph.units[i] for i in remaining]
+
+
+def plan_course(course_code, unit_guide):
+    results = []
+    for block in unit_guide:
+        entry_time = block["mode_entry"].get("entry_time")
+        mode = block["mode_entry"].get("mode")
+        plan, unplaced = generate_plan(block["units"], entry_time, mode)
+        results.append({
+            "mode_entry": block["mode_entry"],
+            "guide_issues": validate_guide(block["units"], entry_time),
+            "plan": plan,
+            "unplaced": unplaced,
+        })
+    return course_code, results
+
+
+def _plan_course_job(job):
+    return plan_course(*job)
+
+
+def plan_all(course_codes=None, workers=None):
+    store = open_enrichment_store()
+    enrichment = store.load_all()
+    jobs = [
+        (code, record["unit_guide"]) for code, record in sorted(enrichment.items())
+        if record.get("unit_guide") and (not course_codes or code in course_codes)
+    ]
+    if not jobs:
+        print("No courses with a unit guide to plan")
+        return {}
+
+    # Build the graph and table once here so workers load them from the cache instead of rebuilding
+    graph, table = load_graph(), load_table()
+    start = time.perf_counter()
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    if workers == 1 or len(jobs) == 1:
+        init_worker(graph, table)
+        results = [_plan_course_job(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+            results = pool.map(_plan_course_job, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+
+    plans = dict(results)
+    issues = 0
+    for course_code, blocks in plans.items():
+        serializer.dump(blocks, os.path.join(OUTPUT_DIR, f"{course_code}.json"), indent=4)
+        issues += sum(len(block["guide_issues"]) for block in blocks)
+    print(f"Planned {len(plans)} courses in {time.perf_counter() - start:.2f}s, "
+          f"{issues} issues found in the course guides. Plans saved to {OUTPUT_DIR}")
+    return plans
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    workers = None
+    if "--workers" in args:
+        position = args.index("--workers")
+        workers = int(args[position + 1])
+        del args[position:position + 2]
+    plan_all({code.upper() for code in args}, workers=workers)
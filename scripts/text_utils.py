@@ -0,0 +1,158 @@
+# Shared text processing for the extractors: precompiled patterns and a fast text normalizer.
+import re
+import unicodedata
+from functools import lru_cache
+
+# Typographic characters replaced with their ASCII equivalents. Chained str.replace calls are
+# used rather than str.translate, which is several times slower on non-ASCII strings in CPython.
+TYPOGRAPHIC_REPLACEMENTS = (
+    ('’', "'"),  # right single quote
+    ('‘', "'"),  # left single quote
+    ('“', '"'),  # left double quote
+    ('”', '"'),  # right double quote
+)
+
+# Unit codes such as ABC123, anywhere in a string or as a whole table cell
+UNIT_CODE_PATTERN = re.compile(r'\b[A-Z]{3}\d{3}\b')
+UNIT_CODE_CELL_PATTERN = re.compile(r'^[A-Z]{3}\d{3}$')
+
+# Prerequisite cleaning
+OR_WORD_PATTERN = re.compile(r'\bor\b', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Course guide text (getPDFInfo.py)
+SPLIT_UNIT_CODE_PATTERN = re.compile(r'([A-Z]{3})\s*\n\s*(\d{3})')
+SEMESTER_TITLE_PATTERN = re.compile(r'Year\s+\d,?\s+Semester\s+\d(?:\s+\(July\))?')
+
+# Prerequisite expressions: unit codes, brackets, the words joining them and any other word
+PREREQ_TOKEN_PATTERN = re.compile(r"\b[A-Z]{3}\d{3}\b|\(|\)|\band\b|\bor\b|,|;|[^\s(),;]+", re.IGNORECASE)
+AND_OR_PATTERN = re.compile(r"\band\s*/\s*or\b", re.IGNORECASE)
+PREREQ_OPERATORS = ("and", "or", ",", ";")
+
+
+def normalize_text(text):
+    # Replace smart quotes and normalize Unicode. Plain ASCII strings, which are most of
+    # the page text, are returned as they are since neither step would change them.
+    if text.isascii():
+        return text
+    for typographic, ascii_char in TYPOGRAPHIC_REPLACEMENTS:
+        text = text.replace(typographic, ascii_char)
+    if text.isascii():
+        return text
+    return unicodedata.normalize('NFKC', text)
+
+
+def find_unit_codes(text):
+    return UNIT_CODE_PATTERN.findall(text)
+
+
+def remove_or_words(text):
+    # Drop the word "or" and collapse the whitespace left behind
+    text = OR_WORD_PATTERN.sub('', text)
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+@lru_cache(maxsize=None)
+def course_structure_pattern(course_code):
+    # Structure headings for one course, e.g. "AB05 - February entry - Full Time" followed by "Semesters"
+    return re.compile(rf'({re.escape(course_code)} - .*?entry - .*?)\s*\n\s*Semesters')
+
+
+def combine_expression(op, operands):
+    # Flatten nested operators of the same kind and drop single-operand wrappers
+    flat = []
+    for operand in operands:
+        if isinstance(operand, dict) and op in operand:
+            flat.extend(operand[op])
+        elif operand is not None:
+            flat.append(operand)
+    if not flat:
+        return None
+    return flat[0] if len(flat) == 1 else {op: flat}
+
+
+def parse_prerequisites(text):
+    # "(IFB104 or IFB130) and IFB105" -> {"and": [{"or": ["IFB104", "IFB130"]}, "IFB105"]}
+    # "and" binds tighter than "or", and commas and semicolons count as "and", so
+    # "IFB104, IFB105 or IFB106" is (IFB104 and IFB105) or IFB106, not a list of three alternatives.
+    # Other words standing between operators are a requirement we cannot check and are kept as an
+    # opaque operand: "Admission to IN01 or IFB104" -> {"or": [{"other": "Admission to IN01"}, "IFB104"]}.
+    # Words next to a unit code or bracket ("Completion of IFB104") only describe it and are dropped,
+    # unless they contain a number, which makes them a requirement of their own joined by "and":
+    # "Completion of 96 credit points including IFB104" -> {"and": [{"other": "..."}, "IFB104"]}.
+    # Returns None when no unit code is mentioned.
+    if not text:
+        return None
+    tokens = []
+    for token in PREREQ_TOKEN_PATTERN.findall(AND_OR_PATTERN.sub("or", text)):
+        if UNIT_CODE_PATTERN.fullmatch(token.upper()):
+            tokens.append(token.upper())
+        elif token.lower() in PREREQ_OPERATORS or token in "()":
+            tokens.append(token.lower())
+        elif tokens and isinstance(tokens[-1], tuple):
+            tokens[-1] = ("other", tokens[-1][1] + " " + token)
+        else:
+            tokens.append(("other", token))
+    if not any(isinstance(token, str) and UNIT_CODE_PATTERN.fullmatch(token) for token in tokens):
+        return None
+    # Keep a phrase where it stands as an operand of its own or mentions a number
+    tokens = [
+        token for i, token in enumerate(tokens)
+        if not isinstance(token, tuple) or any(char.isdigit() for char in token[1]) or (
+            (i == 0 or tokens[i - 1] in PREREQ_OPERATORS + ("(",))
+            and (i == len(tokens) - 1 or tokens[i + 1] in PREREQ_OPERATORS + (")",)))
+    ]
+    # A kept phrase right next to another operand is a further requirement: join them with "and"
+    joined = []
+    for token in tokens:
+        if joined and (isinstance(token, tuple) or isinstance(joined[-1], tuple)) \
+                and joined[-1] not in PREREQ_OPERATORS + ("(",) and token not in PREREQ_OPERATORS + (")",):
+            joined.append("and")
+        joined.append(token)
+    tokens = joined
+    position = 0
+
+    def parse_or():
+        nonlocal position
+        operands = [parse_and()]
+        while position < len(tokens) and tokens[position] == "or":
+            position += 1
+            operands.append(parse_and())
+        return combine_expression("or", operands)
+
+    def parse_and():
+        nonlocal position
+        operands = [parse_atom()]
+        while position < len(tokens) and tokens[position] in ("and", ",", ";"):
+            position += 1
+            operands.append(parse_atom())
+        return combine_expression("and", operands)
+
+    def parse_atom():
+        nonlocal position
+        if position >= len(tokens):
+            return None
+        token = tokens[position]
+        if token == "(":
+            position += 1
+            expr = parse_or()
+            if position < len(tokens) and tokens[position] == ")":
+                position += 1
+            return expr
+        if isinstance(token, tuple):
+            position += 1
+            return {"other": token[1]}
+        if UNIT_CODE_PATTERN.fullmatch(token):
+            position += 1
+            return token
+        # Missing operand (e.g. "ABC123, or ABC124"), leave the operator to the caller
+        return None
+
+    expr = None
+    while position < len(tokens):
+        # Anything left after an unbalanced ")" is joined with "and"
+        start = position
+        expr = combine_expression("and", [expr, parse_or()])
+        if position == start or (position < len(tokens) and tokens[position] == ")"):
+            position += 1
+    return expr
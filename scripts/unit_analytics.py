@@ -0,0 +1,212 @@
+# The purpose of this script is to answer questions across the whole unit catalogue
+# ("average fee by faculty", "units offered in Semester 2") without reparsing every unit file.
+#
+# The raw string fields EUI stores (fees, credit points, faculty/school/study area, offerings) are
+# normalized once into typed NumPy columns and cached in ./cache/unit_table.npz. The cache is rebuilt
+# automatically when the unit records are newer than it. Queries are vectorized over the columns.
+# Teaching periods come from this year's offerings in ./offerings (refreshed by offerings.py between
+# crawls) and fall back to the `overview` a unit file was scraped with when the store has none.
+#
+# Usage:
+#   python scripts/unit_analytics.py build
+#   python scripts/unit_analytics.py fee-by faculty domestic      # sp | domestic | international
+#   python scripts/unit_analytics.py offered "Semester 2" [faculty]
+#   python scripts/unit_analytics.py summary
+import os
+import re
+import sys
+from datetime import datetime
+import numpy as np
+import serializer
+from offerings import open_offerings_store
+from record_store import open_store, writes_packed
+
+UNITS_DIR = "./units"
+TABLE_PATH = "./cache/unit_table.npz"
+
+CATEGORY_FIELDS = ["faculty", "school", "studyArea"]
+FEE_FIELDS = {"sp": "sp_fee", "domestic": "domestic_fee", "international": "international_fee"}
+
+# Teaching periods recognised in the offerings, each one is a bit in the `offered` column
+OFFERING_PERIODS = [
+    ("Semester 1", re.compile(r"semester\s*1", re.IGNORECASE)),
+    ("Semester 2", re.compile(r"semester\s*2", re.IGNORECASE)),
+    ("Summer", re.compile(r"summer", re.IGNORECASE)),
+    ("Winter", re.compile(r"winter", re.IGNORECASE)),
+]
+PERIOD_BITS = {name: 1 << i for i, (name, _) in enumerate(OFFERING_PERIODS)}
+# Fields of an offering record that name its teaching period (e.g. "teachingPeriod", "period_name")
+PERIOD_FIELD_PATTERN = re.compile(r"period", re.IGNORECASE)
+
+FEE_PATTERN = re.compile(r"\$\s*([\d,]+(?:\.\d+)?)")
+NUMBER_PATTERN = re.compile(r"\d+")
+
+
+def parse_fee(text):
+    # "$1,234 (2025)" -> 1234.0, missing or unparseable -> NaN
+    match = FEE_PATTERN.search(text or "")
+    return float(match.group(1).replace(",", "")) if match else np.nan
+
+
+def parse_credit_points(text):
+    match = NUMBER_PATTERN.search(text or "")
+    return int(match.group()) if match else -1
+
+
+def _period_values(value, in_period=False):
+    # Strings held under a teaching-period field, at any depth of an offering record
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _period_values(item, in_period or bool(PERIOD_FIELD_PATTERN.search(key)))
+    elif isinstance(value, list):
+        for item in value:
+            yield from _period_values(item, in_period)
+    elif in_period and isinstance(value, str):
+        yield value
+
+
+def offering_mask(offerings):
+    # Bitmask of the teaching periods a unit is offered in, from the teaching-period field of each
+    # offering record. Records without one fall back to their top-level text fields.
+    if not offerings:
+        return 0
+    mask = 0
+    for record in offerings if isinstance(offerings, list) else [offerings]:
+        if not isinstance(record, dict):
+            continue
+        values = list(_period_values(record)) or [value for value in record.values() if isinstance(value, str)]
+        for value in values:
+            for name, pattern in OFFERING_PERIODS:
+                if pattern.search(value):
+                    mask |= PERIOD_BITS[name]
+    return mask
+
+
+def load_unit_records():
+    if writes_packed():
+        return list(open_store("units").load_all().values())
+    records = []
+    if os.path.exists(UNITS_DIR):
+        for filename in sorted(os.listdir(UNITS_DIR)):
+            if filename.endswith(".json") and not filename.startswith("."):
+                records.append(serializer.load(os.path.join(UNITS_DIR, filename)))
+    return records
+
+
+def current_offerings():
+    # {unitCode: offerings} for this year from the offerings store
+    suffix = f":{datetime.now().year}"
+    return {
+        record["unitCode"]: record["offerings"]
+        for key, record in open_offerings_store().load_all().items() if key.endswith(suffix)
+    }
+
+
+def _index_mtime(store):
+    return os.path.getmtime(store.index_path) if os.path.exists(store.index_path) else 0
+
+
+def source_mtime():
+    # Newest modification time of the unit records and offerings the table is built from
+    offerings_mtime = _index_mtime(open_offerings_store())
+    if writes_packed():
+        return max(_index_mtime(open_store("units")), offerings_mtime)
+    if not os.path.exists(UNITS_DIR):
+        return offerings_mtime
+    return max([os.path.getmtime(UNITS_DIR), offerings_mtime] + [entry.stat().st_mtime for entry in os.scandir(UNITS_DIR)])
+
+
+def build_table(records, offerings=None):
+    # Normalize the raw records into a dict of equal-length NumPy columns. `offerings` maps unit codes
+    # to their stored offerings and takes precedence over the overview embedded in the unit record.
+    records = [r for r in records if r.get("unitCode")]
+    offerings = offerings or {}
+    table = {
+        "unitCode": np.array([r["unitCode"] for r in records], dtype=str),
+        "creditPoints": np.array([parse_credit_points(r.get("creditPoints")) for r in records], dtype=np.int16),
+        "offered": np.array([offering_mask(offerings.get(r["unitCode"], r.get("overview"))) for r in records], dtype=np.uint8),
+    }
+    for name, field in FEE_FIELDS.items():
+        table[f"{name}_fee"] = np.array([parse_fee(r.get(field)) for r in records], dtype=np.float64)
+    for field in CATEGORY_FIELDS:
+        # Categorical column: small integer codes plus the table of distinct values
+        values = np.array([(r.get(field) or "").strip() for r in records], dtype=str)
+        categories, codes = np.unique(values, return_inverse=True)
+        table[field] = codes.astype(np.int32)
+        table[f"{field}_categories"] = categories
+    return table
+
+
+def load_table(rebuild=False):
+    # Cached table, rebuilt when the unit records changed since it was written
+    if not rebuild and os.path.exists(TABLE_PATH) and os.path.getmtime(TABLE_PATH) >= source_mtime():
+        with np.load(TABLE_PATH) as data:
+            return {key: data[key] for key in data.files}
+    table = build_table(load_unit_records(), current_offerings())
+    os.makedirs(os.path.dirname(TABLE_PATH), exist_ok=True)
+    tmp_path = TABLE_PATH + ".tmp.npz"
+    np.savez(tmp_path, **table)
+    os.replace(tmp_path, TABLE_PATH)
+    return table
+
+
+def group_stats(table, by, value):
+    # Mean, count and total of a numeric column per category, ignoring missing values
+    codes = table[by]
+    values = table[value].astype(np.float64)
+    present = ~np.isnan(values)
+    n_groups = len(table[f"{by}_categories"])
+    counts = np.bincount(codes[present], minlength=n_groups)
+    totals = np.bincount(codes[present], weights=values[present], minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = totals / counts
+    return [
+        {by: str(table[f"{by}_categories"][i]) or "(none)", "mean": float(means[i]), "count": int(counts[i]), "total": float(totals[i])}
+        for i in np.argsort(-means) if counts[i]
+    ]
+
+
+def offered_in(table, period, faculty=None):
+    # Unit codes offered in a teaching period, optionally within one faculty
+    mask = (table["offered"] & PERIOD_BITS[period]) != 0
+    if faculty is not None:
+        categories = table["faculty_categories"]
+        matches = np.flatnonzero(np.char.lower(categories) == faculty.lower())
+        mask &= np.isin(table["faculty"], matches)
+    return table["unitCode"][mask].tolist()
+
+
+def summary(table):
+    fees = table["domestic_fee"]
+    return {
+        "units": int(len(table["unitCode"])),
+        "faculties": int(len(table["faculty_categories"])),
+        "with_domestic_fee": int(np.count_nonzero(~np.isnan(fees))),
+        "offered": {name: int(np.count_nonzero(table["offered"] & bit)) for name, bit in PERIOD_BITS.items()},
+    }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "summary"
+
+    if command == "build":
+        table = load_table(rebuild=True)
+        print(f"Built table of {len(table['unitCode'])} units in {TABLE_PATH}")
+    elif command == "fee-by":
+        by = sys.argv[2] if len(sys.argv) > 2 else "faculty"
+        fee = sys.argv[3] if len(sys.argv) > 3 else "domestic"
+        for row in group_stats(load_table(), by, f"{fee}_fee"):
+            print(f"{row[by]:<60} {row['mean']:>10.2f}  ({row['count']} units)")
+    elif command == "offered":
+        period = sys.argv[2] if len(sys.argv) > 2 else "Semester 1"
+        if period not in PERIOD_BITS:
+            print(f"Unknown period '{period}', choose from: {', '.join(PERIOD_BITS)}")
+            sys.exit(1)
+        units = offered_in(load_table(), period, sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"{len(units)} units offered in {period}")
+        print("\n".join(units))
+    elif command == "summary":
+        print(serializer.dumps(summary(load_table()), indent=4).decode("utf-8"))
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
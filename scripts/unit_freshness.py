@@ -0,0 +1,168 @@
+# Decides whether a unit page needs to be fetched again.
+#
+# A unit is fetched at most once per run (run-scoped seen set), and across runs only when
+#   - we have never fetched it,
+#   - its last fetch is older than the TTL (QUT_UNIT_TTL_DAYS, default 30), or
+#   - the PDF of a course that lists it changed since the unit was last fetched.
+# Fetch times and PDF hashes are kept in a small SQLite database so parallel workers can share them.
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import serializer
+
+FRESHNESS_PATH = "./state/freshness.db"
+UNIT_TTL_DAYS = float(os.environ.get("QUT_UNIT_TTL_DAYS", 30))
+
+
+@contextmanager
+def _connect(path=FRESHNESS_PATH):
+    # Open the freshness database, commit on success and always close the connection
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS pdf_hashes (
+            course_code TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS unit_fetches (
+            unit_code TEXT PRIMARY KEY,
+            fetched_at REAL NOT NULL
+        );
+    """)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def record_pdf(course_code, pdf_path, sha256=None, path=FRESHNESS_PATH):
+    # Store the hash of a course PDF. Returns True if it is new or differs from the last one seen.
+    sha256 = sha256 or file_sha256(pdf_path)
+    with _connect(path) as conn:
+        row = conn.execute("SELECT sha256 FROM pdf_hashes WHERE course_code = ?", (course_code,)).fetchone()
+        if row and row[0] == sha256:
+            return False
+        # The first hash we see for a course is not a change, the unit TTL covers older fetches
+        changed_at = time.time() if row else 0
+        conn.execute(
+            "INSERT OR REPLACE INTO pdf_hashes (course_code, sha256, changed_at) VALUES (?, ?, ?)",
+            (course_code, sha256, changed_at))
+    return True
+
+
+def mark_unit_fetched(unit_code, path=FRESHNESS_PATH):
+    with _connect(path) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO unit_fetches (unit_code, fetched_at) VALUES (?, ?)",
+            (unit_code, time.time()))
+
+
+def load_unit_courses(folder="./course_to_unit"):
+    # unit code -> course codes whose PDF lists it
+    unit_courses = {}
+    if not os.path.exists(folder):
+        return unit_courses
+    for filename in os.listdir(folder):
+        # Only the relationship files, not the unit guides
+        if not filename.endswith(".json") or "_" in filename or filename.startswith("."):
+            continue
+        course_code = filename[:-len(".json")]
+        for unit_code in serializer.load(os.path.join(folder, filename)).get("unitCodes", []):
+            unit_courses.setdefault(unit_code, []).append(course_code)
+    return unit_courses
+
+
+class UnitFetchPlanner:
+    def __init__(self, ttl_days=UNIT_TTL_DAYS, path=FRESHNESS_PATH):
+        self.ttl_seconds = ttl_days * 24 * 60 * 60
+        self.path = path
+        self.seen = set()  # Units already handed out in this run
+        self.unit_courses = None
+        self.conn = None
+
+    def _connection(self):
+        # One read connection for the whole run. Plain SELECTs do not hold a transaction open,
+        # so PDF hashes written by other processes are still seen.
+        if self.conn is None:
+            with _connect(self.path):
+                pass  # Create the database and its tables
+            self.conn = sqlite3.connect(self.path, timeout=30)
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _last_fetched(self, conn, unit_code):
+        row = conn.execute("SELECT fetched_at FROM unit_fetches WHERE unit_code = ?", (unit_code,)).fetchone()
+        if row:
+            return row[0]
+        # Units fetched before fetch times were recorded: fall back to the saved record's date
+        unit_file = f"./units/{unit_code}.json"
+        if os.path.exists(unit_file):
+            day_obtained = serializer.load(unit_file).get("day_obtained")
+            if day_obtained:
+                return datetime.strptime(day_obtained, "%Y-%m-%d").timestamp()
+        return None
+
+    def _load_unit_courses(self):
+        if self.unit_courses is None:
+            self.unit_courses = load_unit_courses()
+        return self.unit_courses
+
+    def needs_refresh(self, unit_code):
+        # Freshness check across runs, ignoring the run-scoped seen set
+        conn = self._connection()
+        fetched_at = self._last_fetched(conn, unit_code)
+        if fetched_at is None:
+            return True
+        if time.time() - fetched_at > self.ttl_seconds:
+            return True
+
+        courses = self._load_unit_courses().get(unit_code, [])
+        if courses:
+            placeholders = ",".join("?" * len(courses))
+            row = conn.execute(
+                f"SELECT MAX(changed_at) FROM pdf_hashes WHERE course_code IN ({placeholders})",
+                courses).fetchone()
+            if row[0] is not None and row[0] > fetched_at:
+                return True
+        return False
+
+    def should_fetch(self, unit_code):
+        # True the first time a stale unit is seen in this run, False for every later sighting.
+        # A unit found fresh is not remembered: a course listed later may have a changed PDF.
+        if unit_code in self.seen:
+            return False
+        if self.needs_refresh(unit_code):
+            self.seen.add(unit_code)
+            return True
+        return False
+
+    def add_course(self, course_code, unit_codes):
+        # Record the units a freshly parsed course PDF lists, without re-reading every other course
+        unit_courses = self._load_unit_courses()
+        for unit_codes_of in unit_courses.values():
+            if course_code in unit_codes_of:
+                unit_codes_of.remove(course_code)
+        for unit_code in unit_codes:
+            unit_courses.setdefault(unit_code, []).append(course_code)
+
+    def reload_unit_courses(self):
+        # Forget the cached unit -> course mapping, it is read again on the next check
+        self.unit_courses = None
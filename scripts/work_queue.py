@@ -0,0 +1,487 @@
+# Shared work queue for running the pipeline from several worker processes or machines.
+#
+# Tasks ("course", "pdf", "unit") are leased to one worker at a time and must be acked when done.
+# A lease that is not acked before it expires (crashed or killed worker) is handed out again.
+# The queue also coordinates a minimum interval between requests to each host across every
+# worker, so scaling out does not multiply the load on QUT.
+#
+# Backends:
+#   sqlite (default)  a single database file, fine for many processes on one machine or a shared disk
+#   redis             set QUT_QUEUE_BACKEND=redis and QUT_REDIS_URL, needs the `redis` package
+#
+# Usage:
+#   python scripts/work_queue.py smoke     # check both backends, redis against an in-memory stand-in
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import serializer
+
+try:
+    import redis
+    WatchError = redis.WatchError
+except ImportError:
+    redis = None
+
+    class WatchError(Exception):
+        pass
+
+QUEUE_PATH = "./state/work_queue.db"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+
+# Minimum seconds between two requests to the same host, shared by all workers
+HOST_INTERVALS = {
+    "www.qut.edu.au": 2.0,
+    "pdf.courses.qut.edu.au": 1.0,
+}
+DEFAULT_HOST_INTERVAL = 2.0
+
+
+def host_interval(host):
+    return HOST_INTERVALS.get(host, DEFAULT_HOST_INTERVAL)
+
+
+class SQLiteQueue:
+    def __init__(self, path=QUEUE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # isolation_level=None lets us issue BEGIN IMMEDIATE ourselves to take the write lock up front
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                lease_until REAL NOT NULL DEFAULT 0,
+                lease_token TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                UNIQUE(kind, key)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_state ON tasks(state, lease_until);
+            CREATE TABLE IF NOT EXISTS host_slots (
+                host TEXT PRIMARY KEY,
+                next_allowed REAL NOT NULL
+            );
+        """)
+
+    def enqueue(self, kind, key, payload=None, requeue=False):
+        # Add a task. A (kind, key) pair is only queued once unless requeue is set, which
+        # resets a finished or failed task back to pending.
+        payload_text = serializer.dumps(payload or {}).decode("utf-8")
+        if requeue:
+            cursor = self.conn.execute(
+                "INSERT INTO tasks (kind, key, payload) VALUES (?, ?, ?) "
+                "ON CONFLICT(kind, key) DO UPDATE SET payload = excluded.payload, state = 'pending', "
+                "attempts = 0, error = NULL WHERE state IN ('done', 'failed')",
+                (kind, key, payload_text))
+        else:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO tasks (kind, key, payload) VALUES (?, ?, ?)",
+                (kind, key, payload_text))
+        return cursor.rowcount > 0
+
+    def lease(self, kinds=None, lease_seconds=LEASE_SECONDS):
+        # Hand the oldest pending (or expired) task to the caller. Returns None when there is no work.
+        now = time.time()
+        token = uuid.uuid4().hex
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases that used up their attempts fail instead of being handed out again
+            self.conn.execute(
+                "UPDATE tasks SET state = 'failed', lease_until = 0, error = 'lease expired' "
+                "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS))
+            query = ("SELECT id, kind, key, payload, attempts FROM tasks "
+                     "WHERE (state = 'pending' OR (state = 'leased' AND lease_until < ?))")
+            params = [now]
+            if kinds:
+                query += f" AND kind IN ({','.join('?' * len(kinds))})"
+                params.extend(kinds)
+            row = self.conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            task_id, kind, key, payload, attempts = row
+            self.conn.execute(
+                "UPDATE tasks SET state = 'leased', lease_until = ?, lease_token = ?, attempts = attempts + 1 WHERE id = ?",
+                (now + lease_seconds, token, task_id))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return {"id": task_id, "kind": kind, "key": key, "payload": serializer.loads(payload),
+                "attempts": attempts + 1, "token": token}
+
+    def ack(self, task):
+        # Mark a leased task as done. Ignored if the lease expired and another worker took it over.
+        self.conn.execute(
+            "UPDATE tasks SET state = 'done', error = NULL WHERE id = ? AND lease_token = ?",
+            (task["id"], task["token"]))
+
+    def nack(self, task, error=None):
+        # Give a task back. It is retried until it has been attempted MAX_ATTEMPTS times.
+        state = "failed" if task["attempts"] >= MAX_ATTEMPTS else "pending"
+        self.conn.execute(
+            "UPDATE tasks SET state = ?, lease_until = 0, error = ? WHERE id = ? AND lease_token = ?",
+            (state, error, task["id"], task["token"]))
+
+    def reserve_host_slot(self, host):
+        # Reserve the next request slot for a host and return how long to sleep before using it
+        interval = host_interval(host)
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT next_allowed FROM host_slots WHERE host = ?", (host,)).fetchone()
+            slot = max(now, row[0] if row else now)
+            self.conn.execute(
+                "INSERT INTO host_slots (host, next_allowed) VALUES (?, ?) "
+                "ON CONFLICT(host) DO UPDATE SET next_allowed = excluded.next_allowed",
+                (host, slot + interval))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return slot - now
+
+    def stats(self):
+        rows = self.conn.execute("SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state").fetchall()
+        stats = {}
+        for kind, state, count in rows:
+            stats.setdefault(kind, {})[state] = count
+        return stats
+
+
+class RedisQueue:
+    # Same interface as SQLiteQueue on top of a Redis-compatible server.
+    #   {prefix}:task:{kind}:{key}  hash with payload, state, attempts, token
+    #   {prefix}:pending            list of task ids waiting to be leased
+    #   {prefix}:leased             sorted set of task ids scored by lease expiry
+    #   {prefix}:host:{host}        next allowed request time for the host
+    def __init__(self, url=None, prefix="qut", client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("The redis package is not installed, use the sqlite queue backend")
+            client = redis.Redis.from_url(url or os.environ.get("QUT_REDIS_URL", "redis://localhost:6379/0"))
+        self.client = client
+        self.prefix = prefix
+
+    def _task_key(self, task_id):
+        return f"{self.prefix}:task:{task_id}"
+
+    def enqueue(self, kind, key, payload=None, requeue=False):
+        task_id = f"{kind}:{key}"
+        task_key = self._task_key(task_id)
+        fields = {"kind": kind, "key": key, "payload": serializer.dumps(payload or {}),
+                  "state": "pending", "attempts": 0}
+        if not self.client.hsetnx(task_key, "state", "pending"):
+            state = self.client.hget(task_key, "state")
+            if not requeue or state not in (b"done", b"failed"):
+                return False
+        self.client.hset(task_key, mapping=fields)
+        self.client.rpush(f"{self.prefix}:pending", task_id)
+        return True
+
+    def _requeue_expired(self):
+        expired = self.client.zrangebyscore(f"{self.prefix}:leased", 0, time.time())
+        for task_id in expired:
+            # Only the worker that removes the entry puts it back, so it is not queued twice
+            if not self.client.zrem(f"{self.prefix}:leased", task_id):
+                continue
+            task_id = task_id.decode("utf-8") if isinstance(task_id, bytes) else task_id
+            task_key = self._task_key(task_id)
+            # Clearing the token ends the old lease: its holder can no longer ack or nack it
+            if int(self.client.hget(task_key, "attempts") or 0) >= MAX_ATTEMPTS:
+                self.client.hset(task_key, mapping={"state": "failed", "token": "", "error": "lease expired"})
+            else:
+                self.client.hset(task_key, mapping={"state": "pending", "token": ""})
+                self.client.rpush(f"{self.prefix}:pending", task_id)
+
+    def _claim(self, task_id, kind, lease_seconds):
+        # Lease a task taken off the pending list. Returns None when it is no longer pending (a stale
+        # entry) or another worker claimed it first.
+        task_key = self._task_key(task_id)
+        token = uuid.uuid4().hex
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(task_key)
+                if pipe.hget(task_key, "state") != b"pending":
+                    return None
+                pipe.multi()
+                pipe.hincrby(task_key, "attempts", 1)
+                pipe.hset(task_key, mapping={"state": "leased", "token": token})
+                pipe.zadd(f"{self.prefix}:leased", {task_id: time.time() + lease_seconds})
+                pipe.hgetall(task_key)
+                attempts, _, _, data = pipe.execute()
+            except WatchError:
+                return None
+        return {"id": task_id, "kind": kind, "key": data[b"key"].decode("utf-8"),
+                "payload": serializer.loads(data[b"payload"]), "attempts": attempts, "token": token}
+
+    def lease(self, kinds=None, lease_seconds=LEASE_SECONDS):
+        self._requeue_expired()
+        skipped = []
+        task = None
+        while task is None:
+            task_id = self.client.lpop(f"{self.prefix}:pending")
+            if task_id is None:
+                break
+            task_id = task_id.decode("utf-8") if isinstance(task_id, bytes) else task_id
+            kind = task_id.split(":", 1)[0]
+            if kinds and kind not in kinds:
+                skipped.append(task_id)
+                continue
+            task = self._claim(task_id, kind, lease_seconds)
+        # Tasks of other kinds go back to the front in their original order
+        for task_id in reversed(skipped):
+            self.client.lpush(f"{self.prefix}:pending", task_id)
+        return task
+
+    def _owns(self, task):
+        token = self.client.hget(self._task_key(task["id"]), "token")
+        return token is not None and token.decode("utf-8") == task["token"]
+
+    def ack(self, task):
+        if self._owns(task):
+            self.client.zrem(f"{self.prefix}:leased", task["id"])
+            self.client.hset(self._task_key(task["id"]), "state", "done")
+
+    def nack(self, task, error=None):
+        # Only the worker that removes the lease entry gives the task back; when it is gone the
+        # lease expired and the task was already requeued
+        if not self._owns(task) or not self.client.zrem(f"{self.prefix}:leased", task["id"]):
+            return
+        if task["attempts"] >= MAX_ATTEMPTS:
+            self.client.hset(self._task_key(task["id"]), mapping={"state": "failed", "error": error or ""})
+        else:
+            self.client.hset(self._task_key(task["id"]), mapping={"state": "pending", "error": error or ""})
+            self.client.rpush(f"{self.prefix}:pending", task["id"])
+
+    def reserve_host_slot(self, host):
+        interval = host_interval(host)
+        slot_key = f"{self.prefix}:host:{host}"
+        # Optimistic transaction: retry if another worker reserved a slot in between
+        while True:
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(slot_key)
+                    now = time.time()
+                    current = pipe.get(slot_key)
+                    slot = max(now, float(current) if current else now)
+                    pipe.multi()
+                    pipe.set(slot_key, slot + interval)
+                    pipe.execute()
+                    return slot - now
+                except WatchError:
+                    continue
+
+    def stats(self):
+        stats = {}
+        for task_key in self.client.scan_iter(f"{self.prefix}:task:*"):
+            kind, state = self.client.hmget(task_key, "kind", "state")
+            kind, state = kind.decode("utf-8"), state.decode("utf-8")
+            stats.setdefault(kind, {})
+            stats[kind][state] = stats[kind].get(state, 0) + 1
+        return stats
+
+
+def open_queue():
+    # Pick the backend from QUT_QUEUE_BACKEND (sqlite or redis)
+    backend = os.environ.get("QUT_QUEUE_BACKEND", "sqlite").lower()
+    if backend == "redis":
+        return RedisQueue()
+    return SQLiteQueue(os.environ.get("QUT_QUEUE_PATH", QUEUE_PATH))
+
+
+# ---- smoke test ----
+
+def _b(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+class LocalRedis:
+    # In-memory stand-in for the Redis commands RedisQueue uses, for the smoke test
+    def __init__(self):
+        self.data = {}
+        self.versions = {}
+        self.lock = threading.RLock()
+
+    def _touch(self, key):
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = _b(value)
+            self._touch(key)
+
+    def hsetnx(self, key, field, value):
+        with self.lock:
+            fields = self.data.setdefault(key, {})
+            if _b(field) in fields:
+                return 0
+            fields[_b(field)] = _b(value)
+            self._touch(key)
+            return 1
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(_b(field))
+
+    def hmget(self, key, *fields):
+        return [self.hget(key, field) for field in fields]
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self.lock:
+            fields = self.data.setdefault(key, {})
+            for name, item in ({field: value} if field is not None else mapping).items():
+                fields[_b(name)] = _b(item)
+            self._touch(key)
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            value = int(self.hget(key, field) or 0) + amount
+            self.hset(key, field, value)
+            return value
+
+    def rpush(self, key, value):
+        with self.lock:
+            self.data.setdefault(key, []).append(_b(value))
+            self._touch(key)
+
+    def lpush(self, key, value):
+        with self.lock:
+            self.data.setdefault(key, []).insert(0, _b(value))
+            self._touch(key)
+
+    def lpop(self, key):
+        with self.lock:
+            items = self.data.get(key)
+            if not items:
+                return None
+            self._touch(key)
+            return items.pop(0)
+
+    def zadd(self, key, scores):
+        with self.lock:
+            self.data.setdefault(key, {}).update({_b(member): score for member, score in scores.items()})
+            self._touch(key)
+
+    def zrem(self, key, member):
+        with self.lock:
+            removed = self.data.get(key, {}).pop(_b(member), None) is not None
+            if removed:
+                self._touch(key)
+            return int(removed)
+
+    def zrangebyscore(self, key, low, high):
+        return [member for member, score in sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+                if low <= score <= high]
+
+    def scan_iter(self, pattern):
+        prefix = pattern.rstrip("*")
+        return [key for key in list(self.data) if key.startswith(prefix)]
+
+    def pipeline(self):
+        return _LocalPipeline(self)
+
+
+class _LocalPipeline:
+    # WATCH/MULTI/EXEC: commands run immediately until multi(), then are queued for execute()
+    def __init__(self, client):
+        self.client = client
+        self.watched = {}
+        self.queued = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.watched, self.queued = {}, None
+
+    def watch(self, *keys):
+        self.watched.update({key: self.client.versions.get(key, 0) for key in keys})
+
+    def multi(self):
+        self.queued = []
+
+    def execute(self):
+        with self.client.lock:
+            if any(self.client.versions.get(key, 0) != version for key, version in self.watched.items()):
+                raise WatchError()
+            results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.queued]
+        self.watched, self.queued = {}, None
+        return results
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+        if self.queued is None:
+            return command
+        return lambda *args, **kwargs: self.queued.append((name, args, kwargs))
+
+
+def smoke(queue):
+    # Lease/ack behaviour every backend must have. Returns the list of failed checks.
+    failures = []
+
+    def check(name, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if not ok:
+            failures.append(name)
+
+    check("enqueue once", queue.enqueue("unit", "A", {"unitCode": "A"}) and not queue.enqueue("unit", "A"))
+    expired = queue.lease(lease_seconds=-1)
+    retaken = queue.lease()
+    check("expired lease is handed out again", retaken is not None and retaken["key"] == "A" and retaken["attempts"] == 2)
+    queue.nack(expired, error="late")
+    check("nack of an expired lease does not queue the task twice", queue.lease() is None)
+    queue.ack(expired)
+    queue.ack(retaken)
+    check("ack by the current holder", queue.stats().get("unit") == {"done": 1})
+
+    queue.enqueue("unit", "B")
+    for _ in range(MAX_ATTEMPTS):
+        queue.lease(lease_seconds=-1)
+    check(f"expired lease fails after {MAX_ATTEMPTS} attempts", queue.lease() is None and queue.stats()["unit"].get("failed") == 1)
+
+    queue.enqueue("course", "C")
+    queue.enqueue("unit", "D")
+    task = queue.lease(kinds=["unit"])
+    check("lease only the kinds asked for", task is not None and task["key"] == "D")
+    queue.nack(task, error="retry")
+    task = queue.lease()
+    check("other kinds keep their place", task is not None and task["key"] == "C")
+    queue.ack(task)
+
+    first, second = queue.reserve_host_slot("example.org"), queue.reserve_host_slot("example.org")
+    check("host slots are spaced", second - first >= host_interval("example.org") - 0.1)
+    return failures
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "smoke":
+        directory = tempfile.mkdtemp()
+        try:
+            print("sqlite")
+            failures = smoke(SQLiteQueue(os.path.join(directory, "queue.db")))
+            print("redis (local stand-in)")
+            failures += smoke(RedisQueue(client=LocalRedis()))
+        finally:
+            shutil.rmtree(directory)
+        print(f"{len(failures)} checks failed" if failures else "All checks passed")
+        sys.exit(1 if failures else 0)
+    print("Usage: python scripts/work_queue.py smoke")
+    sys.exit(1)
@@ -0,0 +1,172 @@
+# The purpose of this script is to run the scraping pipeline as a pool of workers that pull
+# course, PDF and unit tasks from a shared queue (see work_queue.py). Start as many workers as
+# you like, on one machine or several sharing the queue, they coordinate their request rate per host.
+#
+# Usage:
+#   python scripts/worker.py enqueue            # queue every course in courses.json
+#   python scripts/worker.py run                # work on any task kind
+#   python scripts/worker.py run unit           # only work on unit tasks
+#   python scripts/worker.py stats
+import os
+import subprocess
+import sys
+import time
+import serializer
+from rate_control import get_controller, read_statuses
+from page_changes import verified_since
+from work_queue import open_queue
+from unit_freshness import UnitFetchPlanner
+from offerings import mark_pipeline_run
+import profiling
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stop a worker after it has found no work for this many seconds
+IDLE_EXIT_SECONDS = 60
+POLL_SECONDS = 5
+
+# Units this worker has already considered in this run
+planner = UnitFetchPlanner()
+rates = get_controller()
+
+
+def run_stage(script_name, *args):
+    # Run one of the stage scripts the same way main.py does. The spiders exit 0 when their page
+    # answered 429/503 and only report the status, so a run whose page asked us to back off fails:
+    # the host's shared cooldown is recorded and the task is given back to the queue.
+    result = subprocess.run(
+        [sys.executable, os.path.join(SCRIPTS_DIR, script_name), *args],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    output = result.stdout.decode(errors='replace')
+    if result.returncode == 0:
+        print(f"Script {script_name} completed successfully with args: {args}")
+        print(output)
+    else:
+        print(f"Script {script_name} failed with error code {result.returncode} and args: {args}")
+        print(result.stderr.decode(errors='replace'))
+
+    backed_off = False
+    for reported in read_statuses(output):
+        backed_off = rates.record(reported["host"], reported["latency"], status=reported["status"],
+                                  error=reported["error"], retry_after=reported["retry_after"]) or backed_off
+    if backed_off:
+        print(f"Script {script_name} was asked to back off, giving the task back")
+    return result.returncode == 0 and not backed_off
+
+
+def wait_for_host(queue, host, requests=1):
+    # Take `requests` globally coordinated slots for the host and sleep until the last one, then
+    # wait out any cooldown a 429/503 put on the host (shared by every process through rate_control)
+    delay = 0
+    for _ in range(requests):
+        delay = queue.reserve_host_slot(host)
+    if delay > 0:
+        time.sleep(delay)
+    rates.wait_sync(host)
+
+
+def handle_course(queue, task):
+    course_code = task["payload"]["courseCode"]
+    wait_for_host(queue, "www.qut.edu.au")
+    started = time.time()
+    if not run_stage("ECI.py", course_code, task["payload"]["course_title"]):
+        return False
+
+    # Queue the PDF once the course page has given us its identifier. The record must come from this
+    # run: written now, or found unchanged and verified now. A file left by an earlier run does not count.
+    course_file = f"./courses/{course_code}.json"
+    # (a second of slack for file systems with coarse timestamps)
+    written = os.path.exists(course_file) and os.path.getmtime(course_file) >= started - 1
+    if not written and not (os.path.exists(course_file) and verified_since(course_code, started - 1)):
+        print(f"No course record for {course_code} from this run")
+        return False
+    identifier = serializer.load(course_file).get("identifier")
+    if identifier:
+        queue.enqueue("pdf", course_code, {"course_code": course_code, "identifier": identifier}, requeue=True)
+    return True
+
+
+def handle_pdf(queue, task):
+    course_code = task["payload"]["course_code"]
+    identifier = task["payload"]["identifier"]
+    wait_for_host(queue, "pdf.courses.qut.edu.au")
+    if not run_stage("download_pdf.py", course_code, identifier):
+        return False
+    if not run_stage("EUFC.py", course_code, identifier):
+        return False
+
+    # Queue the units found in the PDF that need fetching. Units shared between courses are only
+    # queued once, and units fetched in an earlier run are requeued only when they are stale.
+    relationship_file = f"./course_to_unit/{course_code}.json"
+    if os.path.exists(relationship_file):
+        unit_codes = serializer.load(relationship_file).get("unitCodes", [])
+        planner.add_course(course_code, unit_codes)
+        for unit_code in unit_codes:
+            if planner.should_fetch(unit_code):
+                queue.enqueue("unit", unit_code, {"unitCode": unit_code}, requeue=True)
+    return True
+
+
+def handle_unit(queue, task):
+    # The unit page and the offerings call both go to www.qut.edu.au
+    wait_for_host(queue, "www.qut.edu.au", requests=2)
+    return run_stage("EUI.py", task["payload"]["unitCode"])
+
+
+HANDLERS = {
+    "course": handle_course,
+    "pdf": handle_pdf,
+    "unit": handle_unit,
+}
+
+
+def enqueue_courses(queue, courses_file="courses.json"):
+    data = serializer.load(courses_file)
+    added = 0
+    for course in data["list_of_courses"]:
+        if queue.enqueue("course", course["courseCode"], course, requeue=True):
+            added += 1
+    print(f"Queued {added} courses from {courses_file}")
+
+
+def run_worker(queue, kinds=None):
+    idle_since = time.time()
+    while True:
+        task = queue.lease(kinds=kinds)
+        if task is None:
+            if time.time() - idle_since > IDLE_EXIT_SECONDS:
+                print("No more work, worker exiting")
+                return
+            time.sleep(POLL_SECONDS)
+            continue
+
+        idle_since = time.time()
+        print(f"Working on {task['kind']} {task['key']} (attempt {task['attempts']})")
+        try:
+            if HANDLERS[task["kind"]](queue, task):
+                queue.ack(task)
+            else:
+                queue.nack(task, error="stage script failed")
+        except Exception as e:
+            print(f"An error occurred while working on {task['kind']} {task['key']}: {e}")
+            queue.nack(task, error=str(e))
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+    queue = open_queue()
+
+    if command == "enqueue":
+        enqueue_courses(queue, sys.argv[2] if len(sys.argv) > 2 else "courses.json")
+    elif command == "run":
+        # One profiling summary over the stage scripts this worker ran (QUT_PROFILE)
+        profiling.aggregate_run_at_exit()
+        # Unit tasks write offerings, so offerings.py refresh leaves the store uncompacted meanwhile
+        mark_pipeline_run()
+        run_worker(queue, kinds=sys.argv[2:] or None)
+    elif command == "stats":
+        print(serializer.dumps(queue.stats(), indent=4).decode("utf-8"))
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)